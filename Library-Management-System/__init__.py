@@ -9,5 +9,10 @@ from .member import Member
 from .librarian import Librarian
 from .borrow_transaction import BorrowTransaction
 from .library import Library
+from .sqlite_library import SQLiteLibrary
+from .concurrent_library import ConcurrentLibrary
+from .sharded_library import ShardedLibrary
+from .library_server import LibraryServer, LibraryClient
+from .query import F, Query
 
-__all__ = ['Book', 'Member', 'Librarian', 'BorrowTransaction', 'Library']
+__all__ = ['Book', 'Member', 'Librarian', 'BorrowTransaction', 'Library', 'SQLiteLibrary', 'ConcurrentLibrary', 'ShardedLibrary', 'LibraryServer', 'LibraryClient', 'F', 'Query']
@@ -0,0 +1,83 @@
+import gzip
+import json
+import os
+from datetime import timedelta
+from borrow_transaction import BorrowTransaction
+
+SEGMENT_PREFIX = "transactions-"
+SEGMENT_SUFFIX = ".jsonl.gz"
+
+def month_of(date):
+    return f"{date.year:04d}-{date.month:02d}"
+
+class TransactionArchive:
+    """Returned transactions moved out of a library, one gzip JSON-lines segment per borrow month.
+
+    Segments are appended to as gzip members, so archiving more history
+    never rewrites what is already on disk. Nothing is read until a
+    history query asks for the months a segment covers.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, month):
+        return os.path.join(self.directory, SEGMENT_PREFIX + month + SEGMENT_SUFFIX)
+
+    def months(self):
+        """Months with a segment, oldest first, as 'YYYY-MM' strings"""
+        names = os.listdir(self.directory)
+        return sorted(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)] for name in names
+                      if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX))
+
+    def append(self, transactions):
+        """Add transactions to the segments of their borrow months; returns the number written
+
+        Transactions a segment already holds are skipped, so archiving again
+        from a library reloaded from a save made before the last archive run
+        does not duplicate them.
+        """
+        by_month = {}
+        for transaction in transactions:
+            by_month.setdefault(month_of(transaction.borrow_date), []).append(transaction)
+        written = 0
+        for month, batch in by_month.items():
+            if os.path.exists(self.path(month)):
+                archived = self.ids(month)
+                batch = [transaction for transaction in batch if transaction.transaction_id not in archived]
+            if not batch:
+                continue
+            written += len(batch)
+            with open(self.path(month), 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='ab') as f:
+                    for transaction in batch:
+                        f.write(json.dumps(transaction.to_dict()).encode() + b"\n")
+                raw.flush()
+                os.fsync(raw.fileno())
+        return written
+
+    def ids(self, month):
+        """Ids of the transactions in one month's segment"""
+        with gzip.open(self.path(month), 'rb') as f:
+            return {json.loads(line)['transaction_id'] for line in f}
+
+    def read(self, month):
+        """Yield the transactions of one month's segment"""
+        with gzip.open(self.path(month), 'rb') as f:
+            for line in f:
+                yield BorrowTransaction.from_dict(json.loads(line))
+
+    def scan(self, start=None, end=None):
+        """Yield archived transactions borrowed in [start, end), reading only the segments that overlap"""
+        first = month_of(start) if start is not None else None
+        last = month_of(end - timedelta(microseconds=1)) if end is not None else None  # end is exclusive
+        for month in self.months():
+            if (first is not None and month < first) or (last is not None and month > last):
+                continue
+            for transaction in self.read(month):
+                if (start is None or transaction.borrow_date >= start) and (end is None or transaction.borrow_date < end):
+                    yield transaction
+
+    def __len__(self):
+        return sum(1 for month in self.months() for _ in self.read(month))
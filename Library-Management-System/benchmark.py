@@ -0,0 +1,816 @@
+#!/usr/bin/env python3
+"""
+Benchmark script for Library Management System
+"""
+
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from itertools import islice
+from datetime import datetime, timedelta
+from library import Library
+from book import Book
+from member import Member
+from librarian import Librarian
+from borrow_transaction import BorrowTransaction
+from transaction_store import TransactionStore
+from sqlite_library import SQLiteLibrary
+from concurrent_library import ConcurrentLibrary
+from sharded_library import ShardedLibrary
+from library_server import LibraryClient
+import asyncio
+import overdue
+from query import F
+from field_index import FieldIndex
+from book import normalize_author
+from collections import namedtuple
+from datagen import LibraryGenerator
+from codec import available_codecs
+import platform
+
+def build_history(library, history_size):
+    """Fill a library with closed transactions spread over a pool of books"""
+    start = datetime(2020, 1, 1)
+    book_count = len(library.books)
+    member_count = len(library.members)
+    for transaction_id in range(1, history_size + 1):
+        borrow_date = start + timedelta(minutes=transaction_id)
+        transaction = BorrowTransaction(
+            transaction_id,
+            transaction_id % book_count + 1,
+            transaction_id % member_count + 1,
+            1,
+            borrow_date,
+            return_date=borrow_date + timedelta(days=7)
+        )
+        library.transactions[transaction_id] = transaction
+    library.next_transaction_id = history_size + 1
+
+def make_library(book_count=1000, member_count=100, library_class=Library):
+    """Create a library with generated books, members and one librarian"""
+    library = library_class("Benchmark Library")
+    library.add_librarian(Librarian(1, "Bench Librarian", "bench@library.com"))
+    for book_id in range(1, book_count + 1):
+        library.add_book(Book(book_id, f"Title {book_id}", f"Author {book_id % 97}", f"isbn-{book_id}", 1900 + book_id % 120))
+    for member_id in range(1, member_count + 1):
+        library.add_member(Member(member_id, f"Member {member_id}", f"m{member_id}@bench.com", "555-0000"))
+    return library
+
+def bench_return_latency(history_sizes, rounds=1000):
+    """Time return_book against a growing transaction history"""
+    print("=== Return latency vs. transaction history ===")
+    for history_size in history_sizes:
+        library = make_library()
+        build_history(library, history_size)
+        for i in range(rounds):
+            library.borrow_book(i % 100 + 1, i % 1000 + 1, 1)
+
+        start = time.perf_counter()
+        for i in range(rounds):
+            library.return_book(i % 100 + 1, i % 1000 + 1)
+        elapsed = time.perf_counter() - start
+
+        print(f"  history={history_size:>10,}  return_book: {elapsed / rounds * 1e6:8.2f} us/op")
+
+def linear_search(library, query):
+    """The original full-scan search, kept as a baseline"""
+    query = query.lower()
+    return [book for book in library.books.values()
+            if query in book.title.lower() or query in book.author.lower() or query in book.isbn.lower()]
+
+def bench_search(book_counts, queries=("title 4242", "author 57", "isbn-999", "tle 31", "zzz")):
+    """Time indexed search_books against the linear scan"""
+    print("=== search_books: index vs. linear scan ===")
+    for book_count in book_counts:
+        library = make_library(book_count=book_count)
+
+        start = time.perf_counter()
+        for query in queries:
+            linear_search(library, query)
+        scan_time = (time.perf_counter() - start) / len(queries)
+
+        start = time.perf_counter()
+        for query in queries:
+            library.search_books(query, limit=20)
+        index_time = (time.perf_counter() - start) / len(queries)
+
+        print(f"  books={book_count:>10,}  scan: {scan_time * 1e3:8.2f} ms/query  index: {index_time * 1e3:8.2f} ms/query")
+
+def write_library_file(filename, book_count, transaction_count):
+    """Write a large library JSON file record by record, without building it in memory"""
+    start = datetime(2015, 1, 1)
+    with open(filename, 'w') as f:
+        f.write('{"name": "Benchmark Library",\n"books": [\n')
+        for book_id in range(1, book_count + 1):
+            book = Book(book_id, f"Title {book_id}", f"Author {book_id % 97}", f"isbn-{book_id}", 1900 + book_id % 120)
+            f.write(("," if book_id > 1 else "") + json.dumps(book.to_dict()) + "\n")
+        f.write('],\n"members": [')
+        f.write(json.dumps(Member(1, "Bench Member", "m1@bench.com", "555-0000").to_dict()))
+        f.write('],\n"librarians": [')
+        f.write(json.dumps(Librarian(1, "Bench Librarian", "bench@library.com").to_dict()))
+        f.write('],\n"transactions": [\n')
+        for transaction_id in range(1, transaction_count + 1):
+            borrow_date = start + timedelta(minutes=transaction_id)
+            returned = transaction_id % 50 != 0
+            transaction = BorrowTransaction(transaction_id, transaction_id % book_count + 1, 1, 1, borrow_date,
+                                            return_date=borrow_date + timedelta(days=7) if returned else None)
+            f.write(("," if transaction_id > 1 else "") + json.dumps(transaction.to_dict()) + "\n")
+        f.write('],\n"next_ids": {"book": %d, "member": 2, "librarian": 2, "transaction": %d}}\n'
+                % (book_count + 1, transaction_count + 1))
+
+def load_with_json_load(library, filename):
+    """The original whole-document loader, kept as a baseline"""
+    with open(filename, 'r') as f:
+        data = json.load(f)
+    library._install(
+        data['name'],
+        {d['book_id']: Book.from_dict(d) for d in data['books']},
+        {d['member_id']: Member.from_dict(d) for d in data['members']},
+        {d['librarian_id']: Librarian.from_dict(d) for d in data['librarians']},
+        {d['transaction_id']: BorrowTransaction.from_dict(d) for d in data['transactions']},
+        data['next_ids']
+    )
+
+def load_child(filename, mode):
+    """Load a file in this process and report time and peak RSS"""
+    library = Library("Load Benchmark")
+    start = time.perf_counter()
+    if mode == "json":
+        load_with_json_load(library, filename)
+    elif mode == "stream":
+        library.load_from_file(filename)
+    elif mode == "kiosk":
+        library.load_from_file(filename, sections=['books', 'transactions'], active_only=True)
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{elapsed:.3f} {peak_mb:.1f}")
+
+def bench_load(transaction_counts, book_count=100_000):
+    """Compare load time and peak RSS of json.load, the streaming loader and a kiosk partial load"""
+    print("=== load_from_file: json.load vs. streaming ===")
+    directory = tempfile.mkdtemp()
+    for transaction_count in transaction_counts:
+        filename = os.path.join(directory, f"library_{transaction_count}.json")
+        write_library_file(filename, book_count, transaction_count)
+        size_mb = os.path.getsize(filename) / 1e6
+        for mode in ("json", "stream", "kiosk"):
+            output = subprocess.run([sys.executable, __file__, "load-child", filename, mode],
+                                    capture_output=True, text=True, check=True).stdout.split()
+            print(f"  file={size_mb:9.1f} MB  {mode:>6}: {float(output[0]):8.2f} s  peak RSS {float(output[1]):9.1f} MB")
+        os.remove(filename)
+
+class LegacyTransaction:
+    """The original dict-backed transaction layout, kept as a baseline"""
+    def __init__(self, transaction_id, book_id, member_id, librarian_id, borrow_date, due_date, return_date):
+        self.transaction_id = transaction_id
+        self.book_id = book_id
+        self.member_id = member_id
+        self.librarian_id = librarian_id
+        self.borrow_date = borrow_date
+        self.due_date = due_date
+        self.return_date = return_date
+        self.is_returned = return_date is not None
+
+class LegacyBook:
+    """The original dict-backed book layout, kept as a baseline"""
+    def __init__(self, book_id, title, author, isbn, publication_year, available=True):
+        self.book_id = book_id
+        self.title = title
+        self.author = author
+        self.isbn = isbn
+        self.publication_year = publication_year
+        self.available = available
+
+def measure(build):
+    """Return the bytes allocated by build() and still alive afterwards"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return after - before
+
+def bench_memory(record_count):
+    """Compare per-record memory of the entity layouts"""
+    print(f"=== Memory per record ({record_count:,} records) ===")
+    start = datetime(2020, 1, 1, 9, 0)
+
+    def transaction_args(i):
+        borrow_date = start + timedelta(minutes=i)
+        return (i, i % 1000, i % 100, 1, borrow_date, borrow_date + timedelta(days=14),
+                borrow_date + timedelta(days=7) if i % 10 else None)
+
+    layouts = [
+        ("transaction, dict attrs", lambda: {i: LegacyTransaction(*transaction_args(i)) for i in range(1, record_count + 1)}),
+        ("transaction, __slots__", lambda: {i: BorrowTransaction(*transaction_args(i)) for i in range(1, record_count + 1)}),
+        ("transaction, columnar", lambda: TransactionStore(BorrowTransaction(*transaction_args(i)) for i in range(1, record_count + 1))),
+        ("book, dict attrs", lambda: {i: LegacyBook(i, f"Title {i}", f"Author {i % 97}", f"isbn-{i}", 1950) for i in range(1, record_count + 1)}),
+        ("book, __slots__", lambda: {i: Book(i, f"Title {i}", f"Author {i % 97}", f"isbn-{i}", 1950) for i in range(1, record_count + 1)}),
+    ]
+    for label, build in layouts:
+        print(f"  {label:<24} {measure(build) / record_count:8.1f} bytes/record")
+
+def bench_overdue(history_sizes):
+    """Time the overdue report against a per-transaction loop"""
+    print("=== Overdue report: per-object loop vs. column pass ===")
+    for history_size in history_sizes:
+        library = make_library()
+        build_history(library, history_size)
+        as_of = datetime(2020, 1, 1) + timedelta(minutes=history_size)
+
+        start = time.perf_counter()
+        policy = overdue.FinePolicy()
+        rows = [(t.transaction_id, t.get_days_overdue(), policy.fine(t.get_days_overdue()))
+                for t in library.transactions.values() if t.is_overdue()]
+        loop_time = time.perf_counter() - start
+
+        timings = []
+        numpy_module = overdue.np
+        for label, module in (("numpy", numpy_module), ("columns", None)):
+            if label == "numpy" and module is None:
+                continue
+            overdue.np = module
+            start = time.perf_counter()
+            library.overdue_report(as_of=as_of)
+            timings.append(f"{label}: {time.perf_counter() - start:7.3f} s")
+        overdue.np = numpy_module
+
+        print(f"  history={history_size:>10,}  loop: {loop_time:7.3f} s  " + "  ".join(timings))
+
+def bench_batch(batch_sizes):
+    """Compare borrow_many/return_many throughput with a per-item loop"""
+    print("=== Batch borrow/return vs. per-item loop ===")
+    for library_class in (Library, SQLiteLibrary):
+        for batch_size in batch_sizes:
+            timings = {}
+            for mode in ("loop", "batch"):
+                library = make_library(book_count=batch_size, library_class=library_class)
+                requests = [(i % 100 + 1, i + 1) for i in range(batch_size)]
+                start = time.perf_counter()
+                if mode == "loop":
+                    for member_id, book_id in requests:
+                        library.borrow_book(member_id, book_id, 1)
+                else:
+                    library.borrow_many(requests, 1)
+                middle = time.perf_counter()
+                if mode == "loop":
+                    for member_id, book_id in requests:
+                        library.return_book(member_id, book_id)
+                else:
+                    library.return_many(requests)
+                timings[mode] = (batch_size / (middle - start), batch_size / (time.perf_counter() - middle))
+            print(f"  {library_class.__name__:>13} batch={batch_size:>6,}  "
+                  f"borrow: {timings['loop'][0]:9,.0f} -> {timings['batch'][0]:9,.0f} items/s  "
+                  f"return: {timings['loop'][1]:9,.0f} -> {timings['batch'][1]:9,.0f} items/s")
+
+def bench_threads(thread_counts, operations=20_000):
+    """Measure borrow/return throughput as more desk threads share one ConcurrentLibrary"""
+    print("=== Concurrent borrow/return throughput ===")
+    for thread_count in thread_counts:
+        library = make_library(book_count=10_000, library_class=ConcurrentLibrary)
+        per_thread = operations // thread_count
+
+        def desk(offset):
+            # Each desk cycles through its own slice of books, so stripes rarely collide
+            for i in range(per_thread):
+                book_id = (offset + i * thread_count) % 10_000 + 1
+                member_id = book_id % 100 + 1
+                library.borrow_book(member_id, book_id, 1)
+                library.return_book(member_id, book_id)
+
+        threads = [threading.Thread(target=desk, args=(offset,)) for offset in range(thread_count)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        print(f"  threads={thread_count:>2}  {2 * per_thread * thread_count / elapsed:9,.0f} ops/s")
+
+async def generate_load(port, client_count, requests_per_client, window=32, host="127.0.0.1"):
+    """Drive a LibraryServer with borrow/return/search traffic from several clients.
+
+    Each client keeps up to `window` requests in flight. Returns requests per
+    second and the median and 99th percentile latency in milliseconds.
+    """
+    latencies = []
+
+    async def timed(client, op, **args):
+        start = time.perf_counter()
+        await client.call(op, **args)
+        latencies.append(time.perf_counter() - start)
+
+    async def run_client(offset):
+        client = await LibraryClient.connect(host, port)
+        for first in range(0, requests_per_client, window):
+            calls = []
+            for i in range(first, min(first + window, requests_per_client)):
+                book_id = (offset * requests_per_client + i) // 2 % 10_000 + 1
+                if i % 10 == 9:
+                    calls.append(timed(client, 'search_books', query=f"title {book_id}", limit=10))
+                elif i % 2 == 0:
+                    calls.append(timed(client, 'borrow_book', member_id=book_id % 100 + 1, book_id=book_id, librarian_id=1))
+                else:
+                    calls.append(timed(client, 'return_book', member_id=book_id % 100 + 1, book_id=book_id))
+            await asyncio.gather(*calls)
+        await client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(offset) for offset in range(client_count)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return (len(latencies) / elapsed, latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000)
+
+def bench_server(client_counts, requests_per_client=5000):
+    """Load-test a library server running in a child process"""
+    print("=== Library server load (window=32) ===")
+    data_file = os.path.join(tempfile.mkdtemp(), "server.json")
+    make_library(book_count=10_000).save_to_file(data_file)
+    server = subprocess.Popen([sys.executable, "library_server.py", data_file, "0"],
+                              stdout=subprocess.PIPE, text=True)
+    try:
+        port = int(server.stdout.readline().rsplit(":", 1)[1])
+        for client_count in client_counts:
+            rate, median, p99 = asyncio.run(generate_load(port, client_count, requests_per_client))
+            print(f"  clients={client_count:>3}  {rate:9,.0f} req/s  p50 {median:6.2f} ms  p99 {p99:6.2f} ms")
+    finally:
+        server.terminate()
+        server.wait()
+
+def bench_sharded(shard_counts, book_count=1_000_000, queries=("title 4242", "author 57", "tle 31", "itle 9")):
+    """Compare search throughput of one index with the catalogue split over worker processes"""
+    print(f"=== Sharded search, {book_count:,} books, {os.cpu_count()} cores ===")
+    batch = [f"{query}{i}" for i in range(25) for query in queries]
+    library = make_library(book_count=book_count)
+    start = time.perf_counter()
+    for query in batch:
+        library.search_books(query, limit=10)
+    print(f"  {'single':>8}  one-by-one {len(batch) / (time.perf_counter() - start):8,.0f} q/s")
+    for shard_count in shard_counts:
+        library = make_library(book_count=book_count, library_class=lambda name: ShardedLibrary(name, shards=shard_count))
+        try:
+            library.search_books("warm up")  # waits until the shards have indexed everything
+            start = time.perf_counter()
+            for query in batch:
+                library.search_books(query, limit=10)
+            middle = time.perf_counter()
+            library.search_many(batch, limit=10)
+            end = time.perf_counter()
+            print(f"  shards={shard_count:<2}  one-by-one {len(batch) / (middle - start):8,.0f} q/s  "
+                  f"batched {len(batch) / (end - middle):8,.0f} q/s")
+        finally:
+            library.close()
+
+def bench_snapshot(transaction_counts, book_count=100_000):
+    """Compare cold start from JSON with opening a memory-mapped binary snapshot"""
+    print("=== Cold start: load_from_file vs. open_snapshot ===")
+    directory = tempfile.mkdtemp()
+    for transaction_count in transaction_counts:
+        json_file = os.path.join(directory, f"library_{transaction_count}.json")
+        snapshot_file = os.path.join(directory, f"library_{transaction_count}.snap")
+        write_library_file(json_file, book_count, transaction_count)
+        library = Library("Benchmark Library")
+        start = time.perf_counter()
+        library.load_from_file(json_file)
+        load_time = time.perf_counter() - start
+        start = time.perf_counter()
+        library.save_snapshot(snapshot_file)
+        save_time = time.perf_counter() - start
+        del library
+
+        library = Library("Benchmark Library")
+        start = time.perf_counter()
+        library.open_snapshot(snapshot_file)
+        open_time = time.perf_counter() - start
+        start = time.perf_counter()
+        library.books[book_count // 2]
+        library.get_active_transaction(50)
+        lookup_time = time.perf_counter() - start
+        start = time.perf_counter()
+        library.search_books("title 4242")
+        search_time = time.perf_counter() - start
+        print(f"  transactions={transaction_count:>11,}  JSON {os.path.getsize(json_file) / 1e6:7.1f} MB load {load_time:7.2f} s  "
+              f"| snapshot {os.path.getsize(snapshot_file) / 1e6:6.1f} MB save {save_time:6.2f} s open {open_time * 1000:7.1f} ms  "
+              f"first lookups {lookup_time * 1000:5.2f} ms  first search {search_time:5.2f} s")
+        os.remove(json_file)
+        del library
+        os.remove(snapshot_file)
+
+def bench_report(history_sizes, page_size=100):
+    """Compare peak memory and time of a full transaction report built as a list and streamed in pages"""
+    print("=== Transaction report: get_all_transactions vs. iter_transactions ===")
+    for history_size in history_sizes:
+        library = make_library()
+        build_history(library, history_size)
+
+        def as_list():
+            return sum(len(str(transaction)) for transaction in library.get_all_transactions())
+
+        def as_pages():
+            return sum(len(str(transaction)) for page in library.iter_transactions(page_size=page_size) for transaction in page)
+
+        for label, report in (("list", as_list), ("pages", as_pages)):
+            tracemalloc.start()
+            start = time.perf_counter()
+            report()
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"  history={history_size:>11,}  {label:>5}: {elapsed:7.2f} s  peak {peak / 1e6:9.1f} MB")
+
+def bench_query(book_counts, rounds=20):
+    """Time planned queries against a scan of every book with the same predicate"""
+    print("=== Library.query: planned vs. full scan ===")
+    queries = {
+        "author": F.author == "Author 57",
+        "author+year": (F.author == "Author 57") & (F.publication_year >= 2000),
+        "year in": F.publication_year.is_in([1950, 1990]),
+        "borrowed": F.available == False,
+        "isbn": F.isbn == "isbn-4242",
+        "title contains": F.title.contains("tle 424"),
+    }
+    for book_count in book_counts:
+        library = make_library(book_count=book_count)
+        library.borrow_many([(member_id, member_id * 7) for member_id in range(1, 101)], 1)
+        for label, predicate in queries.items():
+            start = time.perf_counter()
+            for _ in range(rounds):
+                scanned = [book for book in library.books.values() if predicate.matches(book)]
+            scan_time = (time.perf_counter() - start) / rounds
+
+            query = library.query('books').where(predicate)
+            start = time.perf_counter()
+            for _ in range(rounds):
+                planned = query.all()
+            plan_time = (time.perf_counter() - start) / rounds
+            assert len(planned) == len(scanned)
+            access = query.explain().split(" (")[0]
+            print(f"  books={book_count:>10,}  {label:>14}: scan {scan_time * 1e3:8.2f} ms  planned {plan_time * 1e3:8.3f} ms  ({access})")
+
+BookRow = namedtuple('BookRow', 'book_id author publication_year')
+SURNAMES = ["Orwell", "Austen", "Orczy", "Tolstoy", "Ondaatje", "Le Guin", "Pratchett", "Okri", "Dickens", "Eliot"]
+
+def book_rows(count):
+    """Lightweight stand-ins for books, enough to fill the field indexes at 10M rows"""
+    for book_id in range(1, count + 1):
+        author = f"{SURNAMES[book_id % len(SURNAMES)]} {book_id * 7919 % 50_000}"
+        yield BookRow(book_id, author, 1800 + book_id * 31 % 225)
+
+def bench_ranges(book_counts, rounds=5):
+    """Time year ranges and author prefixes from the sorted indexes against a scan"""
+    print("=== Sorted field indexes: range and prefix queries vs. scan ===")
+    queries = {
+        "years 1900-1905": ('publication_year', lambda index: index.range(1900, 1905),
+                            lambda row: 1900 <= row.publication_year <= 1905),
+        "years 1900-1950": ('publication_year', lambda index: index.range(1900, 1950),
+                            lambda row: 1900 <= row.publication_year <= 1950),
+        "author 'Or'": ('author', lambda index: index.prefix("Or"),
+                        lambda row: normalize_author(row.author).startswith("or")),
+        "author 'Orwell 123'": ('author', lambda index: index.prefix("Orwell 123"),
+                                lambda row: normalize_author(row.author).startswith("orwell 123")),
+    }
+    for book_count in book_counts:
+        rows = list(book_rows(book_count))
+        start = time.perf_counter()
+        indexes = {'publication_year': FieldIndex.build('publication_year', rows),
+                   'author': FieldIndex.build('author', rows, normalize_author)}
+        build_time = time.perf_counter() - start
+        print(f"  books={book_count:>11,}  build both indexes: {build_time:6.1f} s")
+
+        for label, (field, indexed, scan) in queries.items():
+            start = time.perf_counter()
+            scanned = [row.book_id for row in rows if scan(row)]
+            scan_time = time.perf_counter() - start
+            start = time.perf_counter()
+            for _ in range(rounds):
+                found = indexed(indexes[field])
+            index_time = (time.perf_counter() - start) / rounds
+            assert sorted(found) == scanned
+            print(f"  books={book_count:>11,}  {label:>20}: k={len(found):>9,}  scan {scan_time * 1e3:9.1f} ms  "
+                  f"index {index_time * 1e3:8.3f} ms")
+
+        # Maintenance cost paid by add_book and remove_book
+        extra = [BookRow(book_count + i, f"Newauthor {i}", 1700 + i % 300) for i in range(1, 10_001)]
+        start = time.perf_counter()
+        for row in extra:
+            for index in indexes.values():
+                index.add(row)
+        for row in extra:
+            for index in indexes.values():
+                index.remove(row)
+        per_update = (time.perf_counter() - start) / (2 * len(extra))
+        print(f"  books={book_count:>11,}  add/remove: {per_update * 1e6:6.2f} us per book")
+        del rows, indexes
+
+def zipf_queries(count, vocabulary=10_000, exponent=1.1, seed=42):
+    """A reproducible query log where the query of rank r is asked in proportion to 1 / r ** exponent"""
+    rng = random.Random(seed)
+    queries = [f"title {rng.randrange(1, 1_000_000)}" if rank % 3 else f"author {rank % 97}"
+               for rank in range(1, vocabulary + 1)]
+    weights = [1 / rank ** exponent for rank in range(1, vocabulary + 1)]
+    return rng.choices(queries, weights, k=count)
+
+def bench_search_cache(capacities, book_count=100_000, query_count=50_000, add_every=1000):
+    """Replay a Zipf query log with occasional new books, without and with the search cache"""
+    print(f"=== search_books: Zipf replay of {query_count:,} queries, one add_book per {add_every} ===")
+    log = zipf_queries(query_count)
+    for capacity in [0] + capacities:
+        library = make_library(book_count=book_count)
+        if capacity:
+            library.enable_search_cache(capacity)
+        next_id = book_count + 1
+        start = time.perf_counter()
+        for i, query in enumerate(log, 1):
+            library.search_books(query, limit=20)
+            if i % add_every == 0:
+                library.add_book(Book(next_id, f"Title {next_id}", "Author new", f"isbn-{next_id}", 2024))
+                next_id += 1
+        elapsed = time.perf_counter() - start
+        stats = library.search_cache_stats()
+        detail = (f"hit rate {stats['hit_rate']:6.1%}  evictions {stats['evictions']:>7,}  stale {stats['invalidations']:>6,}"
+                  if stats else "no cache")
+        print(f"  capacity={capacity:>7,}  {query_count / elapsed:>9,.0f} queries/s  {detail}")
+
+def bench_metrics(rounds, book_count=10_000):
+    """Compare borrow/return/search throughput with metrics off and on"""
+    print("=== Metrics overhead: borrow, return and search calls ===")
+    for count in rounds:
+        for enabled in (False, True):
+            library = make_library(book_count=book_count)
+            if enabled:
+                library.enable_metrics()
+            start = time.perf_counter()
+            for i in range(count):
+                book_id = i % book_count + 1
+                library.borrow_book(i % 100 + 1, book_id, 1)
+                library.return_book(i % 100 + 1, book_id)
+                library.find_by_isbn(f"isbn-{book_id}")
+            elapsed = time.perf_counter() - start
+            label = "on" if enabled else "off"
+            print(f"  calls={3 * count:>9,}  metrics {label:>3}: {elapsed / (3 * count) * 1e6:6.2f} us/call")
+
+SUITE_SEED = 42
+SUITE_OPERATIONS = 1000  # timed calls per scenario for the per-call scenarios
+
+def _latencies(durations):
+    """Summary of per-call durations in seconds"""
+    ordered = sorted(durations)
+    total = sum(ordered)
+    return {
+        'operations': len(ordered),
+        'seconds': total,
+        'ops_per_second': len(ordered) / total if total else None,
+        'p50_us': ordered[len(ordered) // 2] * 1e6 if ordered else None,
+        'p99_us': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1e6 if ordered else None,
+    }
+
+def _timed_calls(calls):
+    durations = []
+    for call in calls:
+        start = time.perf_counter()
+        call()
+        durations.append(time.perf_counter() - start)
+    return _latencies(durations)
+
+def _timed_once(operations, action):
+    start = time.perf_counter()
+    action()
+    elapsed = time.perf_counter() - start
+    return {'operations': operations, 'seconds': elapsed, 'ops_per_second': operations / elapsed if elapsed else None}
+
+def run_suite_scale(scale, seed=SUITE_SEED, log=sys.stderr):
+    """Generate a library of the given scale and time every scenario on it"""
+    generator = LibraryGenerator(books=scale, members=max(10, scale // 10), librarians=max(2, scale // 10_000),
+                                 transactions=scale, seed=seed)
+    results = []
+
+    def record(scenario, measurement, **extra):
+        results.append(dict(scenario=scenario, scale=scale, **measurement, **extra))
+        print(f"  scale={scale:>10,}  {scenario:<18} {measurement['seconds']:9.3f} s", file=log, flush=True)
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "generated.json")
+        record('generate', _timed_once(scale * 2, lambda: generator.write(source)), bytes=os.path.getsize(source))
+        library = Library("Benchmark Library")
+        record('load', _timed_once(scale * 2, lambda: library.load_from_file(source)))
+        assert len(library.books) == scale, "Generated library did not load"
+
+        queries = generator.queries(SUITE_OPERATIONS)
+        record('search', _timed_calls(lambda query=query: library.search_books(query, limit=20) for query in queries))
+
+        rng = random.Random(f"{seed}-suite")
+        available = list(islice(library.available_ids, SUITE_OPERATIONS))
+        loans = [(rng.randrange(1, generator.member_count + 1), book_id) for book_id in available]
+        when = generator.end
+        record('borrow', _timed_calls(lambda member_id=member_id, book_id=book_id: library.borrow_book(member_id, book_id, 1, when)
+                                      for member_id, book_id in loans))
+        later = when + timedelta(days=10)
+        record('return', _timed_calls(lambda member_id=member_id, book_id=book_id: library.return_book(member_id, book_id, later)
+                                      for member_id, book_id in loans))
+
+        transactions = len(library.transactions)
+        record('report_overdue', _timed_once(transactions, lambda: library.overdue_report(as_of=later)))
+        record('report_history', _timed_once(transactions, lambda: sum(
+            len(page) for page in library.iter_transactions(order='-borrow_date', page_size=1000))))
+
+        target = os.path.join(directory, "saved.json")
+        record('save', _timed_once(len(library.books) + transactions, lambda: library.save_to_file(target)),
+               bytes=os.path.getsize(target) if os.path.exists(target) else None)
+    return results
+
+def run_suite(scales, seed=SUITE_SEED):
+    """Run every scenario at every scale and return the JSON-ready report"""
+    print(f"=== Benchmark suite, seed {seed} ===", file=sys.stderr)
+    results = [result for scale in scales for result in run_suite_scale(scale, seed)]
+    return {
+        'suite': 'library',
+        'format': 1,
+        'seed': seed,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count()
+        },
+        'results': results
+    }
+
+def compare_results(baseline_file, current_file, tolerance=0.10):
+    """Print throughput changes between two suite reports; return the regressions beyond tolerance"""
+    with open(baseline_file) as f:
+        baseline = {(r['scenario'], r['scale']): r for r in json.load(f)['results']}
+    with open(current_file) as f:
+        current = json.load(f)['results']
+    regressions = []
+    for result in current:
+        before = baseline.get((result['scenario'], result['scale']))
+        if not before or not before['ops_per_second'] or not result['ops_per_second']:
+            continue
+        change = result['ops_per_second'] / before['ops_per_second'] - 1
+        flag = "  REGRESSION" if change < -tolerance else ""
+        print(f"  {result['scenario']:<18} scale={result['scale']:>10,}  {change:+7.1%}{flag}")
+        if flag:
+            regressions.append(result)
+    return regressions
+
+def bench_archive(scales, keep_days=180):
+    """Save and load times before and after archiving history older than keep_days"""
+    print(f"=== Archiving returned transactions older than {keep_days} days ===")
+    for scale in scales:
+        generator = LibraryGenerator(books=scale // 10, members=max(10, scale // 100), transactions=scale)
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "library.json")
+            generator.write(source)
+            library = Library("Benchmark Library")
+            library.load_from_file(source)
+
+            def save_and_load():
+                start = time.perf_counter()
+                library.save_to_file(source)
+                saved = time.perf_counter()
+                Library("Reload").load_from_file(source)
+                return saved - start, time.perf_counter() - saved, os.path.getsize(source)
+
+            save_time, load_time, size = save_and_load()
+            print(f"  transactions={scale:>10,}  before: save {save_time:6.2f} s  load {load_time:6.2f} s  {size / 1e6:8.1f} MB")
+            start = time.perf_counter()
+            moved = library.archive_transactions(generator.end - timedelta(days=keep_days), os.path.join(directory, "archive"))
+            archive_time = time.perf_counter() - start
+            archive_size = sum(os.path.getsize(library.archive.path(month)) for month in library.archive.months())
+            print(f"  transactions={scale:>10,}  archived {moved:,} in {archive_time:.2f} s "
+                  f"to {len(library.archive.months())} segments, {archive_size / 1e6:.1f} MB")
+            save_time, load_time, size = save_and_load()
+            print(f"  transactions={scale:>10,}  after:  save {save_time:6.2f} s  load {load_time:6.2f} s  {size / 1e6:8.1f} MB")
+            month = generator.end - timedelta(days=400)
+            start = time.perf_counter()
+            count = sum(1 for _ in library.transaction_history(month, month + timedelta(days=30)))
+            print(f"  transactions={scale:>10,}  one archived month of history: {count:,} loans "
+                  f"in {(time.perf_counter() - start) * 1e3:.0f} ms")
+
+def bench_incremental(scales, changes=(10, 100, 1000, 10_000)):
+    """Full save versus delta save latency as the number of changed records grows"""
+    print("=== Full save vs incremental save ===")
+    for scale in scales:
+        generator = LibraryGenerator(books=scale, members=max(10, scale // 10), transactions=scale)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "library.json")
+            generator.write(filename)
+            library = Library("Benchmark Library")
+            library.load_from_file(filename)
+            start = time.perf_counter()
+            library.save_to_file(filename)
+            full_time = time.perf_counter() - start
+            print(f"  books={scale:>10,}  full save {full_time * 1e3:9.1f} ms  {os.path.getsize(filename) / 1e6:8.1f} MB")
+            available = iter(library.get_available_books())
+            for count in changes:
+                # Each borrow touches a book, a member and a new transaction
+                for book, member_id in zip(available, range(1, count + 1)):
+                    library.borrow_book(member_id % len(library.members) + 1, book.book_id, 1)
+                start = time.perf_counter()
+                path = library.save_incremental(filename)
+                delta_time = time.perf_counter() - start
+                if path is None:
+                    # Every available book is already out, so the round changed nothing
+                    print(f"  books={scale:>10,}  {count:>7,} loans: no books left to borrow, stopping")
+                    break
+                print(f"  books={scale:>10,}  {count:>7,} loans: delta save {delta_time * 1e3:9.1f} ms  "
+                      f"{os.path.getsize(path) / 1e3:9.1f} KB  ({full_time / delta_time:,.0f}x faster)")
+            start = time.perf_counter()
+            merged = library.merge_deltas()
+            print(f"  books={scale:>10,}  merged {merged} deltas in {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+def bench_codecs(scales):
+    """Save and load throughput of the indented format and of the compact format with each installed codec"""
+    print(f"=== Save and load throughput (codecs installed: {', '.join(available_codecs())}) ===")
+    for scale in scales:
+        generator = LibraryGenerator(books=scale, members=max(10, scale // 10), transactions=scale)
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "source.json")
+            generator.write(source)
+            library = Library("Benchmark Library")
+            library.load_from_file(source)
+            for codec in [None] + available_codecs():
+                filename = os.path.join(directory, f"{codec or 'indented'}.json")
+                library.set_codec(codec)
+                start = time.perf_counter()
+                library.save_to_file(filename)
+                save_time = time.perf_counter() - start
+                size = os.path.getsize(filename)
+                reloaded = Library("Reload")
+                reloaded.set_codec(codec)
+                start = time.perf_counter()
+                reloaded.load_from_file(filename)
+                load_time = time.perf_counter() - start
+                # Without books the load is decoding and table building, not search indexing
+                start = time.perf_counter()
+                Library("Reload").load_from_file(filename, sections=('members', 'librarians', 'transactions'))
+                history_time = time.perf_counter() - start
+                print(f"  books={scale:>10,}  {codec or 'indented':>8}  {size / 1e6:7.1f} MB  "
+                      f"save {save_time:6.2f} s {size / 1e6 / save_time:6.1f} MB/s  "
+                      f"load {load_time:6.2f} s {size / 1e6 / load_time:6.1f} MB/s  "
+                      f"load without books {history_time:6.2f} s")
+
+if __name__ == "__main__":
+    scenario = sys.argv[1] if len(sys.argv) > 1 else "return"
+    sizes = [int(arg) for arg in sys.argv[2:]] if scenario not in ("load-child", "compare") else []
+    if scenario == "return":
+        bench_return_latency(sizes or [10_000, 100_000, 1_000_000, 10_000_000])
+    elif scenario == "search":
+        bench_search(sizes or [10_000, 100_000, 1_000_000])
+    elif scenario == "batch":
+        bench_batch(sizes or [100, 1000, 10_000])
+    elif scenario == "report":
+        bench_report(sizes or [100_000, 1_000_000])
+    elif scenario == "archive":
+        bench_archive(sizes or [100_000, 1_000_000])
+    elif scenario == "incremental":
+        bench_incremental(sizes or [10_000, 100_000])
+    elif scenario == "codecs":
+        bench_codecs(sizes or [10_000, 100_000])
+    elif scenario == "suite":
+        # JSON report on stdout, progress on stderr: python benchmark.py suite 1000 10000 > results.json
+        # 10^6 and up need several GB per million books, mostly for the search index
+        json.dump(run_suite(sizes or [1_000, 10_000, 100_000]), sys.stdout, indent=2)
+        print()
+    elif scenario == "compare":
+        # python benchmark.py compare baseline.json current.json [tolerance]
+        tolerance = float(sys.argv[4]) if len(sys.argv) > 4 else 0.10
+        sys.exit(1 if compare_results(sys.argv[2], sys.argv[3], tolerance) else 0)
+    elif scenario == "metrics":
+        bench_metrics(sizes or [100_000])
+    elif scenario == "cache":
+        bench_search_cache(sizes or [100, 1000, 10_000])
+    elif scenario == "ranges":
+        bench_ranges(sizes or [1_000_000, 10_000_000])
+    elif scenario == "query":
+        bench_query(sizes or [10_000, 100_000, 1_000_000])
+    elif scenario == "snapshot":
+        bench_snapshot(sizes or [100_000, 1_000_000, 10_000_000])
+    elif scenario == "sharded":
+        bench_sharded(sizes or [1, 2, 4, 8])
+    elif scenario == "server":
+        bench_server(sizes or [1, 4, 16, 64])
+    elif scenario == "threads":
+        bench_threads(sizes or [1, 2, 4, 8])
+    elif scenario == "overdue":
+        bench_overdue(sizes or [100_000, 1_000_000, 10_000_000])
+    elif scenario == "memory":
+        for size in sizes or [100_000, 1_000_000]:
+            bench_memory(size)
+    elif scenario == "load":
+        # About 5 GB of JSON at the largest size
+        bench_load(sizes or [100_000, 1_000_000, 25_000_000])
+    elif scenario == "load-child":
+        load_child(sys.argv[2], sys.argv[3])
+    else:
+        print(f"Unknown scenario: {scenario}")
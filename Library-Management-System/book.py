@@ -1,4 +1,19 @@
+def normalize_isbn(isbn):
+    """Return an ISBN as ISBN-13 digits without hyphens or spaces"""
+    digits = str(isbn).replace("-", "").replace(" ", "").upper()
+    if len(digits) == 10 and digits[:9].isdigit() and (digits[9].isdigit() or digits[9] == "X"):
+        digits = "978" + digits[:9]
+        total = sum(int(d) * (1 if i % 2 == 0 else 3) for i, d in enumerate(digits))
+        digits += str((10 - total % 10) % 10)
+    return digits
+
+def normalize_author(author):
+    """Return an author name lower-cased with runs of whitespace collapsed"""
+    return " ".join(str(author).lower().split())
+
 class Book:
+    __slots__ = ('book_id', 'title', 'author', 'isbn', 'publication_year', 'available', 'on_change', '__weakref__')
+    
     def __init__(self, book_id, title, author, isbn, publication_year, available=True):
         self.book_id = book_id
         self.title = title
@@ -6,6 +21,7 @@ class Book:
         self.isbn = isbn
         self.publication_year = publication_year
         self.available = available
+        self.on_change = None  # Called with the book whenever its availability changes
     
     def __str__(self):
         status = "Available" if self.available else "Borrowed"
@@ -14,11 +30,16 @@ class Book:
     def borrow(self):
         if self.available:
             self.available = False
+            if self.on_change:
+                self.on_change(self)
             return True
         return False
     
     def return_book(self):
-        self.available = True
+        if not self.available:
+            self.available = True
+            if self.on_change:
+                self.on_change(self)
     
     def to_dict(self):
         return {
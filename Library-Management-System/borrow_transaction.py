@@ -1,6 +1,8 @@
 from datetime import datetime, timedelta
 
 class BorrowTransaction:
+    __slots__ = ('transaction_id', 'book_id', 'member_id', 'librarian_id', 'borrow_date', 'due_date', 'return_date', '__weakref__')
+    
     def __init__(self, transaction_id, book_id, member_id, librarian_id, borrow_date, due_date=None, return_date=None):
         self.transaction_id = transaction_id
         self.book_id = book_id
@@ -9,7 +11,10 @@ class BorrowTransaction:
         self.borrow_date = borrow_date
         self.due_date = due_date if due_date else borrow_date + timedelta(days=14)  # Default 2 weeks
         self.return_date = return_date
-        self.is_returned = return_date is not None
+    
+    @property
+    def is_returned(self):
+        return self.return_date is not None
     
     def __str__(self):
         status = "Returned" if self.is_returned else "Active"
@@ -19,7 +24,6 @@ class BorrowTransaction:
     def return_book(self, return_date=None):
         """Mark the book as returned"""
         self.return_date = return_date if return_date else datetime.now()
-        self.is_returned = True
     
     def is_overdue(self):
         """Check if the book is overdue"""
@@ -0,0 +1,244 @@
+import json
+from array import array
+from itertools import islice
+from book import Book
+from member import Member
+from librarian import Librarian
+from borrow_transaction import BorrowTransaction
+from transaction_store import TransactionStore, DELETED, NO_DATE, to_epoch, from_epoch
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+# A compact library file starts with this, which is how load_from_file tells it from the indented format
+HEADER = b'{"format":"compact-1"'
+CHUNK_SIZE = 4096  # records per encoded line
+
+class JSONCodec:
+    """Standard library json, with no whitespace between tokens"""
+    name = 'json'
+    available = True
+
+    def __init__(self):
+        self.encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+    def dumps(self, value):
+        return self.encoder.encode(value).encode()
+
+    def loads(self, data):
+        return json.loads(data)
+
+class OrjsonCodec:
+    name = 'orjson'
+    available = orjson is not None
+
+    def dumps(self, value):
+        return orjson.dumps(value)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+class MsgspecCodec:
+    name = 'msgspec'
+    available = msgspec is not None
+
+    def __init__(self):
+        self.encoder = msgspec.json.Encoder()
+        self.decoder = msgspec.json.Decoder()
+
+    def dumps(self, value):
+        return self.encoder.encode(value)
+
+    def loads(self, data):
+        try:
+            return self.decoder.decode(data)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e  # reported like the json and orjson decode errors
+
+CODECS = (OrjsonCodec, MsgspecCodec, JSONCodec)  # fastest first
+
+def available_codecs():
+    return [codec.name for codec in CODECS if codec.available]
+
+def get_codec(name=None):
+    """Return the named codec, or the fastest one installed when name is None"""
+    for codec in CODECS:
+        if codec.available and name in (None, codec.name):
+            return codec()
+    raise ValueError(f"Codec {name!r} is not available; installed codecs are {available_codecs()}")
+
+# Records are stored as arrays of their fields in this order, with dates as epoch microseconds
+FIELDS = {
+    'books': ('book_id', 'title', 'author', 'isbn', 'publication_year', 'available'),
+    'members': ('member_id', 'name', 'email', 'phone', 'borrowed_books', 'loan_limit'),
+    'librarians': ('librarian_id', 'name', 'email'),
+    'transactions': ('transaction_id', 'book_id', 'member_id', 'librarian_id', 'borrow_date', 'due_date', 'return_date')
+}
+
+def book_row(book):
+    return (book.book_id, book.title, book.author, book.isbn, book.publication_year, book.available)
+
+def member_row(member):
+    return (member.member_id, member.name, member.email, member.phone, list(member.borrowed_books), member.loan_limit)
+
+def librarian_row(librarian):
+    return (librarian.librarian_id, librarian.name, librarian.email)
+
+def transaction_row(transaction):
+    return_date = transaction.return_date
+    return (transaction.transaction_id, transaction.book_id, transaction.member_id, transaction.librarian_id,
+            to_epoch(transaction.borrow_date), to_epoch(transaction.due_date),
+            to_epoch(return_date) if return_date is not None else None)
+
+def book_from_row(row):
+    return Book(*row)
+
+def member_from_row(row):
+    member = Member(row[0], row[1], row[2], row[3], row[5])
+    member.borrowed_books = dict.fromkeys(row[4])
+    return member
+
+def librarian_from_row(row):
+    return Librarian(*row)
+
+def transaction_from_row(row):
+    return BorrowTransaction(row[0], row[1], row[2], row[3], from_epoch(row[4]), from_epoch(row[5]),
+                             from_epoch(row[6]) if row[6] is not None else None)
+
+TO_ROW = {'books': book_row, 'members': member_row, 'librarians': librarian_row, 'transactions': transaction_row}
+FROM_ROW = {'books': book_from_row, 'members': member_from_row, 'librarians': librarian_from_row,
+            'transactions': transaction_from_row}
+
+def store_rows(store):
+    """Rows of a TransactionStore read straight from its columns, without building row views"""
+    columns = zip(store.ids, store.book_ids, store.member_ids, store.librarian_ids,
+                  store.borrow_dates, store.due_dates, store.return_dates)
+    for row in columns:
+        if row[0] != DELETED:
+            yield row if row[6] != NO_DATE else row[:6] + (None,)
+
+def library_sections(library):
+    """(section, rows) for each table of a library"""
+    transactions = library.transactions
+    if isinstance(transactions, TransactionStore):
+        transaction_rows = store_rows(transactions)
+    else:
+        transaction_rows = map(transaction_row, transactions.values())
+    return [
+        ('books', map(book_row, library.books.values())),
+        ('members', map(member_row, library.members.values())),
+        ('librarians', map(librarian_row, library.librarians.values())),
+        ('transactions', transaction_rows)
+    ]
+
+def write_library(f, codec, name, next_ids, sections, generation=0):
+    """Write a compact library file to a binary file.
+
+    The whole file is one JSON document, but each line holds the header or up
+    to CHUNK_SIZE records, so it can be encoded and decoded a chunk at a time.
+    sections is an iterable of (section, rows) and may be a generator.
+    """
+    dumps = codec.dumps
+    f.write(HEADER + b',"name":' + dumps(name) + b',"next_ids":' + dumps(next_ids) + b',"generation":' + dumps(generation))
+    for section, rows in sections:
+        f.write(b',\n' + dumps(section) + b':[')
+        separator = b'\n'
+        while True:
+            chunk = list(islice(rows, CHUNK_SIZE))
+            if not chunk:
+                break
+            f.write(separator + dumps(chunk))
+            separator = b',\n'
+        f.write(b'\n]')
+    f.write(b'}\n')
+
+def is_compact(filename):
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(HEADER)) == HEADER
+    except FileNotFoundError:
+        return False
+
+class CompactReader:
+    """Reader for compact library files, with the interface of JSONStreamReader.
+
+    Sections are yielded as iterators over chunks, each a list of record
+    arrays; chunks the caller does not consume are skipped without being
+    decoded.
+    """
+
+    def __init__(self, f, codec):
+        self.file = f
+        self.codec = codec
+
+    def sections(self):
+        loads = self.codec.loads
+        line = self.file.readline().rstrip()
+        header = loads(line[:-1] + b'}' if line.endswith(b',') else line)
+        yield 'name', header['name']
+        yield 'next_ids', header['next_ids']
+        yield 'generation', header.get('generation', 0)
+        for line in self.file:
+            line = line.rstrip()
+            if not line.endswith(b':['):
+                continue
+            lines = self._chunk_lines()
+            yield loads(line[:-2]), (loads(chunk) for chunk in lines)
+            for _ in lines:
+                pass
+
+    def _chunk_lines(self):
+        for line in self.file:
+            if line.startswith(b']'):
+                return
+            line = line.rstrip()
+            if line:
+                yield line.rstrip(b',')
+
+def read_tables(filename, codec, wanted, active_only=False):
+    """Load a compact library file into fresh tables, building the transaction columns directly.
+
+    Returns (name, next_ids, generation, {section: table}).
+    """
+    name, next_ids, generation = None, {}, 0
+    tables = {'books': {}, 'members': {}, 'librarians': {}, 'transactions': TransactionStore()}
+    with open(filename, 'rb') as f:
+        for key, value in CompactReader(f, codec).sections():
+            if key == 'name':
+                name = value
+            elif key == 'next_ids':
+                next_ids = value
+            elif key == 'generation':
+                generation = value
+            elif key not in wanted:
+                continue
+            elif key == 'transactions':
+                tables[key] = _read_store(value, active_only)
+            else:
+                table, from_row = tables[key], FROM_ROW[key]
+                for chunk in value:
+                    for row in chunk:
+                        table[row[0]] = from_row(row)
+    return name, next_ids, generation, tables
+
+def _read_store(chunks, active_only):
+    columns = tuple(array('q') for _ in FIELDS['transactions'])
+    for chunk in chunks:
+        if active_only:
+            chunk = [row for row in chunk if row[6] is None]
+        if not chunk:
+            continue
+        values = list(zip(*chunk))
+        values[6] = [NO_DATE if date is None else date for date in values[6]]
+        for column, column_values in zip(columns, values):
+            column.extend(column_values)
+    ids = columns[0]
+    dense = not ids or ids == array('q', range(ids[0], ids[0] + len(ids)))
+    return TransactionStore.from_columns(columns, dense)
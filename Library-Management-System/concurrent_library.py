@@ -0,0 +1,141 @@
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from library import Library
+
+def _synchronized(method):
+    """Run a Library method while holding the shared index lock"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.index_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class ConcurrentLibrary(Library):
+    """Library that many circulation desks can use from different threads.
+
+    Borrow and return checks run under locks striped by member_id and by
+    book_id, so checks on a member's loans hold and desks working for
+    different members on different books do not wait for each other. Writes
+    to the shared tables and indexes, and reads that walk them, take a short
+    index lock. Locks are always taken in the order member stripes, book
+    stripes, index lock, ID lock.
+    """
+
+    def __init__(self, name, stripes=64):
+        super().__init__(name)
+        self.member_locks = [threading.Lock() for _ in range(stripes)]
+        self.book_locks = [threading.Lock() for _ in range(stripes)]
+        self.index_lock = threading.RLock()
+        self.id_lock = threading.Lock()
+
+    def _book_lock(self, book_id):
+        return self.book_locks[hash(book_id) % len(self.book_locks)]
+
+    def _member_lock(self, member_id):
+        return self.member_locks[hash(member_id) % len(self.member_locks)]
+
+    def _acquire(self, requests):
+        """Acquire the member and book stripes covering (member_id, book_id) pairs, in a fixed order to avoid deadlock"""
+        members = sorted({hash(member_id) % len(self.member_locks) for member_id, _ in requests})
+        books = sorted({hash(book_id) % len(self.book_locks) for _, book_id in requests})
+        locks = [self.member_locks[stripe] for stripe in members] + [self.book_locks[stripe] for stripe in books]
+        for lock in locks:
+            lock.acquire()
+        return locks
+
+    @contextmanager
+    def _exclusive(self):
+        """Hold every stripe and the index lock, stopping all circulation"""
+        locks = self.member_locks + self.book_locks + [self.index_lock]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def borrow_book(self, member_id, book_id, librarian_id, borrow_date=None):
+        """Borrow a book"""
+        with self._member_lock(member_id), self._book_lock(book_id):
+            return super().borrow_book(member_id, book_id, librarian_id, borrow_date)
+
+    def return_book(self, member_id, book_id, return_date=None):
+        """Return a borrowed book"""
+        with self._member_lock(member_id), self._book_lock(book_id):
+            return super().return_book(member_id, book_id, return_date)
+
+    def borrow_many(self, requests, librarian_id, atomic=False, borrow_date=None):
+        """Borrow a batch of (member_id, book_id) pairs with one timestamp"""
+        requests = list(requests)
+        locks = self._acquire(requests)
+        try:
+            return super().borrow_many(requests, librarian_id, atomic, borrow_date)
+        finally:
+            for lock in locks:
+                lock.release()
+
+    def return_many(self, requests, atomic=False, return_date=None):
+        """Return a batch of (member_id, book_id) pairs with one timestamp"""
+        requests = list(requests)
+        locks = self._acquire(requests)
+        try:
+            return super().return_many(requests, atomic, return_date)
+        finally:
+            for lock in locks:
+                lock.release()
+
+    def archive_transactions(self, before, directory=None):
+        """Move old returned transactions to the archive while no loan is in flight
+
+        Archiving rebuilds the transaction store, which open-loan views held by
+        a borrow or return in progress still point into.
+        """
+        with self._exclusive():
+            return super().archive_transactions(before, directory)
+
+    def _plan_query(self, table, predicate):
+        """Plan under the index lock, and read the candidates into a list under it too"""
+        with self.index_lock:
+            plan = super()._plan_query(table, predicate)
+        records = plan.records
+
+        def locked_records():
+            with self.index_lock:
+                return list(records())
+        plan.records = locked_records
+        return plan
+
+    def remove_book(self, book_id):
+        """Remove a book from the library"""
+        with self._book_lock(book_id), self.index_lock:
+            return super().remove_book(book_id)
+
+    def _allocate_transaction_ids(self, count):
+        """Reserve a block of consecutive transaction IDs and return the first"""
+        with self.id_lock:
+            return super()._allocate_transaction_ids(count)
+
+    _apply_borrow = _synchronized(Library._apply_borrow)
+    _apply_return = _synchronized(Library._apply_return)
+    add_book = _synchronized(Library.add_book)
+    add_member = _synchronized(Library.add_member)
+    add_librarian = _synchronized(Library.add_librarian)
+    get_all_books = _synchronized(Library.get_all_books)
+    get_available_books = _synchronized(Library.get_available_books)
+    get_borrowed_books = _synchronized(Library.get_borrowed_books)
+    get_all_members = _synchronized(Library.get_all_members)
+    get_all_librarians = _synchronized(Library.get_all_librarians)
+    get_all_transactions = _synchronized(Library.get_all_transactions)
+    get_member_borrowed_books = _synchronized(Library.get_member_borrowed_books)
+    search_books = _synchronized(Library.search_books)
+    overdue_report = _synchronized(Library.overdue_report)
+    top_borrowers = _synchronized(Library.top_borrowers)
+    next_due = _synchronized(Library.next_due)
+    overdue_since = _synchronized(Library.overdue_since)
+    save_to_file = _synchronized(Library.save_to_file)
+    save_incremental = _synchronized(Library.save_incremental)
+    merge_deltas = _synchronized(Library.merge_deltas)
+    load_from_file = _synchronized(Library.load_from_file)
+    compact_journal = _synchronized(Library.compact_journal)
@@ -0,0 +1,148 @@
+import json
+import random
+from datetime import datetime, timedelta
+from itertools import accumulate
+from book import Book
+from member import Member
+from librarian import Librarian
+from borrow_transaction import BorrowTransaction
+
+FIRST_NAMES = ["Amara", "Ben", "Chen", "Dilani", "Elena", "Farid", "Grace", "Hiro", "Ines", "Jonas", "Kavya",
+               "Liam", "Maya", "Nuwan", "Olga", "Pablo", "Quinn", "Rosa", "Sami", "Tara", "Uma", "Victor",
+               "Wen", "Ximena", "Yusuf", "Zara"]
+SURNAMES = ["Perera", "Smith", "Garcia", "Okafor", "Nakamura", "Silva", "Kowalski", "Dubois", "Haddad", "Jensen",
+            "Fernando", "Rossi", "Novak", "Kim", "Murphy", "Schmidt", "Ivanova", "Costa", "Mensah", "Lindqvist",
+            "Bakker", "Horvat", "Papadopoulos", "Yilmaz", "Andersen", "Moreau", "Nguyen", "Bianchi", "Walsh", "Sato"]
+TITLE_WORDS = ["The", "Silent", "River", "Garden", "Night", "Shadow", "Empire", "Last", "Secret", "House", "Light",
+               "Stone", "City", "Winter", "Song", "Storm", "Map", "Island", "Memory", "Fire", "Glass", "Queen",
+               "Journey", "Forest", "Letters", "Ocean", "Clock", "Mountain", "Bridge", "Summer", "Dream", "Road",
+               "Crown", "Orchard", "Harbor", "Lantern", "Mirror", "Tide", "Compass", "Kingdom", "Wolf", "Star",
+               "Machine", "Archive", "Salt", "Thread", "Engine", "Cartographer", "Physics", "History"]
+START = datetime(2021, 1, 1)  # first day of generated borrowing history
+
+def zipf_weights(count, exponent=1.0):
+    """Cumulative weights where item i is picked in proportion to 1 / (i + 1) ** exponent"""
+    return list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+class LibraryGenerator:
+    """Deterministic synthetic library data.
+
+    Authors, title words, book popularity and member activity follow Zipf
+    distributions; publication years lean towards recent decades; loans last
+    a few days to a few weeks, with a tail of late returns, and the most
+    recent loans are still open. The same seed always gives the same data,
+    whatever order the parts are generated in.
+    """
+
+    def __init__(self, books, members, librarians=2, transactions=0, seed=42, days=3 * 365, open_fraction=0.05):
+        self.book_count = books
+        self.member_count = members
+        self.librarian_count = librarians
+        self.transaction_count = transactions
+        self.seed = seed
+        self.end = START + timedelta(days=days)  # the generated "today"
+        self.open_count = min(int(transactions * open_fraction), books // 2, transactions)
+        self.open_loans = self._open_loans()  # {book_id: (member_id, librarian_id, borrow_date)}
+
+    def _random(self, part):
+        return random.Random(f"{self.seed}-{part}")
+
+    def _open_loans(self):
+        rng = self._random("open")
+        member_weights = zipf_weights(self.member_count, 0.8)
+        book_ids = rng.sample(range(1, self.book_count + 1), self.open_count)
+        member_ids = rng.choices(range(1, self.member_count + 1), cum_weights=member_weights, k=self.open_count)
+        loans = {}
+        for book_id, member_id in zip(book_ids, member_ids):
+            borrow_date = self.end - timedelta(days=rng.uniform(0, 30))
+            loans[book_id] = (member_id, rng.randrange(1, self.librarian_count + 1), borrow_date.replace(microsecond=0))
+        return loans
+
+    def authors(self):
+        """Pool of author names, most prolific first"""
+        rng = self._random("authors")
+        count = max(10, self.book_count // 8)
+        return [f"{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}" for _ in range(count)]
+
+    def books(self):
+        rng = self._random("books")
+        authors = self.authors()
+        author_weights = zipf_weights(len(authors))
+        word_weights = zipf_weights(len(TITLE_WORDS), 0.7)
+        for book_id in range(1, self.book_count + 1):
+            title = " ".join(rng.choices(TITLE_WORDS, cum_weights=word_weights, k=rng.randint(1, 4)))
+            author = rng.choices(authors, cum_weights=author_weights)[0]
+            year = max(1450, self.end.year - int(rng.expovariate(1 / 25)))
+            isbn = f"978{book_id:09d}"
+            isbn += str(-sum(int(d) * (1 if i % 2 == 0 else 3) for i, d in enumerate(isbn)) % 10)
+            yield Book(book_id, f"{title} {book_id}", author, isbn, year, available=book_id not in self.open_loans)
+
+    def members(self):
+        rng = self._random("members")
+        loans = {}
+        for book_id, (member_id, _, _) in self.open_loans.items():
+            loans.setdefault(member_id, []).append(book_id)
+        for member_id in range(1, self.member_count + 1):
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}"
+            member = Member(member_id, name, f"member{member_id}@example.org", f"555-{rng.randrange(10000):04d}")
+            member.borrowed_books = dict.fromkeys(loans.get(member_id, ()))
+            yield member
+
+    def librarians(self):
+        for librarian_id in range(1, self.librarian_count + 1):
+            yield Librarian(librarian_id, f"Librarian {librarian_id}", f"librarian{librarian_id}@example.org")
+
+    def transactions(self, chunk=10_000):
+        """Closed loans in borrow-date order, then the open ones"""
+        rng = self._random("transactions")
+        book_weights = zipf_weights(self.book_count, 0.9)
+        member_weights = zipf_weights(self.member_count, 0.8)
+        closed = self.transaction_count - self.open_count
+        span = (self.end - START).total_seconds() - 60 * 86400  # closed loans start at least 60 days ago
+        transaction_id = 0
+        while transaction_id < closed:
+            size = min(chunk, closed - transaction_id)
+            book_ids = rng.choices(range(1, self.book_count + 1), cum_weights=book_weights, k=size)
+            member_ids = rng.choices(range(1, self.member_count + 1), cum_weights=member_weights, k=size)
+            for book_id, member_id in zip(book_ids, member_ids):
+                transaction_id += 1
+                borrow_date = START + timedelta(seconds=int(span * transaction_id / max(closed, 1)))
+                # Median loan of about 9 days; roughly one in five comes back after the 14-day due date
+                days = min(rng.lognormvariate(2.2, 0.5), 59)
+                yield BorrowTransaction(transaction_id, book_id, member_id, rng.randrange(1, self.librarian_count + 1),
+                                        borrow_date, return_date=borrow_date + timedelta(days=days))
+        open_loans = sorted(self.open_loans.items(), key=lambda item: item[1][2])
+        for book_id, (member_id, librarian_id, borrow_date) in open_loans:
+            transaction_id += 1
+            yield BorrowTransaction(transaction_id, book_id, member_id, librarian_id, borrow_date)
+
+    def queries(self, count):
+        """Search queries a kiosk might see: popular author surnames and title words"""
+        rng = self._random("queries")
+        authors = self.authors()[:50]
+        word_weights = zipf_weights(len(TITLE_WORDS), 0.7)
+        queries = []
+        for _ in range(count):
+            if rng.random() < 0.4:
+                queries.append(rng.choice(authors).split()[1].lower())
+            else:
+                queries.append(" ".join(rng.choices(TITLE_WORDS, cum_weights=word_weights, k=rng.randint(1, 2))).lower())
+        return queries
+
+    def write(self, filename, name="Generated Library"):
+        """Write the library as a JSON file load_from_file reads, one record at a time"""
+        sections = (('books', self.books()), ('members', self.members()),
+                    ('librarians', self.librarians()), ('transactions', self.transactions()))
+        with open(filename, 'w') as f:
+            f.write('{"name": %s' % json.dumps(name))
+            for section, records in sections:
+                f.write(',\n"%s": [' % section)
+                for i, record in enumerate(records):
+                    f.write(("," if i else "") + "\n" + json.dumps(record.to_dict()))
+                f.write("\n]")
+            f.write(',\n"next_ids": %s}\n' % json.dumps({
+                'book': self.book_count + 1,
+                'member': self.member_count + 1,
+                'librarian': self.librarian_count + 1,
+                'transaction': self.transaction_count + 1
+            }))
@@ -0,0 +1,154 @@
+import glob
+import json
+import os
+import re
+from json_stream import JSONStreamReader
+from book import Book
+from member import Member
+from librarian import Librarian
+from borrow_transaction import BorrowTransaction
+from codec import CompactReader, TO_ROW, get_codec, is_compact, write_library
+
+# The id field of the records in each section of a library file
+KEYS = {'books': 'book_id', 'members': 'member_id', 'librarians': 'librarian_id', 'transactions': 'transaction_id'}
+RECORD_CLASSES = {'books': Book, 'members': Member, 'librarians': Librarian, 'transactions': BorrowTransaction}
+COMPLETE = re.compile(r"\.delta-\d{6}$")  # suffix of a delta that was fully written
+
+def delta_files(filename):
+    """Delta files saved on top of a base library file, oldest first, ignoring torn .tmp leftovers"""
+    return sorted(path for path in glob.glob(glob.escape(filename) + '.delta-*')
+                  if COMPLETE.search(path[len(filename):]))
+
+def _remove_torn(filename):
+    """Delete temporary files left by delta writes that never finished"""
+    for path in glob.glob(glob.escape(filename) + '.delta-*.tmp'):
+        os.remove(path)
+
+def _write_atomically(filename, write, mode='w'):
+    with open(filename + '.tmp', mode) as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(filename + '.tmp', filename)
+
+def write_delta(filename, library, changed, removed):
+    """Write the records changed and removed since the last save as the next delta of a base file.
+
+    changed and removed map each section to the ids involved; the records
+    themselves are read from the library. Returns the delta's file name.
+    """
+    _remove_torn(filename)
+    existing = delta_files(filename)
+    sequence = int(existing[-1].rsplit('-', 1)[1]) + 1 if existing else 1
+    delta = {
+        'name': library.name,
+        'upsert': {section: [getattr(library, section)[key].to_dict() for key in keys]
+                   for section, keys in changed.items() if keys},
+        'delete': {section: list(keys) for section, keys in removed.items() if keys},
+        'next_ids': {
+            'book': library.next_book_id,
+            'member': library.next_member_id,
+            'librarian': library.next_librarian_id,
+            'transaction': library.next_transaction_id
+        },
+        'generation': library.generation
+    }
+    path = f"{filename}.delta-{sequence:06d}"
+    _write_atomically(path, lambda f: json.dump(delta, f))
+    return path
+
+def read_deltas(filename):
+    """Yield each delta of a base file, oldest first"""
+    for path in delta_files(filename):
+        with open(path) as f:
+            yield json.load(f)
+
+def remove_deltas(filename):
+    for path in delta_files(filename):
+        os.remove(path)
+    _remove_torn(filename)
+
+def merge_deltas(filename):
+    """Fold the deltas of a base file into it and delete them.
+
+    The base is streamed record by record, so memory use grows with the
+    size of the deltas, not of the library. Replaying a delta is
+    idempotent, so a crash between replacing the base and deleting the
+    deltas loses nothing. Returns the number of deltas merged.
+    """
+    deltas = list(read_deltas(filename))
+    if not deltas:
+        return 0
+    upserts = {section: {} for section in KEYS}  # {section: {id: latest record}}
+    for delta in deltas:
+        for section, records in delta['upsert'].items():
+            for record in records:
+                upserts[section][record[KEYS[section]]] = record
+        for section, keys in delta['delete'].items():
+            for key in keys:
+                upserts[section][key] = None
+
+    def write_records(out, records):
+        out.write('[')
+        for i, record in enumerate(records):
+            out.write((',' if i else '') + '\n' + json.dumps(record))
+        out.write('\n]')
+
+    def merged(section, records):
+        pending = upserts[section]
+        for record in records:
+            record = pending.pop(record[KEYS[section]], record)
+            if record is not None:
+                yield record
+        # Records added since the base was written
+        yield from (record for record in pending.values() if record is not None)
+        pending.clear()
+
+    def merged_rows(section, chunks):
+        # Compact bases hold records as arrays with the id first
+        pending = upserts[section]
+        to_row = TO_ROW[section]
+        for chunk in chunks:
+            for row in chunk:
+                if row[0] in pending:
+                    record = pending.pop(row[0])
+                    if record is not None:
+                        yield to_row(RECORD_CLASSES[section].from_dict(record))
+                else:
+                    yield row
+        for record in pending.values():
+            if record is not None:
+                yield to_row(RECORD_CLASSES[section].from_dict(record))
+        pending.clear()
+
+    def write_compact(out):
+        codec = get_codec()
+        with open(filename, 'rb') as f:
+            sections = CompactReader(f, codec).sections()
+            header = dict(next(sections) for _ in range(3))
+            write_library(out, codec, deltas[-1].get('name', header['name']), deltas[-1].get('next_ids', header['next_ids']),
+                          ((key, merged_rows(key, chunks)) for key, chunks in sections),
+                          deltas[-1].get('generation', header['generation']))
+
+    def write(out):
+        with open(filename) as f:
+            out.write('{')
+            separator = ''
+            for key, value in JSONStreamReader(f).sections():
+                out.write(separator + '\n' + json.dumps(key) + ': ')
+                separator = ','
+                if key in KEYS:
+                    write_records(out, merged(key, value))
+                else:
+                    out.write(json.dumps(deltas[-1].get(key, value)))
+            for section in KEYS:
+                if upserts[section]:
+                    out.write(separator + '\n' + json.dumps(section) + ': ')
+                    write_records(out, merged(section, ()))
+            out.write('\n}\n')
+    if is_compact(filename):
+        _write_atomically(filename, write_compact, 'wb')
+    else:
+        _write_atomically(filename, write)
+    remove_deltas(filename)
+    return len(deltas)
@@ -0,0 +1,81 @@
+from bisect import bisect_left, bisect_right
+
+class FieldIndex:
+    """Ids of the books sharing each value of one field, optionally normalized.
+
+    The distinct keys are also kept in a sorted list, so ranges and
+    prefixes are found by binary search in O(log n + k). Books without a
+    value for the field are indexed under None, outside the sorted keys.
+    """
+
+    def __init__(self, field, normalize=None):
+        self.field = field
+        self.normalize = normalize
+        self.entries = {}  # {key: {book_id: None}}
+        self.keys = []  # distinct keys other than None, sorted
+
+    @classmethod
+    def build(cls, field, books, normalize=None):
+        index = cls(field, normalize)
+        entries = index.entries
+        for book in books:
+            entries.setdefault(index.key(getattr(book, field)), {})[book.book_id] = None
+        # One sort instead of an insertion per key
+        index.keys = sorted(key for key in entries if key is not None)
+        return index
+
+    def key(self, value):
+        if value is None:
+            return None
+        return self.normalize(value) if self.normalize else value
+
+    def add(self, book):
+        key = self.key(getattr(book, self.field))
+        ids = self.entries.get(key)
+        if ids is None:
+            ids = self.entries[key] = {}
+            if key is not None:
+                self.keys.insert(bisect_left(self.keys, key), key)
+        ids[book.book_id] = None
+
+    def remove(self, book):
+        key = self.key(getattr(book, self.field))
+        ids = self.entries.get(key)
+        if ids is not None:
+            ids.pop(book.book_id, None)
+            if not ids:
+                del self.entries[key]
+                if key is not None:
+                    del self.keys[bisect_left(self.keys, key)]
+
+    def lookup(self, value):
+        """Ids of the books whose field has the same key as value"""
+        return self.entries.get(self.key(value), {})
+
+    def key_range(self, low=None, high=None, include_low=True, include_high=True):
+        """Sorted keys between low and high; a bound of None is open"""
+        keys = self.keys
+        start = 0 if low is None else (bisect_left if include_low else bisect_right)(keys, low)
+        end = len(keys) if high is None else (bisect_right if include_high else bisect_left)(keys, high)
+        return keys[start:end]
+
+    def key_prefix(self, prefix):
+        """Sorted keys starting with a prefix, for string keys"""
+        keys = self.keys
+        start = end = bisect_left(keys, prefix)
+        while end < len(keys) and keys[end].startswith(prefix):
+            end += 1
+        return keys[start:end]
+
+    def ids(self, keys):
+        """Ids of the books under the given keys, in key order"""
+        entries = self.entries
+        return [book_id for key in keys for book_id in entries[key]]
+
+    def range(self, low=None, high=None, include_low=True, include_high=True):
+        """Ids of the books whose key lies between low and high, in key order"""
+        return self.ids(self.key_range(self.key(low), self.key(high), include_low, include_high))
+
+    def prefix(self, prefix):
+        """Ids of the books whose key starts with the normalized prefix, in key order"""
+        return self.ids(self.key_prefix(self.key(prefix)))
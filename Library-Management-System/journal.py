@@ -0,0 +1,55 @@
+import json
+import os
+
+class Journal:
+    """Append-only log of library mutations, one compact JSON record per line.
+
+    Each time the journal is emptied it starts with a generation record naming
+    the snapshot its mutations apply on top of.
+    """
+
+    def __init__(self, filename, sync_every=100):
+        self.filename = filename
+        self.sync_every = sync_every  # fsync after this many records
+        self.pending = 0  # records written since the last fsync
+        self.records = 0  # records in the journal since the last snapshot
+        self.file = open(filename, 'a')
+
+    def append(self, op, **data):
+        """Write one record, syncing to disk once a batch is complete"""
+        data['op'] = op
+        self.file.write(json.dumps(data, separators=(',', ':')) + '\n')
+        self.pending += 1
+        self.records += 1
+        if self.pending >= self.sync_every:
+            self.sync()
+
+    def sync(self):
+        """Flush buffered records and fsync them to disk"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending = 0
+
+    def truncate(self, generation):
+        """Drop every record, after they have been folded into the snapshot of this generation"""
+        self.file.close()
+        self.file = open(self.filename, 'w')
+        self.file.write(json.dumps({'op': 'generation', 'generation': generation}, separators=(',', ':')) + '\n')
+        self.sync()
+        self.records = 0
+
+    def close(self):
+        """Sync and close the journal file"""
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
+
+    @staticmethod
+    def read(filename):
+        """Yield the records of a journal file, stopping at a torn final write"""
+        with open(filename, 'r') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    break
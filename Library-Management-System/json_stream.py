@@ -0,0 +1,106 @@
+import json
+import re
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+class JSONStreamReader:
+    """Incremental reader for a JSON document whose top level is an object.
+
+    Values are decoded one at a time from a sliding buffer, and top-level
+    arrays are yielded element by element, so only one element has to be in
+    memory at once.
+    """
+
+    def __init__(self, f, chunk_size=1 << 20):
+        self.file = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def sections(self):
+        """Yield (key, value) for each top-level member.
+
+        Array values are yielded as iterators over their elements; any
+        elements the caller does not consume are skipped before moving on.
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            self._peek()
+            key = self._value()
+            self._expect(":")
+            if self._peek() == "[":
+                self.pos += 1
+                items = self._array_items()
+                yield key, items
+                for _ in items:
+                    pass
+            else:
+                yield key, self._value()
+            if self._next_separator("}"):
+                return
+
+    def _array_items(self):
+        if self._peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            self._peek()
+            yield self._value()
+            if self._next_separator("]"):
+                return
+
+    def _next_separator(self, closing):
+        """Consume a ',' or the closing bracket, returning True at the closing bracket"""
+        char = self._peek()
+        self.pos += 1
+        if char == closing:
+            return True
+        if char != ",":
+            raise json.JSONDecodeError(f"Expecting ',' or '{closing}'", self.buffer, self.pos - 1)
+        return False
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buffer, self.pos)
+        self.pos += 1
+
+    def _peek(self):
+        """Skip whitespace and return the next character without consuming it"""
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise json.JSONDecodeError("Unexpected end of data", self.buffer, self.pos)
+
+    def _value(self):
+        """Decode the next complete value, reading more data until it is whole"""
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and not self.eof and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def _fill(self):
+        """Append the next chunk to the buffer, dropping what was consumed"""
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
@@ -1,6 +1,8 @@
 from datetime import datetime, timedelta
 
 class Librarian:
+    __slots__ = ('librarian_id', 'name', 'email', '__weakref__')
+    
     def __init__(self, librarian_id, name, email):
         self.librarian_id = librarian_id
         self.name = name
@@ -29,19 +31,27 @@ class Librarian:
         """Process a book return transaction"""
         return library.return_book(member_id, book_id)
     
-    def generate_report(self, library, report_type="all"):
-        """Generate various reports"""
+    def process_borrow_many(self, library, requests, atomic=False):
+        """Process a batch of (member_id, book_id) borrows"""
+        return library.borrow_many(requests, self.librarian_id, atomic)
+    
+    def process_return_many(self, library, requests, atomic=False):
+        """Process a batch of (member_id, book_id) returns"""
+        return library.return_many(requests, atomic)
+    
+    def generate_report(self, library, report_type="all", page_size=None):
+        """Generate various reports as iterators, so large reports are never built in memory"""
         if report_type == "books":
-            return library.get_all_books()
+            return library.iter_books(page_size=page_size)
         elif report_type == "members":
-            return library.get_all_members()
+            return library.iter_members(page_size=page_size)
         elif report_type == "transactions":
-            return library.get_all_transactions()
+            return library.iter_transactions(page_size=page_size)
         else:
             return {
-                "books": library.get_all_books(),
-                "members": library.get_all_members(),
-                "transactions": library.get_all_transactions()
+                "books": library.iter_books(page_size=page_size),
+                "members": library.iter_members(page_size=page_size),
+                "transactions": library.iter_transactions(page_size=page_size)
             }
     
     def to_dict(self):
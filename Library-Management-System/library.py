@@ -1,9 +1,43 @@
+import heapq
 import json
+import os
+import time
+from collections import namedtuple
+from itertools import islice
+from contextlib import nullcontext
 from datetime import datetime
-from book import Book
+from book import Book, normalize_author, normalize_isbn
 from member import Member
 from librarian import Librarian
 from borrow_transaction import BorrowTransaction
+from search_index import SearchIndex
+from search_cache import SearchCache
+import metrics
+from journal import Journal
+from json_stream import JSONStreamReader
+from transaction_store import ORDER_COLUMNS, TransactionStore, TransactionRow, to_epoch
+from overdue import FinePolicy, compute_overdue
+from snapshot import LazySearchIndex, Snapshot, write_snapshot
+from archive import TransactionArchive
+from codec import get_codec, is_compact, library_sections, read_tables, write_library
+from delta import KEYS, RECORD_CLASSES, merge_deltas, read_deltas, remove_deltas, write_delta
+from field_index import FieldIndex
+from query import ORDERING, And, Comparison, Plan, Query
+
+QUERY_TABLES = ('books', 'members', 'transactions')
+SECTIONS = ('books', 'members', 'librarians', 'transactions')
+
+# Outcome of one request in borrow_many or return_many
+BatchResult = namedtuple('BatchResult', ['member_id', 'book_id', 'success', 'error', 'transaction_id'])
+
+def _stream(items, filter, page_size):
+    """Apply an optional filter to an iterator and optionally group it into lists of page_size"""
+    if filter is not None:
+        items = (item for item in items if filter(item))
+    if page_size is None:
+        return items
+    items = iter(items)
+    return iter(lambda: list(islice(items, page_size)), [])
 
 class Library:
     def __init__(self, name):
@@ -11,7 +45,30 @@ class Library:
         self.books = {}  # {book_id: Book object}
         self.members = {}  # {member_id: Member object}
         self.librarians = {}  # {librarian_id: Librarian object}
-        self.transactions = {}  # {transaction_id: BorrowTransaction object}
+        self.transactions = TransactionStore()  # {transaction_id: BorrowTransaction row view}
+        self.active_loans = {}  # {(book_id, member_id): open BorrowTransaction object}
+        self.book_loans = {}  # {book_id: open BorrowTransaction object}
+        self.due_heap = []  # min-heap of (due epoch, transaction_id, book_id) for open loans, with returned ones skipped lazily
+        self.borrower_heap = []  # min-heap of (-loan count, member_id), with stale entries skipped lazily
+        self.loan_limit = None  # Default most books a member may hold, or None for no limit
+        self.search_index = self._build_search_index(())
+        self.isbn_index = {}  # {normalized ISBN-13: book_id}
+        self.book_indexes = self._build_book_indexes(())  # {field: FieldIndex}, None until first needed
+        self.available_ids = {}  # {book_id: None}, insertion-ordered set of available books
+        self.borrowed_ids = {}  # {book_id: None}, insertion-ordered set of borrowed books
+        self.search_cache = None  # SearchCache of search_books results, if enabled
+        self.catalogue_version = 0  # Bumped whenever books are added, removed or replaced
+        self.metrics = None  # Metrics of the instrumented operations, if enabled
+        self.archive = None  # TransactionArchive holding old returned transactions, if any
+        self.codec = None  # Codec save_to_file writes the compact format with, or None for indented JSON
+        self.changed = {section: {} for section in SECTIONS}  # {section: {id: None}} written since the last save or load
+        self.removed = {section: {} for section in SECTIONS}  # {section: {id: None}} removed since the last save or load
+        self.saved_to = None  # File that changed and removed are relative to
+        self._watch_transactions()
+        self.journal = None  # Journal of mutations since the last snapshot, if enabled
+        self.journal_filename = None  # Snapshot file the journal belongs to
+        self.snapshot_every = None  # Compact the journal after this many records
+        self.generation = 0  # Bumped for each snapshot that folds in the journal; ties a journal to its snapshot
         self.next_book_id = 1
         self.next_member_id = 1
         self.next_librarian_id = 1
@@ -21,13 +78,41 @@ class Library:
         """Add a new book to the library"""
         if book.book_id in self.books:
             return False
+        isbn = normalize_isbn(book.isbn)
+        if isbn and isbn in self.isbn_index:
+            return False
         self.books[book.book_id] = book
+        if isbn:
+            self.isbn_index[isbn] = book.book_id
+        self.removed['books'].pop(book.book_id, None)
+        self._track_availability(book)
+        self.search_index.add(book)
+        self.catalogue_version += 1
+        if self.book_indexes is not None:
+            for index in self.book_indexes.values():
+                index.add(book)
+        self._log('add_book', book=book.to_dict())
         return True
     
     def remove_book(self, book_id):
         """Remove a book from the library"""
         if book_id in self.books:
-            del self.books[book_id]
+            book = self.books.pop(book_id)
+            self.isbn_index.pop(normalize_isbn(book.isbn), None)
+            self.available_ids.pop(book_id, None)
+            self.borrowed_ids.pop(book_id, None)
+            book.on_change = None
+            self.search_index.remove(book_id)
+            self.catalogue_version += 1
+            self.changed['books'].pop(book_id, None)
+            self.removed['books'][book_id] = None
+            if self.book_indexes is not None:
+                for index in self.book_indexes.values():
+                    index.remove(book)
+            transaction = self.book_loans.get(book_id)
+            if transaction:
+                self._unindex_loan(transaction)
+            self._log('remove_book', book_id=book_id)
             return True
         return False
     
@@ -36,6 +121,10 @@ class Library:
         if member.member_id in self.members:
             return False
         self.members[member.member_id] = member
+        self._watch_member(member)
+        self._member_changed(member)
+        self._count_loans(member)
+        self._log('add_member', member=member.to_dict())
         return True
     
     def add_librarian(self, librarian):
@@ -43,9 +132,11 @@ class Library:
         if librarian.librarian_id in self.librarians:
             return False
         self.librarians[librarian.librarian_id] = librarian
+        self.changed['librarians'][librarian.librarian_id] = None
+        self._log('add_librarian', librarian=librarian.to_dict())
         return True
     
-    def borrow_book(self, member_id, book_id, librarian_id):
+    def borrow_book(self, member_id, book_id, librarian_id, borrow_date=None):
         """Borrow a book"""
         if member_id not in self.members:
             return False, "Member not found"
@@ -59,27 +150,16 @@ class Library:
         
         if not book.available:
             return False, "Book is not available"
+        if self._at_loan_limit(member):
+            return False, "Member has reached the loan limit"
         
-        # Create transaction
-        transaction = BorrowTransaction(
-            self.next_transaction_id,
-            book_id,
-            member_id,
-            librarian_id,
-            datetime.now()
-        )
-        
-        # Update book and member status
-        book.borrow()
-        member.borrow_book(book_id)
-        
-        # Store transaction
-        self.transactions[self.next_transaction_id] = transaction
-        self.next_transaction_id += 1
+        with self._batch():
+            transaction = self._apply_borrow(member, book, librarian_id, self._allocate_transaction_ids(1),
+                                             borrow_date if borrow_date else datetime.now())
         
         return True, f"Book borrowed successfully. Transaction ID: {transaction.transaction_id}"
     
-    def return_book(self, member_id, book_id):
+    def return_book(self, member_id, book_id, return_date=None):
         """Return a borrowed book"""
         if member_id not in self.members:
             return False, "Member not found"
@@ -90,40 +170,416 @@ class Library:
         member = self.members[member_id]
         
         # Find the active transaction for this book and member
-        active_transaction = None
-        for transaction in self.transactions.values():
-            if (transaction.book_id == book_id and 
-                transaction.member_id == member_id and 
-                not transaction.is_returned):
-                active_transaction = transaction
-                break
+        active_transaction = self.active_loans.get((book_id, member_id))
         
         if not active_transaction:
             return False, "No active borrowing transaction found"
         
-        # Update transaction, book, and member
-        active_transaction.return_book()
-        book.return_book()
-        member.return_book(book_id)
+        with self._batch():
+            self._apply_return(member, book, active_transaction, return_date if return_date else datetime.now())
         
         return True, f"Book returned successfully. Transaction ID: {active_transaction.transaction_id}"
     
+    def borrow_many(self, requests, librarian_id, atomic=False, borrow_date=None):
+        """Borrow a batch of (member_id, book_id) pairs with one timestamp
+        
+        Returns one BatchResult per request, in order. With atomic=True nothing is
+        borrowed unless every request is valid; otherwise valid requests go ahead.
+        """
+        requests = list(requests)
+        borrow_date = borrow_date if borrow_date else datetime.now()
+        librarian_ok = librarian_id in self.librarians
+        members, books = {}, {}
+        claimed = set()  # books taken by earlier requests in this batch
+        taken = {}  # {member_id: books taken by earlier requests in this batch}
+        errors = []
+        for member_id, book_id in requests:
+            if member_id not in members:
+                members[member_id] = self.members.get(member_id)
+            if book_id not in books:
+                books[book_id] = self.books.get(book_id)
+            if members[member_id] is None:
+                errors.append("Member not found")
+            elif books[book_id] is None:
+                errors.append("Book not found")
+            elif not librarian_ok:
+                errors.append("Librarian not found")
+            elif not books[book_id].available or book_id in claimed:
+                errors.append("Book is not available")
+            elif self._at_loan_limit(members[member_id], taken.get(member_id, 0)):
+                errors.append("Member has reached the loan limit")
+            else:
+                claimed.add(book_id)
+                taken[member_id] = taken.get(member_id, 0) + 1
+                errors.append(None)
+        
+        if atomic and any(errors):
+            return [BatchResult(member_id, book_id, False, error or "Batch aborted", None)
+                    for (member_id, book_id), error in zip(requests, errors)]
+        
+        results = []
+        with self._batch():
+            transaction_id = self._allocate_transaction_ids(errors.count(None))
+            for (member_id, book_id), error in zip(requests, errors):
+                if error:
+                    results.append(BatchResult(member_id, book_id, False, error, None))
+                    continue
+                self._apply_borrow(members[member_id], books[book_id], librarian_id, transaction_id, borrow_date)
+                results.append(BatchResult(member_id, book_id, True, None, transaction_id))
+                transaction_id += 1
+        return results
+    
+    def return_many(self, requests, atomic=False, return_date=None):
+        """Return a batch of (member_id, book_id) pairs with one timestamp
+        
+        Returns one BatchResult per request, in order. With atomic=True nothing is
+        returned unless every request is valid; otherwise valid requests go ahead.
+        """
+        requests = list(requests)
+        return_date = return_date if return_date else datetime.now()
+        loans = []
+        errors = []
+        seen = set()
+        for member_id, book_id in requests:
+            loan = self.active_loans.get((book_id, member_id))
+            if loan is None or (book_id, member_id) in seen:
+                if member_id not in self.members:
+                    errors.append("Member not found")
+                elif book_id not in self.books:
+                    errors.append("Book not found")
+                else:
+                    errors.append("No active borrowing transaction found")
+            else:
+                seen.add((book_id, member_id))
+                errors.append(None)
+            loans.append(loan)
+        
+        if atomic and any(errors):
+            return [BatchResult(member_id, book_id, False, error or "Batch aborted", None)
+                    for (member_id, book_id), error in zip(requests, errors)]
+        
+        results = []
+        with self._batch():
+            for (member_id, book_id), loan, error in zip(requests, loans, errors):
+                if error:
+                    results.append(BatchResult(member_id, book_id, False, error, None))
+                    continue
+                self._apply_return(self.members[member_id], self.books[book_id], loan, return_date)
+                results.append(BatchResult(member_id, book_id, True, None, loan.transaction_id))
+        return results
+    
+    def _batch(self):
+        """Context manager grouping the writes of one operation; the dict backend needs none"""
+        return nullcontext()
+    
+    def _allocate_transaction_ids(self, count):
+        """Reserve a block of consecutive transaction IDs and return the first"""
+        first = self.next_transaction_id
+        self.next_transaction_id += count
+        return first
+    
+    def _apply_borrow(self, member, book, librarian_id, transaction_id, borrow_date):
+        """Record a validated loan and return its transaction"""
+        transaction = BorrowTransaction(transaction_id, book.book_id, member.member_id, librarian_id, borrow_date)
+        
+        # Update book and member status
+        book.borrow()
+        member.borrow_book(book.book_id)
+        self._count_loans(member)
+        
+        # Store transaction
+        self.transactions[transaction_id] = transaction
+        transaction = self.transactions[transaction_id]
+        self._index_loan(transaction)
+        self._log('borrow_book', member_id=member.member_id, book_id=book.book_id, librarian_id=librarian_id,
+                  borrow_date=transaction.borrow_date.isoformat())
+        return transaction
+    
+    def _apply_return(self, member, book, transaction, return_date):
+        """Close a validated loan"""
+        transaction.return_book(return_date)
+        self._unindex_loan(transaction)
+        book.return_book()
+        member.return_book(book.book_id)
+        self._count_loans(member)
+        self._log('return_book', member_id=member.member_id, book_id=book.book_id,
+                  return_date=transaction.return_date.isoformat())
+    
+    def _at_loan_limit(self, member, pending=0):
+        """Check whether a member already holds as many books as allowed"""
+        limit = member.loan_limit if member.loan_limit is not None else self.loan_limit
+        return limit is not None and len(member.borrowed_books) + pending >= limit
+    
+    def _count_loans(self, member):
+        """Record a member's current loan count in the top-borrowers heap"""
+        if member.borrowed_books:
+            heapq.heappush(self.borrower_heap, (-len(member.borrowed_books), member.member_id))
+        if len(self.borrower_heap) > 2 * len(self.members) + 64:
+            self.borrower_heap = [entry for entry in self.borrower_heap if self._is_current(entry)]
+            heapq.heapify(self.borrower_heap)
+    
+    def _is_current(self, entry):
+        member = self.members.get(entry[1])
+        return member is not None and len(member.borrowed_books) == -entry[0]
+    
+    def top_borrowers(self, n=10):
+        """Get up to n (member, loan count) pairs for the members holding the most books"""
+        top, seen = [], set()
+        while self.borrower_heap and len(top) < n:
+            entry = heapq.heappop(self.borrower_heap)
+            if entry[1] not in seen and self._is_current(entry):
+                seen.add(entry[1])
+                top.append(entry)
+        for entry in top:
+            heapq.heappush(self.borrower_heap, entry)
+        return [(self.members[member_id], -count) for count, member_id in top]
+    
+    def find_by_isbn(self, isbn):
+        """Find a book by ISBN-10 or ISBN-13, with or without hyphens"""
+        book_id = self.isbn_index.get(normalize_isbn(isbn))
+        return self.books.get(book_id) if book_id is not None else None
+    
+    def get_active_transaction(self, book_id):
+        """Get the open transaction for a book, or None if it is not on loan"""
+        return self.book_loans.get(book_id)
+    
+    def _index_loan(self, transaction):
+        """Record an open transaction in the active-loan indexes"""
+        self.active_loans[(transaction.book_id, transaction.member_id)] = transaction
+        self.book_loans[transaction.book_id] = transaction
+        heapq.heappush(self.due_heap, (to_epoch(transaction.due_date), transaction.transaction_id, transaction.book_id))
+    
+    def _index_loans(self, transactions):
+        """Rebuild the active-loan indexes from open transactions, heapifying the due heap once"""
+        self.active_loans = {}
+        self.book_loans = {}
+        self.due_heap = []
+        for transaction in transactions:
+            self.active_loans[(transaction.book_id, transaction.member_id)] = transaction
+            self.book_loans[transaction.book_id] = transaction
+            self.due_heap.append((to_epoch(transaction.due_date), transaction.transaction_id, transaction.book_id))
+        heapq.heapify(self.due_heap)
+    
+    def _unindex_loan(self, transaction):
+        """Drop a closed transaction from the active-loan indexes; its due heap entry goes stale"""
+        self.active_loans.pop((transaction.book_id, transaction.member_id), None)
+        if self.book_loans.get(transaction.book_id) is transaction:
+            del self.book_loans[transaction.book_id]
+        if len(self.due_heap) > 2 * len(self.book_loans) + 64:
+            self.due_heap = [entry for entry in self.due_heap if self._is_open(entry)]
+            heapq.heapify(self.due_heap)
+    
+    def _is_open(self, entry):
+        loan = self.book_loans.get(entry[2])
+        return loan is not None and loan.transaction_id == entry[1]
+    
+    def _due_between(self, low, high=None, n=None):
+        """Open loans due in [low, high), earliest first, at most n
+        
+        The heap is walked best first from its root without popping anything,
+        so queries never change it. A walk visits only the entries due before
+        the last loan it returns, O((m + k) log m) for m entries due before
+        low and k results; borrowing costs O(log n) and returning O(1).
+        """
+        heap = self.due_heap
+        found = []
+        frontier = [(heap[0], 0)] if heap else []  # (entry, position in heap)
+        while frontier and (n is None or len(found) < n):
+            entry, i = heapq.heappop(frontier)
+            if high is not None and entry[0] >= high:
+                break
+            if entry[0] >= low and self._is_open(entry):
+                found.append(self.transactions[entry[1]])
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+        return found
+    
+    def next_due(self, n=1, as_of=None):
+        """Get the n open loans that fall due next, at or after as_of, earliest first"""
+        return self._due_between(to_epoch(as_of if as_of else datetime.now()), n=n)
+    
+    def overdue_since(self, since, as_of=None):
+        """Get open loans that fell due at or after since and before as_of, earliest due first"""
+        return self._due_between(to_epoch(since), to_epoch(as_of if as_of else datetime.now()))
+    
+    def overdue_alerts(self, clock=datetime.now, sleep=time.sleep, max_wait=60):
+        """Yield open loans as they cross their due date, sleeping until the next one is due"""
+        cursor = datetime.min  # loans due before this have been reported
+        while True:
+            now = clock()
+            if now > cursor:
+                yield from self.overdue_since(cursor, now)
+                cursor = now
+            upcoming = self.next_due(1, now)
+            wait = max_wait
+            if upcoming:
+                wait = min(max_wait, max((upcoming[0].due_date - now).total_seconds(), 0))
+            sleep(wait)
+    
     def get_all_books(self):
         """Get all books"""
         return list(self.books.values())
     
     def get_available_books(self):
         """Get all available books"""
-        return [book for book in self.books.values() if book.available]
+        return [self.books[book_id] for book_id in self.available_ids]
     
     def get_borrowed_books(self):
         """Get all borrowed books"""
-        return [book for book in self.books.values() if not book.available]
+        return [self.books[book_id] for book_id in self.borrowed_ids]
+    
+    def get_status(self):
+        """Get library counters without building any lists"""
+        return {
+            'total_books': len(self.books),
+            'available_books': len(self.available_ids),
+            'borrowed_books': len(self.borrowed_ids),
+            'total_members': len(self.members),
+            'total_librarians': len(self.librarians),
+            'total_transactions': len(self.transactions)
+        }
+    
+    def _track_availability(self, book):
+        """Register a book in the availability sets and follow its changes"""
+        book.on_change = self._availability_changed
+        self._availability_changed(book)
+    
+    def _availability_changed(self, book):
+        """Move a book between the available and borrowed sets"""
+        self.changed['books'][book.book_id] = None
+        if book.available:
+            self.borrowed_ids.pop(book.book_id, None)
+            self.available_ids[book.book_id] = None
+        else:
+            self.available_ids.pop(book.book_id, None)
+            self.borrowed_ids[book.book_id] = None
+    
+    def _watch_member(self, member):
+        member.on_change = self._member_changed
+    
+    def _member_changed(self, member):
+        self.changed['members'][member.member_id] = None
+    
+    def _watch_transactions(self):
+        self.transactions.on_change = self._transaction_changed
+    
+    def _transaction_changed(self, transaction_id):
+        self.changed['transactions'][transaction_id] = None
+    
+    def _reset_changes(self, filename):
+        """Start tracking changes afresh, relative to filename (None if no file holds the current state)"""
+        self.changed = {section: {} for section in SECTIONS}
+        self.removed = {section: {} for section in SECTIONS}
+        self.saved_to = filename
     
     def get_all_members(self):
         """Get all members"""
         return list(self.members.values())
     
+    def iter_books(self, filter=None, available=None, page_size=None):
+        """Iterate over books, building each one only when it is reached
+        
+        `filter` is an optional predicate, `available` limits the scan to
+        available (True) or borrowed (False) books, and with `page_size` the
+        iterator yields lists of up to that many books.
+        """
+        return _stream(self._select_books(available), filter, page_size)
+    
+    def iter_members(self, filter=None, page_size=None):
+        """Iterate over members, optionally filtered and in pages"""
+        return _stream(self._stream_values(self.members), filter, page_size)
+    
+    def iter_transactions(self, filter=None, order=None, page_size=None):
+        """Iterate over transactions, optionally filtered, ordered and in pages
+        
+        `order` names a field (transaction_id, book_id, member_id,
+        borrow_date, due_date or return_date), with a leading '-' for
+        descending order. Without it transactions come in ID order.
+        """
+        if order is not None and order.lstrip('-') not in ORDER_COLUMNS:
+            raise ValueError(f"Cannot order transactions by {order}")
+        return _stream(self._select_transactions(order), filter, page_size)
+    
+    @staticmethod
+    def _stream_values(table):
+        """Values of a table, without keeping lazily loaded ones in memory"""
+        return table.peek_values() if hasattr(table, 'peek_values') else table.values()
+    
+    def _select_books(self, available):
+        if available is None:
+            return self._stream_values(self.books)
+        # Walk the catalogue's keys instead of copying the availability set,
+        # which borrows and returns made during the walk may change
+        ids = self.available_ids if available else self.borrowed_ids
+        books = self.books
+        return (books[book_id] for book_id in books if book_id in ids)
+    
+    def _select_transactions(self, order):
+        if order is None:
+            return self.transactions.values()
+        return self.transactions.sorted_values(order.lstrip('-'), reverse=order.startswith('-'))
+    
+    def archive_transactions(self, before, directory=None):
+        """Move transactions returned before a cutoff into per-month archive segments
+        
+        Archived transactions leave the working set, so saves, loads, scans and
+        reports no longer pay for them; transaction_history() reads them back
+        when asked. Returns the number of transactions archived.
+        """
+        if directory is not None:
+            self.archive = TransactionArchive(directory)
+        if self.archive is None:
+            raise ValueError("No archive directory given")
+        old = list(self._archive_candidates(before))
+        if not old:
+            return 0
+        # Segments are synced before the transactions leave the working set;
+        # if we stop in between, transaction_history() skips the duplicates
+        self.archive.append(old)
+        self._drop_transactions({transaction.transaction_id for transaction in old})
+        self.compact_journal()
+        return len(old)
+    
+    def open_archive(self, directory):
+        """Use the archive segments in a directory for history queries"""
+        self.archive = TransactionArchive(directory)
+    
+    def transaction_history(self, start=None, end=None, filter=None, include_archive=True):
+        """Iterate over transactions borrowed in [start, end), archived ones first
+        
+        Only the archive segments for months in the range are read, and only
+        when include_archive is set.
+        """
+        def in_range(transaction):
+            return ((start is None or transaction.borrow_date >= start) and
+                    (end is None or transaction.borrow_date < end) and (filter is None or filter(transaction)))
+        
+        if include_archive and self.archive is not None:
+            for transaction in self.archive.scan(start, end):
+                if transaction.transaction_id not in self.transactions and (filter is None or filter(transaction)):
+                    yield transaction
+        for transaction in self.transactions.values():
+            if in_range(transaction):
+                yield transaction
+    
+    def _archive_candidates(self, before):
+        return (transaction for transaction in self.transactions.values()
+                if transaction.return_date is not None and transaction.return_date < before)
+    
+    def _drop_transactions(self, transaction_ids):
+        """Remove closed transactions, rebuilding the store so their rows are freed"""
+        kept = TransactionStore(transaction for transaction in self.transactions.values()
+                                if transaction.transaction_id not in transaction_ids)
+        self.transactions = kept
+        self._watch_transactions()
+        for transaction_id in transaction_ids:
+            self.changed['transactions'].pop(transaction_id, None)
+            self.removed['transactions'][transaction_id] = None
+        # Open loans are views over store rows, so point them at the new store
+        self.active_loans = {key: kept[loan.transaction_id] for key, loan in self.active_loans.items()}
+        self.book_loans = {book_id: kept[loan.transaction_id] for book_id, loan in self.book_loans.items()}
+    
     def get_all_librarians(self):
         """Get all librarians"""
         return list(self.librarians.values())
@@ -132,88 +588,523 @@ class Library:
         """Get all transactions"""
         return list(self.transactions.values())
     
+    def overdue_report(self, as_of=None, policy=None, include_returned=True):
+        """Compute days overdue and fines for every transaction in one pass over the date columns"""
+        store = self.transactions
+        return compute_overdue(store.ids, store.due_dates, store.return_dates,
+                               as_of if as_of else datetime.now(), policy if policy else FinePolicy(),
+                               include_returned)
+    
     def get_member_borrowed_books(self, member_id):
         """Get books borrowed by a specific member"""
         if member_id not in self.members:
             return []
         
-        member = self.members[member_id]
-        borrowed_books = []
-        for book_id in member.borrowed_books:
-            if book_id in self.books:
-                borrowed_books.append(self.books[book_id])
+        books = self.books
+        return [books[book_id] for book_id in self.members[member_id].borrowed_books if book_id in books]
+    
+    def _build_search_index(self, books):
+        """Build the search index over some books"""
+        return SearchIndex.build(books)
+    
+    def _build_book_indexes(self, books):
+        """Build the secondary indexes the query planner uses on book fields"""
+        books = list(books)
+        return {
+            'author': FieldIndex.build('author', books, normalize_author),
+            'publication_year': FieldIndex.build('publication_year', books)
+        }
+    
+    def query(self, table):
+        """Start a query over 'books', 'members' or 'transactions'
         
-        return borrowed_books
+        For example library.query('books').where(F.author == "Tolkien",
+        F.publication_year > 1950, F.available == True).all(), with F from query.
+        """
+        if table not in QUERY_TABLES:
+            raise ValueError(f"Cannot query {table}")
+        return Query(self, table)
     
-    def search_books(self, query):
-        """Search books by title or author"""
-        query = query.lower()
-        results = []
-        for book in self.books.values():
-            if (query in book.title.lower() or 
-                query in book.author.lower() or 
-                query in book.isbn.lower()):
-                results.append(book)
-        return results
+    def _plan_query(self, table, predicate):
+        """Answer a query from the most selective index on one of its terms, or by a scan"""
+        terms = predicate.conjuncts() if predicate is not None else []
+        paths = [path for path in (self._index_path(table, term) for term in terms) if path]
+        if table == 'books':
+            paths += [path for path in (self._range_path(terms), self._prefix_path(terms)) if path]
+        if not paths and table == 'books':
+            # Search candidates cost a search to count, so they are the last resort before a scan
+            paths = [path for path in (self._search_path(term) for term in terms) if path]
+        if not paths:
+            scan = {'books': self.iter_books, 'members': self.iter_members, 'transactions': self.iter_transactions}[table]
+            return Plan(f"Full scan of {table}", scan, len(getattr(self, table)), predicate)
+        
+        covered, access, records, estimate, exact = min(paths, key=lambda path: path[3])
+        residual = [term for term in terms if not exact or all(term is not other for other in covered)]
+        return Plan(access, records, estimate, residual[0] if len(residual) == 1 else (And(residual) if residual else None))
+    
+    def _index_path(self, table, term):
+        """Return ((term,), description, records, estimate, exact) for an index that answers a term, or None"""
+        if not isinstance(term, Comparison) or term.op not in ('==', 'in'):
+            return None
+        values = [term.value] if term.op == '==' else list(term.value)
+        field = term.field
+        if table == 'books':
+            if field == 'book_id':
+                ids, exact, access = [value for value in values if value in self.books], True, "Primary key lookup"
+            elif field == 'available' and term.op == '==' and isinstance(term.value, bool):
+                ids, exact, access = self.available_ids if term.value else self.borrowed_ids, True, "Availability set"
+            elif field == 'isbn':
+                ids = [self.isbn_index.get(normalize_isbn(value)) for value in values]
+                ids, exact, access = [book_id for book_id in ids if book_id is not None], False, "ISBN index"
+            elif field in ('author', 'publication_year'):
+                index = self._get_book_indexes()[field]
+                ids = {}
+                for value in values:
+                    ids.update(index.lookup(value))
+                exact, access = field == 'publication_year', f"{field} index"
+            else:
+                return None
+            books = self.books
+            return ((term,), f"{access} ({term})", lambda: (books[book_id] for book_id in list(ids) if book_id in books),
+                    len(ids), exact)
+        if table == 'members' and field == 'member_id':
+            members = [self.members[value] for value in values if value in self.members]
+            return (term,), f"Primary key lookup ({term})", lambda: members, len(members), True
+        if table == 'transactions':
+            if field == 'transaction_id':
+                transactions = [self.transactions[value] for value in values if value in self.transactions]
+                return (term,), f"Primary key lookup ({term})", lambda: transactions, len(transactions), True
+            if field == 'is_returned' and term.op == '==' and term.value is False:
+                # Read the return date column rather than the loan indexes, which drop loans of removed books;
+                # the indexes still give the estimate
+                transactions = self.transactions
+                return ((term,), f"Open-loan column scan ({term})", lambda: list(transactions.open_values()),
+                        len(self.book_loans), True)
+        return None
+    
+    def _range_path(self, terms):
+        """Answer every bound on publication_year at once from a slice of the sorted year index"""
+        covered = [term for term in terms if isinstance(term, Comparison) and term.field == 'publication_year'
+                   and term.op in ORDERING and term.value is not None]
+        if not covered:
+            return None
+        low = high = None  # (value, inclusive)
+        for term in covered:
+            bound = (term.value, term.op in ('>=', '<='))
+            if term.op in ('>', '>='):
+                if low is None or bound[0] > low[0] or (bound[0] == low[0] and not bound[1]):
+                    low = bound
+            elif high is None or bound[0] < high[0] or (bound[0] == high[0] and not bound[1]):
+                high = bound
+        index = self._get_book_indexes()['publication_year']
+        keys = index.key_range(low and low[0], high and high[0], low is None or low[1], high is None or high[1])
+        books = self.books
+        description = " AND ".join(str(term) for term in covered)
+        return (covered, f"publication_year range index ({description})",
+                lambda: (books[book_id] for book_id in index.ids(keys) if book_id in books),
+                sum(len(index.entries[key]) for key in keys), True)
+    
+    def _prefix_path(self, terms):
+        """Answer an author prefix from a slice of the sorted author index"""
+        for term in terms:
+            if isinstance(term, Comparison) and term.field == 'author' and term.op == 'startswith' and term.value.strip():
+                index = self._get_book_indexes()['author']
+                keys = index.key_prefix(index.key(term.value))
+                books = self.books
+                # Keys are normalized, so candidates are re-checked against the exact prefix
+                return ((term,), f"author prefix index ({term})",
+                        lambda: (books[book_id] for book_id in index.ids(keys) if book_id in books),
+                        sum(len(index.entries[key]) for key in keys), False)
+        return None
+    
+    def _search_path(self, term):
+        """Use the search index for a substring match on title, author or ISBN"""
+        if not isinstance(term, Comparison) or term.op != 'contains' or term.field not in ('title', 'author', 'isbn') or not term.value:
+            return None
+        # The search index matches any of the three fields, so candidates are re-checked
+        ids = self.search_index.search(term.value)
+        books = self.books
+        return ((term,), f"Search index candidates ({term})", lambda: (books[book_id] for book_id in ids if book_id in books),
+                len(ids), False)
+    
+    def _get_book_indexes(self):
+        if self.book_indexes is None:
+            self.book_indexes = self._build_book_indexes(self._stream_values(self.books))
+        return self.book_indexes
+    
+    def search_books(self, query, limit=None):
+        """Search books by title, author or ISBN, best matches first"""
+        cache = self.search_cache
+        if cache is None:
+            return self._search(query, limit)
+        # Results are cached as book ids, so availability changes show through without invalidating them
+        book_ids = cache.get((query, limit), self.catalogue_version)
+        if book_ids is None:
+            books = self._search(query, limit)
+            cache.put((query, limit), self.catalogue_version, [book.book_id for book in books])
+            return books
+        return [self.books[book_id] for book_id in book_ids]
+    
+    def _search(self, query, limit):
+        return [self.books[book_id] for book_id in self.search_index.search(query, limit)]
+    
+    def enable_search_cache(self, capacity=1024, ttl=None):
+        """Cache up to capacity search_books results, each for at most ttl seconds if given"""
+        self.search_cache = SearchCache(capacity, ttl)
+    
+    def disable_search_cache(self):
+        self.search_cache = None
+    
+    def search_cache_stats(self):
+        """Hit, miss and eviction counts of the search cache, or None when it is disabled"""
+        return self.search_cache.stats() if self.search_cache is not None else None
+    
+    def enable_metrics(self):
+        """Start timing the operations in metrics.INSTRUMENTED, with fresh counts
+        
+        Timed wrappers are set on this instance only, so a library without
+        metrics runs its methods untouched.
+        """
+        self.disable_metrics()
+        self.metrics = metrics.Metrics()
+        for name in metrics.INSTRUMENTED:
+            setattr(self, name, self.metrics.timed(name, getattr(self, name)))
+    
+    def disable_metrics(self):
+        """Stop timing operations and drop the collected metrics"""
+        if self.metrics is not None:
+            for name in metrics.INSTRUMENTED:
+                self.__dict__.pop(name, None)
+        self.metrics = None
+    
+    def metrics_snapshot(self):
+        """Operation latencies and counts, table sizes and cache stats as a dict, or None when disabled"""
+        return metrics.snapshot(self, self.metrics) if self.metrics is not None else None
+    
+    def metrics_text(self):
+        """The metrics in the Prometheus text format, or None when disabled"""
+        return metrics.prometheus_text(self, self.metrics) if self.metrics is not None else None
+    
+    def set_codec(self, name='auto'):
+        """Save in the compact format with the named codec ('orjson', 'msgspec' or 'json'), or the
+        fastest one installed for 'auto'; None goes back to indented JSON. Returns the codec used.
+        
+        Compact files hold each record as an array with dates as epoch microseconds,
+        a few thousand records to a line. load_from_file reads either format.
+        """
+        self.codec = get_codec(None if name == 'auto' else name) if name is not None else None
+        return self.codec
     
     def save_to_file(self, filename):
-        """Save library data to JSON file"""
+        """Save library data to JSON file
+        
+        Saving over a journaled snapshot folds the journal into it: the
+        snapshot gets the next generation and the journal is emptied, so a
+        crash in between cannot replay mutations the snapshot already holds.
+        That holds too for a journal left next to filename by another session.
+        """
+        temp_filename = filename + '.tmp'
+        if self._has_journal(filename):
+            self.generation += 1
+        if self.codec is not None:
+            with open(temp_filename, 'wb') as f:
+                write_library(f, self.codec, self.name, self._next_ids(), library_sections(self), self.generation)
+                f.flush()
+                os.fsync(f.fileno())
+            self._replace_base(temp_filename, filename)
+            return
+        
         data = {
             'name': self.name,
             'books': [book.to_dict() for book in self.books.values()],
             'members': [member.to_dict() for member in self.members.values()],
             'librarians': [librarian.to_dict() for librarian in self.librarians.values()],
             'transactions': [transaction.to_dict() for transaction in self.transactions.values()],
-            'next_ids': {
-                'book': self.next_book_id,
-                'member': self.next_member_id,
-                'librarian': self.next_librarian_id,
-                'transaction': self.next_transaction_id
-            }
+            'next_ids': self._next_ids(),
+            'generation': self.generation
         }
         
-        with open(filename, 'w') as f:
+        # Write to a temporary file first so a crash never leaves a half-written copy
+        with open(temp_filename, 'w') as f:
             json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        self._replace_base(temp_filename, filename)
+    
+    def _next_ids(self):
+        return {
+            'book': self.next_book_id,
+            'member': self.next_member_id,
+            'librarian': self.next_librarian_id,
+            'transaction': self.next_transaction_id
+        }
+    
+    def _has_journal(self, filename):
+        """Whether filename has a journal, open here or left on disk, that a save must supersede"""
+        return (self.journal and filename == self.journal_filename) or os.path.exists(filename + '.journal')
     
-    def load_from_file(self, filename):
-        """Load library data from JSON file"""
+    def _empty_journal(self, filename):
+        """Drop the journal of filename once a save holds its mutations"""
+        if self.journal and filename == self.journal_filename:
+            self.journal.truncate(self.generation)
+        elif os.path.exists(filename + '.journal'):
+            os.remove(filename + '.journal')
+    
+    def _replace_base(self, temp_filename, filename):
+        os.replace(temp_filename, filename)
+        self._empty_journal(filename)
+        # The new base already holds whatever older deltas recorded
+        remove_deltas(filename)
+        self._reset_changes(filename)
+    
+    def save_incremental(self, filename):
+        """Save only the records changed since filename was last saved or loaded, as a delta file
+        
+        The delta goes next to filename and load_from_file applies it on top;
+        merge_deltas folds deltas back into the base. When filename does not
+        hold an earlier state of this library, a full save_to_file is done
+        instead. Returns the file written, or None if nothing changed.
+        """
+        if self.saved_to != filename or not os.path.exists(filename):
+            self.save_to_file(filename)
+            return filename
+        if not any(self.changed.values()) and not any(self.removed.values()):
+            return None
+        journaled = self._has_journal(filename)
+        if journaled:
+            self.generation += 1
+        path = write_delta(filename, self, self.changed, self.removed)
+        self._reset_changes(filename)
+        if journaled:
+            # The delta holds everything journaled since the base was written
+            self._empty_journal(filename)
+        return path
+    
+    def merge_deltas(self, filename=None):
+        """Fold the delta files of filename (by default the last one saved) into it; returns how many"""
+        return merge_deltas(filename if filename is not None else self.saved_to)
+    
+    def enable_journal(self, filename, sync_every=100, snapshot_every=None):
+        """Start journaling mutations next to a snapshot of the current state"""
+        self.disable_journal()
+        self.journal_filename = filename
+        self.snapshot_every = snapshot_every
+        self.journal = Journal(filename + '.journal', sync_every)
+        self.compact_journal()
+    
+    def disable_journal(self):
+        """Sync and close the journal, if one is open"""
+        if self.journal:
+            self.journal.close()
+        self.journal = None
+        self.journal_filename = None
+    
+    def flush_journal(self):
+        """Force journaled mutations to disk"""
+        if self.journal:
+            self.journal.sync()
+    
+    def compact_journal(self):
+        """Write a fresh snapshot and empty the journal"""
+        if self.journal:
+            self.save_to_file(self.journal_filename)
+    
+    def _log(self, op, **data):
+        """Append a mutation to the journal when journaling is enabled"""
+        if self.journal:
+            self.journal.append(op, **data)
+            if self.snapshot_every and self.journal.records >= self.snapshot_every:
+                self.compact_journal()
+    
+    def _replay_journal(self, filename):
+        """Apply the mutations recorded in a journal file on top of the loaded snapshot"""
+        for record in Journal.read(filename):
+            op = record['op']
+            if op == 'generation':
+                if record['generation'] < self.generation:
+                    return  # written before the snapshot, which already holds these mutations
+            elif op == 'add_book':
+                self.add_book(Book.from_dict(record['book']))
+            elif op == 'remove_book':
+                self.remove_book(record['book_id'])
+            elif op == 'add_member':
+                self.add_member(Member.from_dict(record['member']))
+            elif op == 'add_librarian':
+                self.add_librarian(Librarian.from_dict(record['librarian']))
+            elif op == 'borrow_book':
+                self.borrow_book(record['member_id'], record['book_id'], record['librarian_id'],
+                                 datetime.fromisoformat(record['borrow_date']))
+            elif op == 'return_book':
+                self.return_book(record['member_id'], record['book_id'],
+                                 datetime.fromisoformat(record['return_date']))
+    
+    def load_from_file(self, filename, sections=None, active_only=False):
+        """Load library data from JSON file, replaying its journal if there is one
+        
+        The file is read one record at a time, so the parsed document is never
+        held in memory next to the objects built from it. Pass `sections` to load
+        only some of 'books', 'members', 'librarians' and 'transactions', and
+        `active_only` to keep only open transactions. The journal is replayed
+        only on a full load.
+        """
+        self.disable_journal()
+        wanted = set(sections) if sections is not None else set(SECTIONS)
         try:
-            with open(filename, 'r') as f:
-                data = json.load(f)
-            
-            self.name = data['name']
-            
-            # Load books
-            self.books = {}
-            for book_data in data['books']:
-                book = Book.from_dict(book_data)
-                self.books[book.book_id] = book
-            
-            # Load members
-            self.members = {}
-            for member_data in data['members']:
-                member = Member.from_dict(member_data)
-                self.members[member.member_id] = member
-            
-            # Load librarians
-            self.librarians = {}
-            for librarian_data in data['librarians']:
-                librarian = Librarian.from_dict(librarian_data)
-                self.librarians[librarian.librarian_id] = librarian
-            
-            # Load transactions
-            self.transactions = {}
-            for transaction_data in data['transactions']:
-                transaction = BorrowTransaction.from_dict(transaction_data)
-                self.transactions[transaction.transaction_id] = transaction
-            
-            # Load next IDs
-            next_ids = data.get('next_ids', {})
-            self.next_book_id = next_ids.get('book', 1)
-            self.next_member_id = next_ids.get('member', 1)
-            self.next_librarian_id = next_ids.get('librarian', 1)
-            self.next_transaction_id = next_ids.get('transaction', 1)
-            
-            return True
-        except (FileNotFoundError, json.JSONDecodeError):
+            if is_compact(filename):
+                name, next_ids, generation, tables = read_tables(filename, self.codec or get_codec(), wanted, active_only)
+            else:
+                name, next_ids, generation, tables = self._read_json(filename, wanted, active_only, self.name)
+            for change in read_deltas(filename):
+                name, next_ids = change['name'], change['next_ids']
+                generation = change.get('generation', generation)
+                self._apply_delta(change, tables, wanted, active_only)
+        except (FileNotFoundError, ValueError):  # ValueError covers every codec's decode errors
+            return False
+        
+        self._install(name, tables['books'], tables['members'], tables['librarians'], tables['transactions'], next_ids)
+        self.generation = generation
+        self._reset_changes(filename if sections is None and not active_only else None)
+        
+        if sections is None and not active_only and os.path.exists(filename + '.journal'):
+            self._replay_journal(filename + '.journal')
+        
+        return True
+    
+    @staticmethod
+    def _read_json(filename, wanted, active_only, name):
+        """Stream the tables of an indented JSON library file; returns (name, next_ids, generation, {section: table})"""
+        books, members, librarians, transactions = {}, {}, {}, TransactionStore()
+        next_ids = {}
+        generation = 0
+        with open(filename, 'r') as f:
+            for key, value in JSONStreamReader(f).sections():
+                if key == 'name':
+                    name = value
+                elif key == 'next_ids':
+                    next_ids = value
+                elif key == 'generation':
+                    generation = value
+                elif key not in wanted:
+                    continue
+                elif key == 'books':
+                    for book_data in value:
+                        book = Book.from_dict(book_data)
+                        books[book.book_id] = book
+                elif key == 'members':
+                    for member_data in value:
+                        member = Member.from_dict(member_data)
+                        members[member.member_id] = member
+                elif key == 'librarians':
+                    for librarian_data in value:
+                        librarian = Librarian.from_dict(librarian_data)
+                        librarians[librarian.librarian_id] = librarian
+                elif key == 'transactions':
+                    for transaction_data in value:
+                        if active_only and transaction_data['return_date']:
+                            continue
+                        transaction = BorrowTransaction.from_dict(transaction_data)
+                        transactions[transaction.transaction_id] = transaction
+        return name, next_ids, generation, {'books': books, 'members': members, 'librarians': librarians, 'transactions': transactions}
+    
+    @staticmethod
+    def _apply_delta(change, tables, wanted, active_only):
+        """Apply one delta file's upserts and deletions to freshly loaded tables"""
+        for section, records in change['upsert'].items():
+            if section not in wanted:
+                continue
+            table, record_class = tables[section], RECORD_CLASSES[section]
+            for data in records:
+                key = data[KEYS[section]]
+                if section == 'transactions' and active_only and data['return_date']:
+                    if key in table:
+                        del table[key]
+                else:
+                    table[key] = record_class.from_dict(data)
+        for section, keys in change['delete'].items():
+            if section in wanted:
+                for key in keys:
+                    if key in tables[section]:
+                        del tables[section][key]
+    
+    def save_snapshot(self, filename):
+        """Save library data to a binary snapshot that open_snapshot can map without parsing"""
+        write_snapshot(self, filename)
+    
+    def open_snapshot(self, filename):
+        """Replace the library contents with a memory-mapped snapshot
+        
+        Nothing is parsed up front: books, members, librarians and transactions
+        are read from the mapped file when first used, and the search index is
+        built on the first search. Open loans are indexed straight away.
+        """
+        try:
+            snapshot = Snapshot(filename)
+        except (FileNotFoundError, ValueError):
             return False
+        self.disable_journal()
+        
+        self.name = snapshot.name
+        self.books = snapshot.books(self._watch_book)
+        self.isbn_index = snapshot.isbn_index()
+        self.available_ids, self.borrowed_ids = snapshot.availability()
+        self.search_index = LazySearchIndex(self._build_search_index, self.books)
+        self.book_indexes = None
+        self.catalogue_version += 1
+        self.members = snapshot.members(self._watch_member)
+        self.librarians = snapshot.librarians()
+        
+        self.transactions = snapshot.transactions()
+        self._watch_transactions()
+        self._reset_changes(None)
+        self._index_loans(TransactionRow(self.transactions, row) for row in snapshot.open_rows())
+        self.borrower_heap = [(-count, member_id) for member_id, count in snapshot.loan_counts() if count]
+        heapq.heapify(self.borrower_heap)
+        
+        self.next_book_id = snapshot.next_ids['book']
+        self.next_member_id = snapshot.next_ids['member']
+        self.next_librarian_id = snapshot.next_ids['librarian']
+        self.next_transaction_id = snapshot.next_ids['transaction']
+        return True
+    
+    def _watch_book(self, book):
+        """Follow availability changes of a book read from a snapshot"""
+        book.on_change = self._availability_changed
+    
+    def _install(self, name, books, members, librarians, transactions, next_ids):
+        """Replace the library contents with loaded tables and rebuild every index"""
+        self.name = name
+        
+        # Install books and rebuild their indexes
+        self.books = books
+        self.search_index = self._build_search_index(self.books.values())
+        self.book_indexes = self._build_book_indexes(self.books.values())
+        self.catalogue_version += 1
+        self.isbn_index = {}
+        self.available_ids = {}
+        self.borrowed_ids = {}
+        for book in self.books.values():
+            self._track_availability(book)
+            isbn = normalize_isbn(book.isbn)
+            if isbn:
+                self.isbn_index[isbn] = book.book_id
+        
+        self.members = members
+        for member in members.values():
+            self._watch_member(member)
+        self.librarians = librarians
+        self.borrower_heap = [(-len(member.borrowed_books), member.member_id)
+                              for member in members.values() if member.borrowed_books]
+        heapq.heapify(self.borrower_heap)
+        
+        # Install transactions and rebuild the active-loan indexes
+        if not isinstance(transactions, TransactionStore):
+            transactions = TransactionStore(transactions.values())
+        self.transactions = transactions
+        self._watch_transactions()
+        self._index_loans(self.transactions.open_values())
+        
+        # Load next IDs
+        self.next_book_id = next_ids.get('book', 1)
+        self.next_member_id = next_ids.get('member', 1)
+        self.next_librarian_id = next_ids.get('librarian', 1)
+        self.next_transaction_id = next_ids.get('transaction', 1)
@@ -0,0 +1,216 @@
+import asyncio
+import itertools
+import json
+import sys
+from datetime import datetime
+from library import Library
+from book import Book
+from member import Member
+from librarian import Librarian
+from overdue import OverdueReport
+
+# Library methods a client may call, by name. Clients never choose file paths: 'save' writes to the
+# save_path the server was started with.
+COMMANDS = {
+    'add_book', 'remove_book', 'add_member', 'add_librarian',
+    'borrow_book', 'return_book', 'borrow_many', 'return_many',
+    'search_books', 'find_by_isbn', 'get_active_transaction', 'get_status',
+    'get_all_books', 'get_available_books', 'get_borrowed_books',
+    'get_all_members', 'get_all_librarians', 'get_member_borrowed_books',
+    'overdue_report', 'next_due', 'overdue_since',
+}
+RECORD_ARGS = {'book': Book, 'member': Member, 'librarian': Librarian}  # sent as to_dict() output
+DATE_ARGS = {'borrow_date', 'return_date', 'as_of', 'since'}  # sent as ISO 8601 strings
+WRITE_BUFFER_LIMIT = 1 << 16  # stop handling a connection's requests while this much output is unread
+FAIRNESS_BATCH = 64  # let other connections run after this many pipelined requests
+
+def _encode(value):
+    """json.dumps hook for library objects"""
+    if hasattr(value, 'to_dict'):
+        return value.to_dict()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, OverdueReport):
+        return {'as_of': value.as_of.isoformat(), 'total_fines': value.total_fines, 'loans': list(value)}
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+class LibraryServerError(Exception):
+    """Raised by LibraryClient when the server rejects a request"""
+
+class LibraryServer:
+    """Serve one in-memory Library to many clients over a JSON-lines socket protocol.
+
+    Each request is one line, {"id": 1, "op": "borrow_book", "args": {...}},
+    answered by one line, {"id": 1, "ok": true, "result": ...}, or with
+    "ok": false and an "error" message. Clients may pipeline requests;
+    answers come back in order. A connection whose client stops reading
+    answers is paused, and the kernel socket buffers then push back on
+    the client. The 'save' request saves the library to save_path, if the
+    server was given one.
+    """
+
+    def __init__(self, library, host="127.0.0.1", port=8765, save_path=None):
+        self.library = library
+        self.save_path = save_path  # the only file clients can have the library saved to
+        self.host = host
+        self.port = port
+        self.server = None
+        self.connections = {}  # {StreamWriter: Task serving it}
+
+    async def start(self):
+        """Start listening; with port 0 the chosen port is stored in self.port"""
+        self.server = await asyncio.start_server(self._serve_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        """Stop listening, hang up on connected clients and wait for their handlers"""
+        self.server.close()
+        for writer in list(self.connections):
+            writer.close()
+        await asyncio.gather(*list(self.connections.values()), return_exceptions=True)
+        await self.server.wait_closed()
+
+    def handle_request(self, request):
+        """Run one decoded request against the library and return the response dict"""
+        request_id = request.get('id') if isinstance(request, dict) else None
+        try:
+            op, args = request['op'], dict(request.get('args', {}))
+            if op == 'save':
+                return {'id': request_id, 'ok': True, 'result': self._save(**args)}
+            if op not in COMMANDS:
+                raise ValueError(f"Unknown operation: {op}")
+            for key, record_class in RECORD_ARGS.items():
+                if key in args:
+                    args[key] = record_class.from_dict(args[key])
+            for key in DATE_ARGS & args.keys():
+                if args[key] is not None:
+                    args[key] = datetime.fromisoformat(args[key])
+            result = getattr(self.library, op)(**args)
+        except Exception as error:
+            return {'id': request_id, 'ok': False, 'error': f"{type(error).__name__}: {error}"}
+        return {'id': request_id, 'ok': True, 'result': result}
+
+    def _save(self):
+        if self.save_path is None:
+            raise ValueError("This server has no save path")
+        self.library.save_to_file(self.save_path)
+        return True
+
+    def handle_line(self, line):
+        """Answer one request line with one encoded response line"""
+        try:
+            response = self.handle_request(json.loads(line))
+        except json.JSONDecodeError as error:
+            response = {'id': None, 'ok': False, 'error': f"Invalid JSON: {error}"}
+        return json.dumps(response, default=_encode).encode() + b"\n"
+
+    async def _serve_connection(self, reader, writer):
+        self.connections[writer] = asyncio.current_task()
+        writer.transport.set_write_buffer_limits(high=WRITE_BUFFER_LIMIT)
+        try:
+            for count in itertools.count(1):
+                try:
+                    line = await reader.readline()
+                except ValueError:  # a line longer than the stream limit
+                    writer.write(json.dumps({'id': None, 'ok': False, 'error': "Request too long"}).encode() + b"\n")
+                    break
+                if not line:
+                    break
+                writer.write(self.handle_line(line))
+                # Waits only while the client is not reading what we already sent
+                await writer.drain()
+                if count % FAIRNESS_BATCH == 0:
+                    await asyncio.sleep(0)
+        except ConnectionError:
+            pass
+        finally:
+            del self.connections[writer]
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+class LibraryClient:
+    """Async client for LibraryServer that can keep many requests in flight"""
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.pending = {}  # {request id: Future}
+        self.ids = itertools.count(1)
+        self.receiver = asyncio.create_task(self._receive())
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=8765):
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def call(self, op, **args):
+        """Send one request and wait for its result.
+
+        Several calls may run at once, e.g. under asyncio.gather; they are
+        written back to back without waiting for earlier answers.
+        """
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.writer.write(json.dumps({'id': request_id, 'op': op, 'args': args}, default=_encode).encode() + b"\n")
+        await self.writer.drain()
+        return await future
+
+    async def _receive(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self.pending.pop(response['id'], None)
+                if future is None or future.done():
+                    continue
+                if response['ok']:
+                    future.set_result(response['result'])
+                else:
+                    future.set_exception(LibraryServerError(response['error']))
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Connection to library server closed"))
+            self.pending.clear()
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+        await self.receiver
+
+def main():
+    """Serve a library: python library_server.py [data_file] [port]; 'save' requests write back to data_file"""
+    library = Library("City Central Library")
+    if len(sys.argv) > 1 and sys.argv[1] != "-":
+        if not library.load_from_file(sys.argv[1]):
+            print(f"Could not load {sys.argv[1]}; starting empty")
+    save_path = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] != "-" else None
+    server = LibraryServer(library, port=int(sys.argv[2]) if len(sys.argv) > 2 else 8765, save_path=save_path)
+
+    async def run():
+        await server.start()
+        print(f"Serving {library.name} on {server.host}:{server.port}", flush=True)
+        await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,8 @@ from member import Member
 from librarian import Librarian
 import json
 
+REPORT_PAGE_SIZE = 20  # report lines shown before asking to continue
+
 def main():
     # Initialize library
     library = Library("City Central Library")
@@ -20,7 +22,8 @@ def main():
         print("4. Search Books")
         print("5. Save Data")
         print("6. Load Data")
-        print("7. Exit")
+        print("7. Show Metrics")
+        print("8. Exit")
         
         choice = input("Enter your choice: ")
         
@@ -37,6 +40,8 @@ def main():
         elif choice == '6':
             load_data(library)
         elif choice == '7':
+            show_metrics(library)
+        elif choice == '8':
             print("Thank you for using the Library Management System!")
             break
         else:
@@ -138,7 +143,7 @@ def add_book(library):
         if library.add_book(book):
             print("Book added successfully!")
         else:
-            print("Book ID already exists!")
+            print("Book ID or ISBN already exists!")
     except ValueError:
         print("Invalid input. Please enter valid numbers for ID and year.")
 
@@ -204,46 +209,47 @@ def generate_reports(library):
     print("3. All Transactions")
     print("4. Available Books")
     print("5. Borrowed Books")
+    print("6. Overdue Loans")
     
     choice = input("Enter report type: ")
     
     if choice == '1':
-        books = library.get_all_books()
-        print("\nAll Books:")
-        for book in books:
-            print(f"  - {book}")
+        print_pages("All Books", library.iter_books(page_size=REPORT_PAGE_SIZE))
     elif choice == '2':
-        members = library.get_all_members()
-        print("\nAll Members:")
-        for member in members:
-            print(f"  - {member}")
+        print_pages("All Members", library.iter_members(page_size=REPORT_PAGE_SIZE))
     elif choice == '3':
-        transactions = library.get_all_transactions()
-        print("\nAll Transactions:")
-        for transaction in transactions:
-            print(f"  - {transaction}")
+        print_pages("All Transactions", library.iter_transactions(page_size=REPORT_PAGE_SIZE))
     elif choice == '4':
-        books = library.get_available_books()
-        print("\nAvailable Books:")
-        for book in books:
-            print(f"  - {book}")
+        print_pages("Available Books", library.iter_books(available=True, page_size=REPORT_PAGE_SIZE))
     elif choice == '5':
-        books = library.get_borrowed_books()
-        print("\nBorrowed Books:")
-        for book in books:
-            print(f"  - {book}")
+        print_pages("Borrowed Books", library.iter_books(available=False, page_size=REPORT_PAGE_SIZE))
+    elif choice == '6':
+        report = library.overdue_report(include_returned=False)
+        print(f"\n{report}")
+        for transaction_id, days, fine in report:
+            print(f"  - Transaction ID: {transaction_id}, Days Overdue: {days}, Fine: {fine:.2f}")
     else:
         print("Invalid choice!")
 
+def print_pages(title, pages):
+    """Print a report one page at a time, asking before each further page"""
+    print(f"\n{title}:")
+    for number, page in enumerate(pages):
+        if number and input("Press Enter for more, or q to stop: ").strip().lower() == 'q':
+            break
+        for item in page:
+            print(f"  - {item}")
+
 def view_library_status(library):
     """View library status"""
+    status = library.get_status()
     print(f"\n=== {library.name} Status ===")
-    print(f"Total Books: {len(library.get_all_books())}")
-    print(f"Available Books: {len(library.get_available_books())}")
-    print(f"Borrowed Books: {len(library.get_borrowed_books())}")
-    print(f"Total Members: {len(library.get_all_members())}")
-    print(f"Total Librarians: {len(library.get_all_librarians())}")
-    print(f"Total Transactions: {len(library.get_all_transactions())}")
+    print(f"Total Books: {status['total_books']}")
+    print(f"Available Books: {status['available_books']}")
+    print(f"Borrowed Books: {status['borrowed_books']}")
+    print(f"Total Members: {status['total_members']}")
+    print(f"Total Librarians: {status['total_librarians']}")
+    print(f"Total Transactions: {status['total_transactions']}")
 
 def search_books(library):
     """Search for books"""
@@ -296,5 +302,24 @@ def load_data(library):
     else:
         print(f"Failed to load data from {filename}")
 
+def show_metrics(library):
+    """Show operation timings and table sizes"""
+    snapshot = library.metrics_snapshot()
+    if snapshot is None:
+        if input("\nMetrics are off. Turn them on now? (y/n): ").lower() == 'y':
+            library.enable_metrics()
+            print("Metrics enabled; operations from now on will be timed.")
+        return
+    
+    print(f"\n=== Metrics (last {snapshot['uptime_seconds']:.0f} s) ===")
+    print(f"{'Operation':<16}{'Calls':>8}{'Failed':>8}{'Mean ms':>10}{'p99 ms':>10}")
+    for name, operation in snapshot['operations'].items():
+        if operation['count']:
+            print(f"{name:<16}{operation['count']:>8}{operation['errors']:>8}"
+                  f"{operation['mean_seconds'] * 1e3:>10.3f}{operation['p99_seconds'] * 1e3:>10.3f}")
+    print("Table sizes: " + ", ".join(f"{table} {size}" for table, size in snapshot['tables'].items()))
+    if input("Show Prometheus text? (y/n): ").lower() == 'y':
+        print(library.metrics_text())
+
 if __name__ == "__main__":
     main()
@@ -1,23 +1,31 @@
 class Member:
-    def __init__(self, member_id, name, email, phone):
+    __slots__ = ('member_id', 'name', 'email', 'phone', 'borrowed_books', 'loan_limit', 'on_change', '__weakref__')
+    
+    def __init__(self, member_id, name, email, phone, loan_limit=None):
         self.member_id = member_id
         self.name = name
         self.email = email
         self.phone = phone
-        self.borrowed_books = []  # List of book IDs currently borrowed
+        self.borrowed_books = {}  # {book_id: None}, insertion-ordered set of book IDs currently borrowed
+        self.loan_limit = loan_limit  # Most books this member may hold, or None for the library default
+        self.on_change = None  # Called with the member whenever its loans change
     
     def __str__(self):
         return f"Member ID: {self.member_id}, Name: {self.name}, Email: {self.email}, Phone: {self.phone}, Borrowed Books: {len(self.borrowed_books)}"
     
     def borrow_book(self, book_id):
         if book_id not in self.borrowed_books:
-            self.borrowed_books.append(book_id)
+            self.borrowed_books[book_id] = None
+            if self.on_change:
+                self.on_change(self)
             return True
         return False
     
     def return_book(self, book_id):
         if book_id in self.borrowed_books:
-            self.borrowed_books.remove(book_id)
+            del self.borrowed_books[book_id]
+            if self.on_change:
+                self.on_change(self)
             return True
         return False
     
@@ -30,7 +38,8 @@ class Member:
             'name': self.name,
             'email': self.email,
             'phone': self.phone,
-            'borrowed_books': self.borrowed_books.copy()
+            'borrowed_books': list(self.borrowed_books),
+            'loan_limit': self.loan_limit
         }
     
     @classmethod
@@ -39,7 +48,8 @@ class Member:
             data['member_id'],
             data['name'],
             data['email'],
-            data['phone']
+            data['phone'],
+            data.get('loan_limit')
         )
-        member.borrowed_books = data['borrowed_books']
+        member.borrowed_books = dict.fromkeys(data['borrowed_books'])
         return member
@@ -0,0 +1,146 @@
+import time
+from bisect import bisect_left
+from functools import wraps
+
+# Upper bounds in seconds of the latency histogram buckets; slower calls go in a final +Inf bucket
+BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+           0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Library methods timed while metrics are enabled
+INSTRUMENTED = ('add_book', 'remove_book', 'add_member', 'borrow_book', 'return_book', 'borrow_many',
+                'return_many', 'search_books', 'find_by_isbn', 'overdue_report', 'save_to_file',
+                'load_from_file', 'save_snapshot', 'open_snapshot')
+
+def _failed(result):
+    """True for the False and (False, message) results Library methods report failures with"""
+    return result is False or (type(result) is tuple and len(result) == 2 and result[0] is False)
+
+class LatencyHistogram:
+    """Call count, total time and bucketed latencies of one operation"""
+
+    __slots__ = ('counts', 'count', 'total', 'errors')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile, or None before any call"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total_seconds': self.total,
+            'mean_seconds': self.total / self.count if self.count else None,
+            'p50_seconds': self.quantile(0.5),
+            'p99_seconds': self.quantile(0.99),
+            'buckets': dict(zip(BUCKETS + (float('inf'),), self.counts))
+        }
+
+class Metrics:
+    """Latency histograms and failure counts for the operations of one library.
+
+    Updates take no lock, so under heavy threading a count can now and then
+    miss a call.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.operations = {}  # {operation name: LatencyHistogram}
+        self.started = time.time()
+
+    def timed(self, name, method):
+        """Wrap a bound method so each call is timed and its failures counted"""
+        histogram = self.operations.setdefault(name, LatencyHistogram())
+        clock = self.clock
+
+        @wraps(method)
+        def timed_method(*args, **kwargs):
+            start = clock()
+            try:
+                result = method(*args, **kwargs)
+            except BaseException:
+                histogram.errors += 1
+                raise
+            finally:
+                histogram.observe(clock() - start)
+            if _failed(result):
+                histogram.errors += 1
+            return result
+        return timed_method
+
+def table_sizes(library):
+    """Rows in each library table and index worth watching"""
+    return {
+        'books': len(library.books),
+        'members': len(library.members),
+        'librarians': len(library.librarians),
+        'transactions': len(library.transactions),
+        'open_loans': len(library.book_loans)
+    }
+
+def snapshot(library, metrics):
+    """Plain-dict view of the metrics and current table sizes"""
+    return {
+        'uptime_seconds': time.time() - metrics.started,
+        'operations': {name: histogram.to_dict() for name, histogram in metrics.operations.items()},
+        'tables': table_sizes(library),
+        'search_cache': library.search_cache_stats()
+    }
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def prometheus_text(library, metrics):
+    """Metrics in the Prometheus text exposition format"""
+    library_label = f'library="{_label(library.name)}"'
+    lines = [
+        "# HELP library_operation_seconds Latency of library operations.",
+        "# TYPE library_operation_seconds histogram",
+    ]
+    for name, histogram in metrics.operations.items():
+        labels = f'{library_label},operation="{name}"'
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), histogram.counts):
+            cumulative += count
+            le = "+Inf" if bound == float('inf') else repr(bound)
+            lines.append(f'library_operation_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+        lines.append(f"library_operation_seconds_sum{{{labels}}} {histogram.total!r}")
+        lines.append(f"library_operation_seconds_count{{{labels}}} {histogram.count}")
+    lines += [
+        "# HELP library_operation_failures_total Library operations that failed or raised.",
+        "# TYPE library_operation_failures_total counter",
+    ]
+    for name, histogram in metrics.operations.items():
+        lines.append(f'library_operation_failures_total{{{library_label},operation="{name}"}} {histogram.errors}')
+    lines += [
+        "# HELP library_table_rows Rows in each library table.",
+        "# TYPE library_table_rows gauge",
+    ]
+    for table, size in table_sizes(library).items():
+        lines.append(f'library_table_rows{{{library_label},table="{table}"}} {size}')
+    cache = library.search_cache_stats()
+    if cache is not None:
+        lines += [
+            "# HELP library_search_cache_events_total Search cache lookups and removals.",
+            "# TYPE library_search_cache_events_total counter",
+        ]
+        for event in ('hits', 'misses', 'evictions', 'invalidations'):
+            lines.append(f'library_search_cache_events_total{{{library_label},event="{event}"}} {cache[event]}')
+    return "\n".join(lines) + "\n"
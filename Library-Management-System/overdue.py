@@ -0,0 +1,87 @@
+from transaction_store import DELETED, NO_DATE, MappedColumn, to_epoch
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; fall back to a single pass over the columns
+    np = None
+
+MICROSECONDS_PER_DAY = 86_400_000_000
+
+class FinePolicy:
+    """Fine charged per full day overdue, after a grace period and up to a cap"""
+
+    def __init__(self, daily_rate=0.25, grace_days=0, max_fine=None):
+        self.daily_rate = daily_rate
+        self.grace_days = grace_days
+        self.max_fine = max_fine
+
+    def fine(self, days_overdue):
+        """Fine for one loan"""
+        fine = max(days_overdue - self.grace_days, 0) * self.daily_rate
+        return min(fine, self.max_fine) if self.max_fine is not None else fine
+
+    def fines(self, days_overdue):
+        """Fines for a numpy array of days overdue"""
+        fines = np.maximum(days_overdue - self.grace_days, 0) * self.daily_rate
+        return np.minimum(fines, self.max_fine) if self.max_fine is not None else fines
+
+class OverdueReport:
+    """Overdue transactions as of a fixed time, as parallel columns"""
+
+    def __init__(self, as_of, transaction_ids, days_overdue, fines):
+        self.as_of = as_of
+        self.transaction_ids = list(transaction_ids)
+        self.days_overdue = list(days_overdue)
+        self.fines = list(fines)
+        self.total_fines = sum(self.fines)
+
+    def __len__(self):
+        return len(self.transaction_ids)
+
+    def __iter__(self):
+        return zip(self.transaction_ids, self.days_overdue, self.fines)
+
+    def __str__(self):
+        return f"Overdue as of {self.as_of.strftime('%Y-%m-%d %H:%M')}: {len(self)} loans, total fines {self.total_fines:.2f}"
+
+def _as_int64(column):
+    """View an int64 column as a numpy array, without copying where possible"""
+    if isinstance(column, MappedColumn):
+        return np.concatenate((np.frombuffer(column.base, dtype=np.int64), np.frombuffer(column.tail, dtype=np.int64)))
+    return np.asarray(column, dtype=np.int64)
+
+def compute_overdue(ids, due_dates, return_dates, as_of, policy, include_returned=True):
+    """Compute an OverdueReport from id, due-date and return-date columns in epoch microseconds.
+
+    A loan counts as overdue when it was still out after its due date at
+    `as_of`, or (with `include_returned`) was returned late before `as_of`,
+    matching BorrowTransaction.is_overdue and get_days_overdue.
+    """
+    now = to_epoch(as_of)
+    if np is not None:
+        ids = _as_int64(ids)
+        due = _as_int64(due_dates)
+        returned = _as_int64(return_dates)
+        still_out = (returned == NO_DATE) | (returned > now)
+        end = np.where(still_out, now, returned)
+        mask = (ids != DELETED) & (end > due)
+        if not include_returned:
+            mask &= still_out
+        days = (end[mask] - due[mask]) // MICROSECONDS_PER_DAY
+        return OverdueReport(as_of, ids[mask].tolist(), days.tolist(), policy.fines(days).tolist())
+
+    overdue_ids, overdue_days, fines = [], [], []
+    fine = policy.fine
+    for transaction_id, due, returned in zip(ids, due_dates, return_dates):
+        if returned == NO_DATE or returned > now:
+            end = now
+        elif include_returned:
+            end = returned
+        else:
+            continue
+        if end > due and transaction_id != DELETED:
+            days = (end - due) // MICROSECONDS_PER_DAY
+            overdue_ids.append(transaction_id)
+            overdue_days.append(days)
+            fines.append(fine(days))
+    return OverdueReport(as_of, overdue_ids, overdue_days, fines)
@@ -0,0 +1,208 @@
+import operator
+from itertools import islice
+
+# How each comparison operator tests a record's value against the query value
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda actual, values: actual in values,
+    'startswith': lambda actual, prefix: str(actual).lower().startswith(prefix.lower()),
+    'contains': lambda actual, text: text.lower() in str(actual).lower(),
+}
+ORDERING = {'<', '<=', '>', '>='}
+
+class Predicate:
+    """A condition on records that can be combined with &, | and ~"""
+
+    def __and__(self, other):
+        return And([self, other])
+
+    def __or__(self, other):
+        return Or([self, other])
+
+    def __invert__(self):
+        return Not(self)
+
+    def conjuncts(self):
+        """The terms that must all hold for this predicate to hold"""
+        return [self]
+
+class Comparison(Predicate):
+    """Compare one field of a record with a value"""
+
+    def __init__(self, field, op, value):
+        self.field = field
+        self.op = op
+        self.value = value
+
+    def matches(self, record):
+        actual = getattr(record, self.field)
+        if actual is None and self.op in ORDERING:
+            return False
+        return OPERATORS[self.op](actual, self.value)
+
+    def __str__(self):
+        value = sorted(self.value, key=repr) if self.op == 'in' else self.value
+        return f"{self.field} {self.op} {value!r}"
+
+class And(Predicate):
+    def __init__(self, terms):
+        self.terms = [part for term in terms for part in term.conjuncts()]
+
+    def matches(self, record):
+        return all(term.matches(record) for term in self.terms)
+
+    def conjuncts(self):
+        return list(self.terms)
+
+    def __str__(self):
+        return " AND ".join(f"({term})" if isinstance(term, Or) else str(term) for term in self.terms)
+
+class Or(Predicate):
+    def __init__(self, terms):
+        self.terms = list(terms)
+
+    def matches(self, record):
+        return any(term.matches(record) for term in self.terms)
+
+    def __str__(self):
+        return " OR ".join(f"({term})" if isinstance(term, And) else str(term) for term in self.terms)
+
+class Not(Predicate):
+    def __init__(self, term):
+        self.term = term
+
+    def matches(self, record):
+        return not self.term.matches(record)
+
+    def __str__(self):
+        return f"NOT ({self.term})"
+
+class Field:
+    """Builds comparisons on one record field, e.g. F.publication_year > 1950"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __eq__(self, value):
+        return Comparison(self.name, '==', value)
+
+    def __ne__(self, value):
+        return Comparison(self.name, '!=', value)
+
+    def __lt__(self, value):
+        return Comparison(self.name, '<', value)
+
+    def __le__(self, value):
+        return Comparison(self.name, '<=', value)
+
+    def __gt__(self, value):
+        return Comparison(self.name, '>', value)
+
+    def __ge__(self, value):
+        return Comparison(self.name, '>=', value)
+
+    __hash__ = None
+
+    def is_in(self, values):
+        return Comparison(self.name, 'in', frozenset(values))
+
+    def startswith(self, prefix):
+        """Case-insensitive prefix match"""
+        return Comparison(self.name, 'startswith', prefix)
+
+    def contains(self, text):
+        """Case-insensitive substring match"""
+        return Comparison(self.name, 'contains', text)
+
+class FieldNamespace:
+    def __getattr__(self, name):
+        return Field(name)
+
+F = FieldNamespace()
+
+class Plan:
+    """How a query will be answered: an access path, then a filter for what the path cannot check"""
+
+    def __init__(self, access, records, estimate, residual=None):
+        self.access = access  # description of the access path
+        self.records = records  # callable returning the candidate records
+        self.estimate = estimate  # number of candidate records, or None if unknown
+        self.residual = residual  # predicate still to check on each candidate, or None
+        self.steps = []  # further descriptions, e.g. sorting and limits
+
+    def execute(self):
+        records = self.records()
+        if self.residual is None:
+            return iter(records)
+        matches = self.residual.matches
+        return (record for record in records if matches(record))
+
+    def __str__(self):
+        lines = [self.access if self.estimate is None else f"{self.access} (~{self.estimate} rows)"]
+        if self.residual is not None:
+            lines.append(f"Filter: {self.residual}")
+        return "\n".join(lines + self.steps)
+
+class Query:
+    """A filtered, ordered and limited view of one library table, planned on first use.
+
+    Build one with Library.query('books' | 'members' | 'transactions') and
+    refine it with where(), order_by() and limit(); each returns a new query.
+    """
+
+    def __init__(self, library, table, predicate=None, order=None, count=None):
+        self.library = library
+        self.table = table
+        self.predicate = predicate
+        self.order = order
+        self.count_limit = count
+
+    def where(self, *predicates):
+        terms = ([self.predicate] if self.predicate is not None else []) + list(predicates)
+        predicate = terms[0] if len(terms) == 1 else And(terms)
+        return Query(self.library, self.table, predicate, self.order, self.count_limit)
+
+    def order_by(self, field):
+        """Order by a field, descending with a leading '-'"""
+        return Query(self.library, self.table, self.predicate, field, self.count_limit)
+
+    def limit(self, count):
+        return Query(self.library, self.table, self.predicate, self.order, count)
+
+    def plan(self):
+        plan = self.library._plan_query(self.table, self.predicate)
+        if self.order is not None:
+            plan.steps.append(f"Sort by {self.order}")
+        if self.count_limit is not None:
+            plan.steps.append(f"Limit {self.count_limit}")
+        return plan
+
+    def explain(self):
+        """Describe the plan that would answer this query"""
+        return str(self.plan())
+
+    def __iter__(self):
+        records = self.plan().execute()
+        if self.order is not None:
+            field = self.order.lstrip('-')
+            present, missing = [], []
+            for record in records:
+                (missing if getattr(record, field) is None else present).append(record)
+            # Records missing the field sort last in either direction
+            present.sort(key=operator.attrgetter(field), reverse=self.order.startswith('-'))
+            records = present + missing
+        return islice(records, self.count_limit)
+
+    def all(self):
+        return list(self)
+
+    def first(self):
+        return next(iter(self.limit(1)), None)
+
+    def count(self):
+        return sum(1 for _ in self)
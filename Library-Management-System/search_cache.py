@@ -0,0 +1,58 @@
+import time
+from collections import OrderedDict
+
+class SearchCache:
+    """Bounded cache of search results with LRU eviction and an optional time to live.
+
+    Each entry remembers the catalogue version it was computed at; an entry
+    from an older version is a miss, so a library invalidates every cached
+    result at once by bumping its version.
+    """
+
+    def __init__(self, capacity=1024, ttl=None, clock=time.monotonic):
+        if capacity < 1:
+            raise ValueError("Cache capacity must be at least 1")
+        self.capacity = capacity
+        self.ttl = ttl  # seconds an entry stays fresh, or None for no expiry
+        self.clock = clock
+        self.entries = OrderedDict()  # {(query, limit): (version, expiry time, result)}, least recent first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # entries dropped to make room
+        self.invalidations = 0  # entries dropped for being stale or expired
+
+    def get(self, key, version):
+        """Return the cached result for key at this catalogue version, or None"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[0] == version and (entry[1] is None or entry[1] > self.clock()):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            del self.entries[key]
+            self.invalidations += 1
+        self.misses += 1
+        return None
+
+    def put(self, key, version, result):
+        expiry = self.clock() + self.ttl if self.ttl is not None else None
+        self.entries[key] = (version, expiry, result)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
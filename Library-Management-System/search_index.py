@@ -0,0 +1,137 @@
+import heapq
+import re
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+NGRAM_SIZE = 3
+
+# Weight of a match in each searchable field
+FIELD_WEIGHTS = (3, 2, 1)  # title, author, isbn
+WHOLE_WORD_BONUS = 4
+
+def score_match(query, fields):
+    """Score lower-cased (title, author, isbn) against a query, or return 0 if it does not match"""
+    score = 0
+    for weight, text in zip(FIELD_WEIGHTS, fields):
+        if query not in text:
+            continue
+        if text == query:
+            score += 4 * weight
+        elif text.startswith(query):
+            score += 3 * weight
+        elif (" " + query) in text:
+            score += 2 * weight
+        else:
+            score += weight
+    return score
+
+class SearchIndex:
+    """Token and n-gram index over book titles, authors and ISBNs"""
+
+    def __init__(self):
+        self.fields = {}  # {book_id: (title, author, isbn) lower-cased}
+        self.tokens = {}  # {token: set of book_ids}
+        self.ngrams = {}  # {ngram: set of book_ids}
+
+    @classmethod
+    def build(cls, books):
+        """Build an index for many books at once"""
+        index = cls()
+        for book in books:
+            index.add(book)
+        return index
+
+    def __len__(self):
+        return len(self.fields)
+
+    def add(self, book):
+        """Index a book"""
+        if book.book_id in self.fields:
+            self.remove(book.book_id)
+        fields = (book.title.lower(), book.author.lower(), str(book.isbn).lower())
+        self.fields[book.book_id] = fields
+        for key in self._keys(fields):
+            self.tokens.setdefault(key, set()).add(book.book_id)
+        for gram in self._ngrams(fields):
+            self.ngrams.setdefault(gram, set()).add(book.book_id)
+
+    def remove(self, book_id):
+        """Drop a book from the index"""
+        fields = self.fields.pop(book_id, None)
+        if fields is None:
+            return False
+        for key in self._keys(fields):
+            self._discard(self.tokens, key, book_id)
+        for gram in self._ngrams(fields):
+            self._discard(self.ngrams, gram, book_id)
+        return True
+
+    def search(self, query, limit=None):
+        """Return ids of books whose title, author or ISBN contains the query, best matches first"""
+        if not query:
+            results = list(self.fields)
+            return results[:limit] if limit is not None else results
+        return [book_id for _, book_id in self.search_scored(query, limit)]
+
+    def search_scored(self, query, limit=None):
+        """Return sorted (-score, book_id) pairs for the best matches.
+
+        Lists from several indexes can be merged with heapq.merge to get the
+        ranking one index over all their books would give.
+        """
+        query = query.lower()
+        if not query:
+            return [(0, book_id) for book_id in sorted(self.fields)][:limit]
+
+        postings = [self.ngrams.get(gram) for gram in self._query_ngrams(query)]
+        if not all(postings):
+            return []
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for other in postings[1:]:
+            candidates &= other
+            if not candidates:
+                return []
+
+        token_postings = [self.tokens.get(token, ()) for token in TOKEN_PATTERN.findall(query)]
+        scored = []
+        for book_id in candidates:
+            score = score_match(query, self.fields[book_id])
+            if score:
+                if token_postings and all(book_id in postings for postings in token_postings):
+                    score += WHOLE_WORD_BONUS
+                scored.append((-score, book_id))
+        if limit is not None and limit < len(scored):
+            return heapq.nsmallest(limit, scored)
+        scored.sort()
+        return scored
+
+    @staticmethod
+    def _keys(fields):
+        keys = set()
+        for text in fields:
+            keys.update(TOKEN_PATTERN.findall(text))
+        return keys
+
+    @staticmethod
+    def _ngrams(fields):
+        grams = set()
+        for text in fields:
+            for size in range(1, NGRAM_SIZE + 1):
+                for i in range(len(text) - size + 1):
+                    grams.add(text[i:i + size])
+        return grams
+
+    @staticmethod
+    def _query_ngrams(query):
+        if len(query) <= NGRAM_SIZE:
+            return [query]
+        grams = {query[i:i + NGRAM_SIZE] for i in range(len(query) - NGRAM_SIZE + 1)}
+        return sorted(grams)
+
+    @staticmethod
+    def _discard(index, key, book_id):
+        postings = index.get(key)
+        if postings is not None:
+            postings.discard(book_id)
+            if not postings:
+                del index[key]
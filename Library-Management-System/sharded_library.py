@@ -0,0 +1,143 @@
+import heapq
+import multiprocessing
+import os
+from itertools import islice
+from book import Book
+from library import Library
+from search_index import SearchIndex
+
+ADD_CHUNK = 10_000  # books sent to a shard per message while bulk loading
+
+def _shard_worker(connection):
+    """Hold one shard's SearchIndex and answer requests until told to stop"""
+    index = SearchIndex()
+    while True:
+        op, payload = connection.recv()
+        if op == 'add':
+            for fields in payload:
+                index.add(Book(*fields))
+        elif op == 'remove':
+            index.remove(payload)
+        elif op == 'search':
+            queries, limit = payload
+            connection.send([index.search_scored(query, limit) for query in queries])
+        elif op == 'clear':
+            index = SearchIndex()
+        elif op == 'stop':
+            connection.close()
+            return
+
+class ShardedSearchIndex:
+    """SearchIndex split by book_id hash across persistent worker processes.
+
+    Updates are sent to the owning shard without waiting for an answer. A
+    search goes to every shard at once, each shard ranks its own top matches,
+    and the sorted lists are merged here, so the ranking matches a single
+    SearchIndex over all the books.
+    """
+
+    def __init__(self, shards):
+        context = multiprocessing.get_context("spawn")
+        self.connections = []
+        self.processes = []
+        for _ in range(shards):
+            parent_end, child_end = context.Pipe()
+            process = context.Process(target=_shard_worker, args=(child_end,), daemon=True)
+            process.start()
+            child_end.close()
+            self.connections.append(parent_end)
+            self.processes.append(process)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def _shard(self, book_id):
+        return self.connections[hash(book_id) % len(self.connections)]
+
+    @staticmethod
+    def _fields(book):
+        return (book.book_id, book.title, book.author, book.isbn, book.publication_year)
+
+    def add(self, book):
+        """Index a book in its shard"""
+        self._shard(book.book_id).send(('add', [self._fields(book)]))
+        self.count += 1
+
+    def add_many(self, books):
+        """Index many books, sending each shard its books in chunks"""
+        pending = [[] for _ in self.connections]
+        for book in books:
+            chunk = pending[hash(book.book_id) % len(self.connections)]
+            chunk.append(self._fields(book))
+            if len(chunk) == ADD_CHUNK:
+                self._shard(book.book_id).send(('add', chunk))
+                chunk.clear()
+            self.count += 1
+        for connection, chunk in zip(self.connections, pending):
+            if chunk:
+                connection.send(('add', chunk))
+
+    def remove(self, book_id):
+        """Drop a book from its shard"""
+        self._shard(book_id).send(('remove', book_id))
+        self.count -= 1
+        return True
+
+    def clear(self):
+        for connection in self.connections:
+            connection.send(('clear', None))
+        self.count = 0
+
+    def search(self, query, limit=None):
+        """Return matching book ids, best matches first"""
+        return self.search_many([query], limit)[0]
+
+    def search_many(self, queries, limit=None):
+        """Run several searches in one round trip to the shards"""
+        for connection in self.connections:
+            connection.send(('search', (queries, limit)))
+        answers = [connection.recv() for connection in self.connections]
+        results = []
+        for shard_results in zip(*answers):
+            merged = heapq.merge(*shard_results)
+            results.append([book_id for _, book_id in islice(merged, limit)])
+        return results
+
+    def close(self):
+        """Stop the worker processes"""
+        for connection, process in zip(self.connections, self.processes):
+            connection.send(('stop', None))
+            process.join()
+            connection.close()
+        self.connections = []
+        self.processes = []
+
+class ShardedLibrary(Library):
+    """Library whose catalogue search is spread over worker processes, one per core.
+
+    Books, members and loans stay in this process as usual; only the search
+    index is partitioned, so search CPU work runs in parallel outside the GIL.
+    Call close() to stop the workers.
+    """
+
+    def __init__(self, name, shards=None):
+        self.shard_count = shards or os.cpu_count()
+        super().__init__(name)
+
+    def _build_search_index(self, books):
+        """Reuse the running shards, refilled with the given books"""
+        if getattr(self, 'shards', None) is None:
+            self.shards = ShardedSearchIndex(self.shard_count)
+        else:
+            self.shards.clear()
+        self.shards.add_many(books)
+        return self.shards
+
+    def search_many(self, queries, limit=None):
+        """Search for several queries at once, returning one list of books per query"""
+        return [[self.books[book_id] for book_id in book_ids]
+                for book_ids in self.search_index.search_many(list(queries), limit)]
+
+    def close(self):
+        self.shards.close()
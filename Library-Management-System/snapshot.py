@@ -0,0 +1,316 @@
+import json
+import mmap
+import os
+import struct
+from array import array
+from collections.abc import MutableMapping
+from itertools import compress
+from book import Book, normalize_isbn
+from member import Member
+from librarian import Librarian
+from transaction_store import NO_DATE, TransactionStore, MappedColumn
+
+MAGIC = b"LMSNAP01"
+HEADER = struct.Struct("<8sQQ")  # magic, directory offset, directory length
+NONE = -(2 ** 63)  # stored in an integer column in place of None
+ALIGNMENT = 8
+TRANSACTION_COLUMNS = ('ids', 'book_ids', 'member_ids', 'librarian_ids', 'borrow_dates', 'due_dates', 'return_dates')
+INVERT = bytes([1, 0]) + bytes(254)  # bytes.translate table turning availability flags into borrowed flags
+
+class SnapshotWriter:
+    """Lay out fixed-width columns followed by one heap holding every string"""
+
+    def __init__(self, f):
+        self.file = f
+        self.columns = {}  # {name: [offset, count, typecode]}
+        self.heap = bytearray()
+        f.write(HEADER.pack(MAGIC, 0, 0))
+
+    def column(self, name, typecode, values):
+        data = values if isinstance(values, array) else array(typecode, values)
+        padding = -self.file.tell() % ALIGNMENT
+        self.file.write(bytes(padding))
+        self.columns[name] = [self.file.tell(), len(data), typecode]
+        self.file.write(data.tobytes())
+
+    def strings(self, name, values):
+        """Write a string column as heap offsets; string i is heap[offsets[i]:offsets[i + 1]]"""
+        heap = self.heap
+        ends = array('q', [len(heap)])
+        for value in values:
+            heap += value.encode()
+            ends.append(len(heap))
+        self.column(name, 'q', ends)
+
+    def finish(self, **metadata):
+        self.column('heap', 'B', array('B', self.heap))
+        directory = json.dumps(dict(metadata, columns=self.columns)).encode()
+        offset = self.file.tell()
+        self.file.write(directory)
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, offset, len(directory)))
+
+def _optional(value):
+    return NONE if value is None else value
+
+def _order(keys):
+    """Row numbers sorted by key, for binary search"""
+    return sorted(range(len(keys)), key=keys.__getitem__)
+
+def write_snapshot(library, filename):
+    """Write a library to a binary snapshot file"""
+    books = list(library.books.values())
+    members = list(library.members.values())
+    librarians = list(library.librarians.values())
+    transactions = library.transactions
+    if not isinstance(transactions, TransactionStore) or transactions.count != len(transactions.ids):
+        transactions = TransactionStore(transactions.values())
+
+    with open(filename + '.tmp', 'wb') as f:
+        writer = SnapshotWriter(f)
+
+        book_ids = [book.book_id for book in books]
+        writer.column('books.id', 'q', book_ids)
+        writer.column('books.order', 'q', _order(book_ids))
+        writer.strings('books.title', (book.title for book in books))
+        writer.strings('books.author', (book.author for book in books))
+        writer.strings('books.isbn', (str(book.isbn) for book in books))
+        writer.column('books.year', 'q', (_optional(book.publication_year) for book in books))
+        writer.column('books.available', 'B', (book.available for book in books))
+        isbn_keys = sorted((normalize_isbn(book.isbn), book.book_id) for book in books if normalize_isbn(book.isbn))
+        writer.strings('isbn.key', (isbn for isbn, _ in isbn_keys))
+        writer.column('isbn.book_id', 'q', (book_id for _, book_id in isbn_keys))
+
+        member_ids = [member.member_id for member in members]
+        writer.column('members.id', 'q', member_ids)
+        writer.column('members.order', 'q', _order(member_ids))
+        writer.strings('members.name', (member.name for member in members))
+        writer.strings('members.email', (member.email for member in members))
+        writer.strings('members.phone', (member.phone for member in members))
+        writer.column('members.loan_limit', 'q', (_optional(member.loan_limit) for member in members))
+        loan_ends, loans = array('q'), array('q')
+        for member in members:
+            loans.extend(member.borrowed_books)
+            loan_ends.append(len(loans))
+        writer.column('members.loan_ends', 'q', loan_ends)
+        writer.column('members.loans', 'q', loans)
+
+        librarian_ids = [librarian.librarian_id for librarian in librarians]
+        writer.column('librarians.id', 'q', librarian_ids)
+        writer.column('librarians.order', 'q', _order(librarian_ids))
+        writer.strings('librarians.name', (librarian.name for librarian in librarians))
+        writer.strings('librarians.email', (librarian.email for librarian in librarians))
+
+        for name in TRANSACTION_COLUMNS:
+            writer.column('transactions.' + name, 'q', getattr(transactions, name))
+        writer.column('transactions.open', 'q',
+                      (row for row, returned in enumerate(transactions.return_dates) if returned == NO_DATE))
+
+        writer.finish(name=library.name, dense=transactions.positions is None, next_ids={
+            'book': library.next_book_id,
+            'member': library.next_member_id,
+            'librarian': library.next_librarian_id,
+            'transaction': library.next_transaction_id
+        })
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(filename + '.tmp', filename)
+
+class StringColumn:
+    """Read-only sequence of the strings in one snapshot string column"""
+
+    def __init__(self, buffer, heap_offset, offsets):
+        self.buffer = buffer
+        self.heap_offset = heap_offset
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return str(self.buffer[self.heap_offset + start:self.heap_offset + end], 'utf-8')
+
+class SnapshotTable(MutableMapping):
+    """Dict-like table over snapshot rows that builds each value the first time it is used.
+
+    Built values are kept, so changes made to them stick. Values stored or
+    deleted later live in memory next to the untouched file rows.
+    """
+
+    def __init__(self, keys, build, order=None):
+        self.keys_at = keys  # key of each row
+        self.order = order  # rows sorted by key, or None if the rows already are
+        self.build = build  # turns a row number into its value
+        self.loaded = {}  # {key: value} built from the file or stored since
+        self.removed = set()  # keys with a file row that were deleted
+        self.count = len(keys)
+
+    def _row(self, key):
+        """Binary search for the file row holding a key, or None"""
+        keys, order = self.keys_at, self.order
+        low, high = 0, len(keys)
+        while low < high:
+            middle = (low + high) // 2
+            row = order[middle] if order is not None else middle
+            if keys[row] < key:
+                low = middle + 1
+            elif keys[row] == key:
+                return row
+            else:
+                high = middle
+        return None
+
+    def __getitem__(self, key):
+        value = self.loaded.get(key)
+        if value is None:
+            row = self._row(key) if key not in self.removed else None
+            if row is None:
+                raise KeyError(key)
+            value = self.loaded[key] = self.build(row)
+        return value
+
+    def __contains__(self, key):
+        return key in self.loaded or (key not in self.removed and self._row(key) is not None)
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self.count += 1
+        self.loaded[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.loaded.pop(key, None)
+        if self._row(key) is not None:
+            self.removed.add(key)
+        self.count -= 1
+
+    def __iter__(self):
+        removed = self.removed
+        for key in self.keys_at:
+            if key not in removed:
+                yield key
+        for key in list(self.loaded):
+            if key in removed or self._row(key) is None:
+                yield key
+
+    def __len__(self):
+        return self.count
+
+    def peek_values(self):
+        """Yield every value without keeping the ones not built yet"""
+        for key in self:
+            value = self.loaded.get(key)
+            yield value if value is not None else self.build(self._row(key))
+
+class LazySearchIndex:
+    """Stand-in for a search index that is built on the first search"""
+
+    def __init__(self, build, books):
+        self.build_index = build
+        self.books = books
+        self.index = None
+
+    def _built(self):
+        if self.index is None:
+            self.index = self.build_index(self.books.peek_values())
+        return self.index
+
+    def __len__(self):
+        return len(self.index) if self.index is not None else len(self.books)
+
+    def __getattr__(self, name):
+        return getattr(self._built(), name)
+
+    def add(self, book):
+        # An unbuilt index picks the book up from the table when it is built
+        if self.index is not None:
+            self.index.add(book)
+
+    def remove(self, book_id):
+        if self.index is not None:
+            self.index.remove(book_id)
+        return True
+
+    def search(self, query, limit=None):
+        return self._built().search(query, limit)
+
+class Snapshot:
+    """Memory-mapped snapshot file.
+
+    The file is mapped copy-on-write: readers in several processes share the
+    page cache, and in-place changes stay private to this process.
+    """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        magic, offset, length = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a library snapshot")
+        self.directory = json.loads(self.buffer[offset:offset + length])
+        self.name = self.directory['name']
+        self.next_ids = self.directory['next_ids']
+        self.heap_offset = self.directory['columns']['heap'][0]
+
+    def column(self, name):
+        offset, count, typecode = self.directory['columns'][name]
+        view = memoryview(self.buffer)[offset:offset + count * array(typecode).itemsize]
+        return view.cast(typecode)
+
+    def strings(self, name):
+        return StringColumn(self.buffer, self.heap_offset, self.column(name))
+
+    def books(self, on_load):
+        """Table of books; on_load is called with each book as it is built"""
+        ids, years, available = self.column('books.id'), self.column('books.year'), self.column('books.available')
+        titles, authors, isbns = self.strings('books.title'), self.strings('books.author'), self.strings('books.isbn')
+
+        def build(row):
+            year = years[row]
+            book = Book(ids[row], titles[row], authors[row], isbns[row], None if year == NONE else year, bool(available[row]))
+            on_load(book)
+            return book
+        return SnapshotTable(ids, build, self.column('books.order'))
+
+    def availability(self):
+        """Insertion-ordered sets of available and borrowed book ids, as the file has them"""
+        ids, flags = self.column('books.id'), self.column('books.available').tobytes()
+        return dict.fromkeys(compress(ids, flags)), dict.fromkeys(compress(ids, flags.translate(INVERT)))
+
+    def isbn_index(self):
+        book_ids = self.column('isbn.book_id')
+        return SnapshotTable(self.strings('isbn.key'), book_ids.__getitem__)
+
+    def members(self, on_load):
+        """Table of members; on_load is called with each member as it is built"""
+        ids, limits = self.column('members.id'), self.column('members.loan_limit')
+        names, emails, phones = self.strings('members.name'), self.strings('members.email'), self.strings('members.phone')
+        loan_ends, loans = self.column('members.loan_ends'), self.column('members.loans')
+
+        def build(row):
+            limit = limits[row]
+            member = Member(ids[row], names[row], emails[row], phones[row], None if limit == NONE else limit)
+            member.borrowed_books = dict.fromkeys(loans[loan_ends[row - 1] if row else 0:loan_ends[row]])
+            on_load(member)
+            return member
+        return SnapshotTable(ids, build, self.column('members.order'))
+
+    def loan_counts(self):
+        """Yield (member_id, number of books held) for every member"""
+        ends = self.column('members.loan_ends')
+        for row, member_id in enumerate(self.column('members.id')):
+            yield member_id, ends[row] - (ends[row - 1] if row else 0)
+
+    def librarians(self):
+        ids, names, emails = self.column('librarians.id'), self.strings('librarians.name'), self.strings('librarians.email')
+        return SnapshotTable(ids, lambda row: Librarian(ids[row], names[row], emails[row]), self.column('librarians.order'))
+
+    def transactions(self):
+        """TransactionStore over the mapped columns; new rows are appended in memory"""
+        columns = [MappedColumn(self.column('transactions.' + name)) for name in TRANSACTION_COLUMNS]
+        return TransactionStore.from_columns(columns, self.directory['dense'])
+
+    def open_rows(self):
+        return self.column('transactions.open')
@@ -0,0 +1,635 @@
+import json
+import sqlite3
+import weakref
+from contextlib import contextmanager
+from collections.abc import Mapping
+from datetime import datetime
+from book import Book, normalize_isbn
+from member import Member
+from librarian import Librarian
+from borrow_transaction import BorrowTransaction
+from library import Library, SECTIONS
+from json_stream import JSONStreamReader
+from codec import CompactReader, FROM_ROW, get_codec, is_compact
+from snapshot import Snapshot
+from delta import KEYS, read_deltas
+from overdue import FinePolicy, compute_overdue
+from transaction_store import NO_DATE, to_epoch
+from search_index import TOKEN_PATTERN, WHOLE_WORD_BONUS, score_match
+from query import And, Comparison, Not, Or, Plan
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS books (
+    book_id INTEGER PRIMARY KEY,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    isbn TEXT NOT NULL,
+    publication_year INTEGER,
+    available INTEGER NOT NULL,
+    isbn_key TEXT UNIQUE
+);
+CREATE INDEX IF NOT EXISTS books_available ON books (available);
+CREATE INDEX IF NOT EXISTS books_author ON books (author);
+CREATE INDEX IF NOT EXISTS books_author_prefix ON books (author COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS books_year ON books (publication_year);
+CREATE TABLE IF NOT EXISTS members (
+    member_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    email TEXT,
+    phone TEXT,
+    borrowed_books TEXT NOT NULL,
+    loan_limit INTEGER
+);
+CREATE INDEX IF NOT EXISTS members_loan_count ON members (json_array_length(borrowed_books));
+CREATE TABLE IF NOT EXISTS librarians (
+    librarian_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    email TEXT
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    transaction_id INTEGER PRIMARY KEY,
+    book_id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    librarian_id INTEGER NOT NULL,
+    borrow_date TEXT NOT NULL,
+    due_date TEXT NOT NULL,
+    return_date TEXT
+);
+CREATE INDEX IF NOT EXISTS transactions_book ON transactions (book_id);
+CREATE INDEX IF NOT EXISTS transactions_member ON transactions (member_id);
+CREATE INDEX IF NOT EXISTS transactions_due_date ON transactions (due_date);
+CREATE INDEX IF NOT EXISTS transactions_open ON transactions (book_id, member_id) WHERE return_date IS NULL;
+CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5 (
+    title, author, isbn, content='books', content_rowid='book_id', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+    INSERT INTO books_fts (rowid, title, author, isbn) VALUES (new.book_id, new.title, new.author, new.isbn);
+END;
+CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title, author, isbn) VALUES ('delete', old.book_id, old.title, old.author, old.isbn);
+END;
+CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author, isbn ON books BEGIN
+    INSERT INTO books_fts (books_fts, rowid, title, author, isbn) VALUES ('delete', old.book_id, old.title, old.author, old.isbn);
+    INSERT INTO books_fts (rowid, title, author, isbn) VALUES (new.book_id, new.title, new.author, new.isbn);
+END;
+"""
+
+INSERT_BOOK = "INSERT INTO books (book_id, title, author, isbn, publication_year, available, isbn_key) VALUES (?, ?, ?, ?, ?, ?, ?)"
+INSERT_MEMBER = "INSERT INTO members (member_id, name, email, phone, borrowed_books, loan_limit) VALUES (?, ?, ?, ?, ?, ?)"
+INSERT_LIBRARIAN = "INSERT INTO librarians (librarian_id, name, email) VALUES (?, ?, ?)"
+INSERT_TRANSACTION = "INSERT INTO transactions (transaction_id, book_id, member_id, librarian_id, borrow_date, due_date, return_date) VALUES (?, ?, ?, ?, ?, ?, ?)"
+BOOK_COLUMNS = "book_id, title, author, isbn, publication_year, available"
+# Fields each table can filter on in SQL; anything else is checked in Python
+QUERY_COLUMNS = {
+    'books': {'book_id', 'title', 'author', 'isbn', 'publication_year', 'available'},
+    'members': {'member_id', 'name', 'email', 'phone', 'loan_limit'},
+    'transactions': {'transaction_id', 'book_id', 'member_id', 'librarian_id', 'borrow_date', 'due_date', 'return_date'}
+}
+SQL_OPERATORS = {'==': '=', '!=': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+OPEN_LOANS = "SELECT t.* FROM transactions t JOIN books b ON b.book_id = t.book_id WHERE t.return_date IS NULL"
+
+def _date(value):
+    return datetime.fromisoformat(value) if value else None
+
+def _book_row(book):
+    isbn = normalize_isbn(book.isbn)
+    return (book.book_id, book.title, book.author, book.isbn, book.publication_year, int(book.available), isbn or None)
+
+def _member_row(member):
+    return (member.member_id, member.name, member.email, member.phone, json.dumps(list(member.borrowed_books)), member.loan_limit)
+
+def _librarian_row(librarian):
+    return (librarian.librarian_id, librarian.name, librarian.email)
+
+def _transaction_row(transaction):
+    return (transaction.transaction_id, transaction.book_id, transaction.member_id, transaction.librarian_id,
+            transaction.borrow_date.isoformat(), transaction.due_date.isoformat(),
+            transaction.return_date.isoformat() if transaction.return_date else None)
+
+def _sql_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return int(value) if isinstance(value, bool) else value
+
+def _like(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def _to_sql(predicate, columns):
+    """Compile a query predicate to (WHERE clause, params, exact), or None if SQL cannot narrow it.
+
+    An inexact clause matches a superset of the records, so the predicate
+    still has to be checked on each row.
+    """
+    if isinstance(predicate, Comparison):
+        field, op, value = predicate.field, predicate.op, predicate.value
+        if field == 'is_returned' and 'return_date' in columns and op == '==' and isinstance(value, bool):
+            return f"return_date IS {'NOT ' if value else ''}NULL", (), True
+        if field not in columns:
+            return None
+        if op in ('==', '!=') and value is None:
+            return f"{field} IS {'NOT ' if op == '!=' else ''}NULL", (), True
+        if op == '!=':
+            # Python's None != value holds, SQL's NULL != value does not
+            return f"({field} != ? OR {field} IS NULL)", (_sql_value(value),), True
+        if op in SQL_OPERATORS and value is not None:
+            return f"{field} {SQL_OPERATORS[op]} ?", (_sql_value(value),), True
+        if op == 'in' and None not in value:
+            values = tuple(_sql_value(item) for item in value)
+            return f"{field} IN ({', '.join('?' * len(values))})", values, True
+        if op in ('startswith', 'contains') and isinstance(value, str) and value.isascii():
+            # LIKE folds ASCII case only, hence the isascii() check
+            pattern = _like(value) + "%" if op == 'startswith' else "%" + _like(value) + "%"
+            return f"{field} LIKE ? ESCAPE '\\'", (pattern,), True
+        return None
+    if isinstance(predicate, And):
+        parts = [_to_sql(term, columns) for term in predicate.terms]
+        known = [part for part in parts if part is not None]
+        if not known:
+            return None
+        return (" AND ".join(f"({sql})" for sql, _, _ in known), tuple(param for _, params, _ in known for param in params),
+                len(known) == len(parts) and all(exact for _, _, exact in known))
+    if isinstance(predicate, Or):
+        parts = [_to_sql(term, columns) for term in predicate.terms]
+        if None in parts:
+            return None
+        return (" OR ".join(f"({sql})" for sql, _, _ in parts), tuple(param for _, params, _ in parts for param in params),
+                all(exact for _, _, exact in parts))
+    if isinstance(predicate, Not):
+        part = _to_sql(predicate.term, columns)
+        if part is None or not part[2]:
+            return None
+        return f"NOT ({part[0]})", part[1], True
+    return None
+
+class SQLiteTable(Mapping):
+    """Read-only dict-like view of a table that hydrates rows into entity objects on access"""
+
+    def __init__(self, connection, table, key, columns, from_row):
+        self.connection = connection
+        self.table = table
+        self.key = key
+        self.columns = columns
+        self.from_row = from_row
+        self.cache = weakref.WeakValueDictionary()  # one live object per row
+
+    def hydrate(self, row):
+        """Return the live object for a row, creating it if needed"""
+        entity = self.cache.get(row[0])
+        if entity is None:
+            entity = self.from_row(row)
+            self.cache[row[0]] = entity
+        return entity
+
+    def select(self, where="1", params=(), order=None, limit=-1):
+        """Yield the objects for the rows matching a WHERE clause"""
+        sql = f"SELECT {self.columns} FROM {self.table} WHERE {where} ORDER BY {order or self.key} LIMIT {int(limit)}"
+        for row in self.connection.execute(sql, params):
+            yield self.hydrate(row)
+
+    def forget(self, key=None):
+        """Drop cached objects after their rows were deleted or replaced"""
+        if key is None:
+            self.cache = weakref.WeakValueDictionary()
+        else:
+            self.cache.pop(key, None)
+
+    def __getitem__(self, key):
+        entity = self.cache.get(key)
+        if entity is not None:
+            return entity
+        row = self.connection.execute(
+            f"SELECT {self.columns} FROM {self.table} WHERE {self.key} = ?", (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self.hydrate(row)
+
+    def __contains__(self, key):
+        return self.connection.execute(
+            f"SELECT 1 FROM {self.table} WHERE {self.key} = ?", (key,)).fetchone() is not None
+
+    def __iter__(self):
+        for (key,) in self.connection.execute(f"SELECT {self.key} FROM {self.table} ORDER BY {self.key}"):
+            yield key
+
+    def __len__(self):
+        return self.connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def values(self):
+        return self.select()
+
+    def items(self):
+        return ((getattr(entity, self.key), entity) for entity in self.select())
+
+class OpenLoanView(Mapping):
+    """Dict-like view of open transactions keyed by book_id or by (book_id, member_id)"""
+
+    def __init__(self, transactions, by_member):
+        self.transactions = transactions
+        self.by_member = by_member
+
+    def _where(self, key):
+        if self.by_member:
+            return OPEN_LOANS + " AND t.book_id = ? AND t.member_id = ?", key
+        return OPEN_LOANS + " AND t.book_id = ?", (key,)
+
+    def __getitem__(self, key):
+        sql, params = self._where(key)
+        row = self.transactions.connection.execute(sql, params).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self.transactions.hydrate(row)
+
+    def __iter__(self):
+        for row in self.transactions.connection.execute(OPEN_LOANS):
+            yield (row[1], row[2]) if self.by_member else row[1]
+
+    def __len__(self):
+        return self.transactions.connection.execute(
+            "SELECT COUNT(*) FROM (" + OPEN_LOANS + ")").fetchone()[0]
+
+class SQLiteLibrary(Library):
+    """Library whose books, members, librarians and transactions live in an SQLite database"""
+
+    def __init__(self, name, filename=":memory:"):
+        # The base class sets up every attribute its methods expect; the tables are then replaced by the database
+        super().__init__(name)
+        self.connection = sqlite3.connect(filename, cached_statements=256)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        if "loan_limit" not in {row[1] for row in self.connection.execute("PRAGMA table_info(members)")}:
+            # Databases created before per-member loan limits
+            self.connection.execute("ALTER TABLE members ADD COLUMN loan_limit INTEGER")
+
+        self.books = SQLiteTable(self.connection, "books", "book_id", BOOK_COLUMNS, self._book_from_row)
+        self.members = SQLiteTable(self.connection, "members", "member_id", "*", self._member_from_row)
+        self.librarians = SQLiteTable(self.connection, "librarians", "librarian_id", "*", self._librarian_from_row)
+        self.transactions = SQLiteTable(self.connection, "transactions", "transaction_id", "*", self._transaction_from_row)
+        self.active_loans = OpenLoanView(self.transactions, by_member=True)
+        self.book_loans = OpenLoanView(self.transactions, by_member=False)
+
+        self.name = self._get_meta('name', name)
+        self.next_book_id = int(self._get_meta('next_book_id', 1))
+        self.next_member_id = int(self._get_meta('next_member_id', 1))
+        self.next_librarian_id = int(self._get_meta('next_librarian_id', 1))
+        self.next_transaction_id = int(self._get_meta('next_transaction_id', 1))
+        with self.connection:
+            self._save_meta()
+
+    def close(self):
+        """Close the database connection"""
+        self.connection.close()
+
+    def _get_meta(self, key, default):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _save_meta(self):
+        self.connection.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [
+            ('name', self.name),
+            ('next_book_id', str(self.next_book_id)),
+            ('next_member_id', str(self.next_member_id)),
+            ('next_librarian_id', str(self.next_librarian_id)),
+            ('next_transaction_id', str(self.next_transaction_id))
+        ])
+
+    def _book_from_row(self, row):
+        book = Book(row[0], row[1], row[2], row[3], row[4], bool(row[5]))
+        book.on_change = self._availability_changed
+        return book
+
+    def _member_from_row(self, row):
+        member = Member(row[0], row[1], row[2], row[3], row[5])
+        member.borrowed_books = dict.fromkeys(json.loads(row[4]))
+        return member
+
+    def _librarian_from_row(self, row):
+        return Librarian(row[0], row[1], row[2])
+
+    def _transaction_from_row(self, row):
+        return BorrowTransaction(row[0], row[1], row[2], row[3], _date(row[4]), _date(row[5]), _date(row[6]))
+
+    def _availability_changed(self, book):
+        """Write a book's availability back to the database"""
+        in_transaction = self.connection.in_transaction
+        self.connection.execute("UPDATE books SET available = ? WHERE book_id = ?",
+                                (int(book.available), book.book_id))
+        if not in_transaction:
+            self.connection.commit()
+
+    def add_book(self, book):
+        """Add a new book to the library"""
+        try:
+            with self.connection:
+                self.connection.execute(INSERT_BOOK, _book_row(book))
+        except sqlite3.IntegrityError:
+            return False  # duplicate book ID or ISBN
+        book.on_change = self._availability_changed
+        self.books.cache[book.book_id] = book
+        self.catalogue_version += 1
+        return True
+
+    def remove_book(self, book_id):
+        """Remove a book from the library"""
+        with self.connection:
+            removed = self.connection.execute("DELETE FROM books WHERE book_id = ?", (book_id,)).rowcount
+        book = self.books.cache.get(book_id)
+        if book is not None:
+            book.on_change = None
+        self.books.forget(book_id)
+        if removed:
+            self.catalogue_version += 1
+        return removed > 0
+
+    def add_member(self, member):
+        """Add a new member"""
+        try:
+            with self.connection:
+                self.connection.execute(INSERT_MEMBER, _member_row(member))
+        except sqlite3.IntegrityError:
+            return False
+        self.members.cache[member.member_id] = member
+        return True
+
+    def add_librarian(self, librarian):
+        """Add a new librarian"""
+        try:
+            with self.connection:
+                self.connection.execute(INSERT_LIBRARIAN, _librarian_row(librarian))
+        except sqlite3.IntegrityError:
+            return False
+        self.librarians.cache[librarian.librarian_id] = librarian
+        return True
+
+    @contextmanager
+    def _batch(self):
+        """Group the writes of one operation into a single SQLite transaction"""
+        if self.connection.in_transaction:
+            yield
+            return
+        self.connection.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            self.connection.rollback()
+            raise
+        self.connection.commit()
+
+    def _allocate_transaction_ids(self, count):
+        """Reserve a block of consecutive transaction IDs and return the first"""
+        first = super()._allocate_transaction_ids(count)
+        self.connection.execute("UPDATE meta SET value = ? WHERE key = 'next_transaction_id'",
+                                (str(self.next_transaction_id),))
+        return first
+
+    def _apply_borrow(self, member, book, librarian_id, transaction_id, borrow_date):
+        """Record a validated loan and return its transaction"""
+        transaction = BorrowTransaction(transaction_id, book.book_id, member.member_id, librarian_id, borrow_date)
+        book.borrow()
+        member.borrow_book(book.book_id)
+        self.connection.execute(INSERT_TRANSACTION, _transaction_row(transaction))
+        self.connection.execute("UPDATE members SET borrowed_books = ? WHERE member_id = ?",
+                                (json.dumps(list(member.borrowed_books)), member.member_id))
+        self.transactions.cache[transaction_id] = transaction
+        return transaction
+
+    def _apply_return(self, member, book, transaction, return_date):
+        """Close a validated loan"""
+        transaction.return_book(return_date)
+        book.return_book()
+        member.return_book(book.book_id)
+        self.connection.execute("UPDATE transactions SET return_date = ? WHERE transaction_id = ?",
+                                (transaction.return_date.isoformat(), transaction.transaction_id))
+        self.connection.execute("UPDATE members SET borrowed_books = ? WHERE member_id = ?",
+                                (json.dumps(list(member.borrowed_books)), member.member_id))
+
+    def find_by_isbn(self, isbn):
+        """Find a book by ISBN-10 or ISBN-13, with or without hyphens"""
+        return next(self.books.select("isbn_key = ?", (normalize_isbn(isbn),)), None)
+
+    def _select_books(self, available):
+        if available is None:
+            return self.books.values()
+        return self.books.select("available = ?", (int(available),))
+
+    def _select_transactions(self, order):
+        if order is None:
+            return self.transactions.values()
+        direction = "DESC" if order.startswith('-') else "ASC"
+        return self.transactions.select(order=f"{order.lstrip('-')} {direction}, transaction_id")
+
+    def _plan_query(self, table, predicate):
+        """Push as much of a query as possible into one SQL WHERE clause"""
+        compiled = _to_sql(predicate, QUERY_COLUMNS[table]) if predicate is not None else None
+        if compiled is None:
+            return Plan(f"Full scan of {table}", getattr(self, table).values, len(getattr(self, table)), predicate)
+        where, params, exact = compiled
+        rows = getattr(self, table)
+        details = self.connection.execute(f"EXPLAIN QUERY PLAN SELECT * FROM {table} WHERE {where}", params).fetchall()
+        access = "\n".join([f"SQL: WHERE {where}"] + [f"  {detail[-1]}" for detail in details])
+        return Plan(access, lambda: rows.select(where, params), None, None if exact else predicate)
+
+    def _archive_candidates(self, before):
+        return self.transactions.select("return_date IS NOT NULL AND return_date < ?", (before.isoformat(),))
+
+    def _drop_transactions(self, transaction_ids):
+        with self.connection:
+            self.connection.executemany("DELETE FROM transactions WHERE transaction_id = ?",
+                                        ((transaction_id,) for transaction_id in transaction_ids))
+        for transaction_id in transaction_ids:
+            self.transactions.forget(transaction_id)
+
+    def get_available_books(self):
+        """Get all available books"""
+        return list(self.books.select("available = 1"))
+
+    def get_borrowed_books(self):
+        """Get all borrowed books"""
+        return list(self.books.select("available = 0"))
+
+    def top_borrowers(self, n=10):
+        """Get up to n (member, loan count) pairs for the members holding the most books"""
+        members = self.members.select("json_array_length(borrowed_books) > 0", (),
+                                      "json_array_length(borrowed_books) DESC, member_id", n)
+        return [(member, len(member.borrowed_books)) for member in members]
+
+    def get_status(self):
+        """Get library counters from the database indexes"""
+        available, borrowed = self.connection.execute(
+            "SELECT COUNT(*) FILTER (WHERE available = 1), COUNT(*) FILTER (WHERE available = 0) FROM books").fetchone()
+        return {
+            'total_books': len(self.books),
+            'available_books': available,
+            'borrowed_books': borrowed,
+            'total_members': len(self.members),
+            'total_librarians': len(self.librarians),
+            'total_transactions': len(self.transactions)
+        }
+
+    def _search(self, query, limit):
+        """Search books by title, author or ISBN, best matches first"""
+        query = query.lower()
+        if not query:
+            return list(self.books.select())[:limit]
+        if len(query) >= 3:
+            phrase = '"' + query.replace('"', '""') + '"'
+            where = "book_id IN (SELECT rowid FROM books_fts WHERE books_fts MATCH ?)"
+            candidates = self.books.select(where, (phrase,))
+        else:
+            pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            where = "title LIKE ? ESCAPE '\\' OR author LIKE ? ESCAPE '\\' OR isbn LIKE ? ESCAPE '\\'"
+            candidates = self.books.select(where, (pattern, pattern, pattern))
+
+        query_tokens = TOKEN_PATTERN.findall(query)
+        scored = []
+        for book in candidates:
+            fields = (book.title.lower(), book.author.lower(), str(book.isbn).lower())
+            score = score_match(query, fields)
+            if score:
+                words = set(TOKEN_PATTERN.findall(" ".join(fields)))
+                if query_tokens and all(token in words for token in query_tokens):
+                    score += WHOLE_WORD_BONUS
+                scored.append((-score, book.book_id, book))
+        scored.sort(key=lambda item: item[:2])
+        return [book for _, _, book in scored[:limit]]
+
+    def overdue_report(self, as_of=None, policy=None, include_returned=True):
+        """Compute days overdue and fines for every transaction that was due before as_of"""
+        as_of = as_of if as_of else datetime.now()
+        rows = self.connection.execute(
+            "SELECT transaction_id, due_date, return_date FROM transactions WHERE due_date < ? ORDER BY transaction_id",
+            (as_of.isoformat(),)).fetchall()
+        ids = [row[0] for row in rows]
+        due_dates = [to_epoch(_date(row[1])) for row in rows]
+        return_dates = [to_epoch(_date(row[2])) if row[2] else NO_DATE for row in rows]
+        return compute_overdue(ids, due_dates, return_dates, as_of, policy if policy else FinePolicy(),
+                               include_returned)
+    
+    def next_due(self, n=1, as_of=None):
+        """Get the n open loans that fall due next, earliest first"""
+        as_of = as_of if as_of else datetime.now()
+        return list(self.transactions.select(
+            "return_date IS NULL AND due_date >= ? AND book_id IN (SELECT book_id FROM books)",
+            (as_of.isoformat(),), order="due_date, transaction_id", limit=n))
+    
+    def overdue_since(self, since, as_of=None):
+        """Get open loans that fell due at or after since and before as_of, earliest due first"""
+        as_of = as_of if as_of else datetime.now()
+        return list(self.transactions.select(
+            "return_date IS NULL AND due_date >= ? AND due_date < ? AND book_id IN (SELECT book_id FROM books)",
+            (since.isoformat(), as_of.isoformat()), order="due_date, transaction_id"))
+    
+    def enable_journal(self, filename, sync_every=100, snapshot_every=None):
+        """Do nothing: SQLite commits every mutation to the database file, which already gives
+        what a journal would. The inherited flush, compact and disable calls are no-ops too;
+        use save_to_file for JSON exports.
+        """
+
+    def open_snapshot(self, filename):
+        """Replace the database contents with a binary snapshot written by save_snapshot
+
+        The database is the store, so the snapshot's records are copied into it
+        rather than mapped lazily as Library.open_snapshot does.
+        """
+        try:
+            snapshot = Snapshot(filename)
+        except (FileNotFoundError, ValueError):
+            return False
+        tables = {
+            'books': (INSERT_BOOK, _book_row, snapshot.books(lambda book: None)),
+            'members': (INSERT_MEMBER, _member_row, snapshot.members(lambda member: None)),
+            'librarians': (INSERT_LIBRARIAN, _librarian_row, snapshot.librarians()),
+            'transactions': (INSERT_TRANSACTION, _transaction_row, snapshot.transactions())
+        }
+        with self.connection:
+            for table, (sql, to_row, records) in tables.items():
+                self.connection.execute(f"DELETE FROM {table}")
+                self.connection.executemany(sql, map(to_row, records.values()))
+            self.name = snapshot.name
+            self.next_book_id = snapshot.next_ids['book']
+            self.next_member_id = snapshot.next_ids['member']
+            self.next_librarian_id = snapshot.next_ids['librarian']
+            self.next_transaction_id = snapshot.next_ids['transaction']
+            self._save_meta()
+        for table in (self.books, self.members, self.librarians, self.transactions):
+            table.forget()
+        self.catalogue_version += 1
+        return True
+
+    def save_incremental(self, filename):
+        """Export the whole library with save_to_file and return filename
+
+        The database commits every change itself, so it keeps no record of
+        changes pending since the last export and every export is full; the
+        full save also drops deltas left next to filename. merge_deltas is
+        inherited and folds deltas written by a Library into their base file.
+        """
+        self.save_to_file(filename)
+        return filename
+
+    def load_from_file(self, filename, sections=None, active_only=False):
+        """Replace the database contents with library data from a JSON file, streamed record by record"""
+        wanted = set(sections) if sections is not None else set(SECTIONS)
+        inserts = {
+            'books': (INSERT_BOOK, Book, _book_row),
+            'members': (INSERT_MEMBER, Member, _member_row),
+            'librarians': (INSERT_LIBRARIAN, Librarian, _librarian_row),
+            'transactions': (INSERT_TRANSACTION, BorrowTransaction, _transaction_row)
+        }
+        next_ids = {}
+        try:
+            compact = is_compact(filename)
+            with open(filename, 'rb' if compact else 'r') as f, self.connection:
+                for table in SECTIONS:
+                    self.connection.execute(f"DELETE FROM {table}")
+                reader = CompactReader(f, self.codec or get_codec()) if compact else JSONStreamReader(f)
+                for key, value in reader.sections():
+                    if key == 'name':
+                        self.name = value
+                    elif key == 'next_ids':
+                        next_ids = value
+                    elif key in wanted and key in inserts:
+                        sql, entity_class, to_row = inserts[key]
+                        if compact:
+                            records = (FROM_ROW[key](row) for chunk in value for row in chunk)
+                        else:
+                            records = map(entity_class.from_dict, value)
+                        if key == 'transactions' and active_only:
+                            records = (transaction for transaction in records if transaction.return_date is None)
+                        self.connection.executemany(sql, map(to_row, records))
+                for change in read_deltas(filename):
+                    self.name, next_ids = change['name'], change['next_ids']
+                    self._replay_delta(change, inserts, wanted, active_only)
+                self.next_book_id = next_ids.get('book', 1)
+                self.next_member_id = next_ids.get('member', 1)
+                self.next_librarian_id = next_ids.get('librarian', 1)
+                self.next_transaction_id = next_ids.get('transaction', 1)
+                self._save_meta()
+        except (FileNotFoundError, ValueError):
+            self.name = self._get_meta('name', self.name)
+            return False
+
+        for table in (self.books, self.members, self.librarians, self.transactions):
+            table.forget()
+        self.catalogue_version += 1
+        return True
+
+    def _replay_delta(self, change, inserts, wanted, active_only):
+        """Apply one delta file's upserts and deletions to the freshly loaded tables"""
+        for section, records in change['upsert'].items():
+            if section not in wanted:
+                continue
+            sql, entity_class, to_row = inserts[section]
+            records = [entity_class.from_dict(data) for data in records]
+            self.connection.executemany(f"DELETE FROM {section} WHERE {KEYS[section]} = ?",
+                                        ((getattr(record, KEYS[section]),) for record in records))
+            if section == 'transactions' and active_only:
+                records = [transaction for transaction in records if transaction.return_date is None]
+            self.connection.executemany(sql, map(to_row, records))
+        for section, keys in change['delete'].items():
+            if section in wanted:
+                self.connection.executemany(f"DELETE FROM {section} WHERE {KEYS[section]} = ?", ((key,) for key in keys))
@@ -3,19 +3,46 @@
 Test script for Library Management System
 """
 
-from library import Library
+from library import Library, SECTIONS
 from book import Book
 from member import Member
 from librarian import Librarian
 from borrow_transaction import BorrowTransaction
+from sqlite_library import SQLiteLibrary
+from concurrent_library import ConcurrentLibrary
+from sharded_library import ShardedLibrary
+from library_server import LibraryServer, LibraryClient, LibraryServerError
+from json_stream import JSONStreamReader
+from journal import Journal
+from codec import available_codecs
+from transaction_store import TransactionStore
+from overdue import FinePolicy
+from query import F
+from search_cache import SearchCache
+from datagen import LibraryGenerator
 from datetime import datetime, timedelta
+import asyncio
+import json
+import os
+import random
+import tempfile
+import sys
+import threading
+
+# Storage backends the tests run against
+BACKENDS = {'dict': Library, 'sqlite': SQLiteLibrary}
+backend = 'dict'
+
+def create_library(name):
+    """Create a library on the backend under test"""
+    return BACKENDS[backend](name)
 
 def test_basic_functionality():
     """Test basic library functionality"""
     print("=== Testing Basic Library Functionality ===")
     
     # Create library
-    library = Library("Test Library")
+    library = create_library("Test Library")
     
     # Test adding books
     book1 = Book(1, "Test Book 1", "Author 1", "123-456", 2023)
@@ -68,7 +95,7 @@ def test_error_cases():
     """Test error handling"""
     print("\n=== Testing Error Cases ===")
     
-    library = Library("Test Library")
+    library = create_library("Test Library")
     
     # Add some data first
     book = Book(1, "Test Book", "Test Author", "123", 2023)
@@ -106,7 +133,7 @@ def test_data_persistence():
     print("\n=== Testing Data Persistence ===")
     
     # Create test data
-    library = Library("Persistence Test Library")
+    library = create_library("Persistence Test Library")
     
     # Add books
     books = [
@@ -133,12 +160,13 @@ def test_data_persistence():
         library.add_librarian(librarian)
     
     # Save data
-    library.save_to_file("test_data.json")
+    filename = os.path.join(tempfile.mkdtemp(), "test_data.json")
+    library.save_to_file(filename)
     print("✓ Data saved successfully")
     
     # Create new library and load data
-    new_library = Library("New Library")
-    success = new_library.load_from_file("test_data.json")
+    new_library = create_library("New Library")
+    success = new_library.load_from_file(filename)
     assert success, "Failed to load data from file"
     
     # Verify loaded data
@@ -147,13 +175,21 @@ def test_data_persistence():
     assert len(new_library.get_all_librarians()) == 2, "Librarians not loaded correctly"
     
     print("✓ Data loaded successfully and verified")
+    
+    # The checked-in fixture predates loan limits and generations, and still loads
+    fixture = create_library("Fixture Library")
+    assert fixture.load_from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_data.json")), "Fixture failed to load"
+    assert [member.to_dict() for member in fixture.get_all_members()] == \
+        [member.to_dict() for member in new_library.get_all_members()], "Fixture members differ"
+    assert fixture.members[1].loan_limit is None and fixture.generation == 0, "Fixture defaults wrong"
+    print("✓ Fixture compatibility verified")
     print("Data persistence tests passed! ✅")
 
 def test_transaction_functionality():
     """Test transaction-related functionality"""
     print("\n=== Testing Transaction Functionality ===")
     
-    library = Library("Transaction Test Library")
+    library = create_library("Transaction Test Library")
     
     # Setup
     book = Book(1, "Transaction Book", "Transaction Author", "333-333", 2022)
@@ -195,12 +231,1370 @@ def test_transaction_functionality():
     print("✓ Transaction completion test passed")
     print("Transaction functionality tests passed! ✅")
 
+def test_active_loan_index():
+    """Test the active-loan index used by return_book"""
+    print("\n=== Testing Active Loan Index ===")
+    
+    library = create_library("Index Test Library")
+    library.add_book(Book(1, "Indexed Book 1", "Author", "444-444", 2020))
+    library.add_book(Book(2, "Indexed Book 2", "Author", "555-555", 2021))
+    library.add_member(Member(1, "Index Member", "index@test.com", "555-4444"))
+    library.add_librarian(Librarian(1, "Index Librarian", "index@lib.com"))
+    
+    library.borrow_book(1, 1, 1)
+    library.borrow_book(1, 2, 1)
+    transaction = library.get_active_transaction(1)
+    assert transaction is not None and transaction.book_id == 1, "Loan not indexed"
+    assert (1, 1) in library.active_loans, "Loan not indexed by book and member"
+    
+    success, message = library.return_book(1, 1)
+    assert success, f"Return failed: {message}"
+    assert library.get_active_transaction(1) is None, "Returned loan still indexed"
+    success, message = library.return_book(1, 1)
+    assert not success, "Should not return the same loan twice"
+    print("✓ Borrow/return index test passed")
+    
+    # Removing a borrowed book drops its open loan
+    assert library.remove_book(2), "Failed to remove book"
+    assert library.get_active_transaction(2) is None, "Removed book still indexed"
+    assert (2, 1) not in library.active_loans, "Removed book still indexed"
+    print("✓ Remove book index test passed")
+    
+    # Reloading rebuilds the index from open transactions
+    library.add_book(Book(3, "Indexed Book 3", "Author", "666-666", 2022))
+    library.borrow_book(1, 3, 1)
+    filename = os.path.join(tempfile.mkdtemp(), "index_test.json")
+    library.save_to_file(filename)
+    new_library = create_library("New Library")
+    assert new_library.load_from_file(filename), "Failed to load data from file"
+    assert new_library.get_active_transaction(3) is not None, "Index not rebuilt on load"
+    assert new_library.get_active_transaction(1) is None, "Closed loan indexed on load"
+    success, message = new_library.return_book(1, 3)
+    assert success, f"Return after load failed: {message}"
+    print("✓ Load index test passed")
+    print("Active loan index tests passed! ✅")
+
+def test_search_index():
+    """Test indexed search"""
+    print("\n=== Testing Search Index ===")
+    
+    library = create_library("Search Test Library")
+    library.add_book(Book(1, "The Great Gatsby", "F. Scott Fitzgerald", "978-0-7432-7356-5", 1925))
+    library.add_book(Book(2, "Great Expectations", "Charles Dickens", "978-0-14-143956-3", 1861))
+    library.add_book(Book(3, "Gatsby Revisited", "Some Critic", "978-1-23-456789-7", 2001))
+    
+    # Substring, prefix and ISBN queries behave like the old scan
+    assert [b.book_id for b in library.search_books("atsb")] != [], "Substring search failed"
+    assert {b.book_id for b in library.search_books("great")} == {1, 2}, "Word search failed"
+    assert [b.book_id for b in library.search_books("7356")] == [1], "ISBN search failed"
+    assert [b.book_id for b in library.search_books("e")] != [], "Single character search failed"
+    assert library.search_books("nothing like this") == [], "Search should find nothing"
+    print("✓ Substring search test passed")
+    
+    # Ranking and limits
+    results = library.search_books("gatsby")
+    assert results[0].book_id == 3, "Title prefix match should rank first"
+    assert len(library.search_books("gatsby", limit=1)) == 1, "Limit not applied"
+    print("✓ Ranking test passed")
+    
+    # Index follows add and remove
+    library.remove_book(1)
+    assert [b.book_id for b in library.search_books("gatsby")] == [3], "Removed book still found"
+    library.add_book(Book(4, "Gatsby Again", "Another Author", "000", 2020))
+    assert {b.book_id for b in library.search_books("gatsby")} == {3, 4}, "Added book not found"
+    print("✓ Index maintenance test passed")
+    print("Search index tests passed! ✅")
+
+def test_isbn_lookup():
+    """Test exact ISBN lookup"""
+    print("\n=== Testing ISBN Lookup ===")
+    
+    library = create_library("ISBN Test Library")
+    book = Book(1, "The Great Gatsby", "F. Scott Fitzgerald", "978-0-7432-7356-5", 1925)
+    assert library.add_book(book), "Failed to add book"
+    
+    assert library.find_by_isbn("978-0-7432-7356-5") is book, "Hyphenated ISBN-13 lookup failed"
+    assert library.find_by_isbn("9780743273565") is book, "Plain ISBN-13 lookup failed"
+    assert library.find_by_isbn("0-7432-7356-7") is book, "ISBN-10 lookup failed"
+    assert library.find_by_isbn("978-0-00-000000-2") is None, "Unknown ISBN should not be found"
+    print("✓ ISBN normalization test passed")
+    
+    duplicate = Book(2, "Gatsby Reprint", "F. Scott Fitzgerald", "0743273567", 1925)
+    assert not library.add_book(duplicate), "Should not add duplicate ISBN"
+    assert library.remove_book(1), "Failed to remove book"
+    assert library.find_by_isbn("9780743273565") is None, "Removed book still found"
+    assert library.add_book(duplicate), "ISBN should be free after removal"
+    print("✓ Duplicate ISBN test passed")
+    print("ISBN lookup tests passed! ✅")
+
+def test_availability_tracking():
+    """Test maintained availability sets and status counters"""
+    print("\n=== Testing Availability Tracking ===")
+    
+    library = create_library("Availability Test Library")
+    library.add_book(Book(1, "Book One", "Author", "101", 2020))
+    library.add_book(Book(2, "Book Two", "Author", "102", 2020))
+    library.add_book(Book(3, "Book Three", "Author", "103", 2020, available=False))
+    library.add_member(Member(1, "Member", "member@test.com", "555-0001"))
+    library.add_librarian(Librarian(1, "Librarian", "lib@test.com"))
+    
+    status = library.get_status()
+    assert status['total_books'] == 3, "Wrong total"
+    assert status['available_books'] == 2, "Wrong available count"
+    assert status['borrowed_books'] == 1, "Wrong borrowed count"
+    
+    library.borrow_book(1, 1, 1)
+    assert [b.book_id for b in library.get_available_books()] == [2], "Available set not updated"
+    assert {b.book_id for b in library.get_borrowed_books()} == {1, 3}, "Borrowed set not updated"
+    
+    library.books[3].return_book()
+    assert library.get_status()['borrowed_books'] == 1, "Direct Book.return_book not tracked"
+    
+    library.remove_book(1)
+    status = library.get_status()
+    assert status['borrowed_books'] == 0 and status['available_books'] == 2, "Removed book still counted"
+    assert status['total_transactions'] == 1, "Wrong transaction count"
+    print("✓ Availability counters test passed")
+    print("Availability tracking tests passed! ✅")
+
+def test_journal_persistence():
+    """Test journaled saves and snapshot-plus-journal recovery"""
+    print("\n=== Testing Journal Persistence ===")
+    
+    filename = os.path.join(tempfile.mkdtemp(), "journal_test.json")
+    library = Library("Journal Test Library")
+    library.add_book(Book(1, "Snapshot Book", "Author", "201", 2020))
+    library.enable_journal(filename, sync_every=2)
+    
+    # Mutations after the snapshot only go to the journal
+    library.add_book(Book(2, "Journaled Book", "Author", "202", 2021))
+    library.add_member(Member(1, "Journal Member", "journal@test.com", "555-2020"))
+    library.add_librarian(Librarian(1, "Journal Librarian", "journal@lib.com"))
+    library.borrow_book(1, 1, 1)
+    library.borrow_book(1, 2, 1)
+    library.return_book(1, 1)
+    library.flush_journal()
+    assert library.journal.records == 6, "Mutations not journaled"
+    
+    # Simulate a torn write at the end of the journal
+    with open(filename + ".journal", "a") as f:
+        f.write('{"op":"add_bo')
+    
+    recovered = Library("Recovered Library")
+    assert recovered.load_from_file(filename), "Failed to load snapshot and journal"
+    assert len(recovered.get_all_books()) == 2, "Journaled book not replayed"
+    assert len(recovered.get_all_transactions()) == 2, "Journaled loans not replayed"
+    assert recovered.get_active_transaction(2) is not None, "Open loan not replayed"
+    assert recovered.transactions[1].is_returned, "Return not replayed"
+    assert recovered.transactions[1].return_date == library.transactions[1].return_date, "Return date changed"
+    assert list(recovered.members[1].borrowed_books) == [2], "Member loans not replayed"
+    print("✓ Journal replay test passed")
+    
+    # Compaction folds the journal into a new snapshot
+    library.snapshot_every = 8
+    library.add_book(Book(3, "Compacted Book", "Author", "203", 2022))
+    library.remove_book(3)
+    assert library.journal.records == 0, "Journal not compacted"
+    assert [record["op"] for record in Journal.read(filename + ".journal")] == ["generation"], "Journal file not truncated"
+    library.disable_journal()
+    recovered = Library("Recovered Library")
+    assert recovered.load_from_file(filename), "Failed to load compacted snapshot"
+    assert 3 not in recovered.books and len(recovered.books) == 2, "Compacted snapshot is wrong"
+    print("✓ Journal compaction test passed")
+    
+    # A crash after the snapshot is written but before the journal is emptied
+    # must not replay mutations the snapshot already holds
+    library = Library("Generation Library")
+    library.add_book(Book(1, "Generation Book", "Author", "204", 2020))
+    library.add_member(Member(1, "Generation Member", "generation@test.com", "555-2021"))
+    library.add_librarian(Librarian(1, "Generation Librarian", "generation@lib.com"))
+    library.enable_journal(filename)
+    library.borrow_book(1, 1, 1)
+    library.return_book(1, 1)
+    library.flush_journal()
+    library.journal.truncate = lambda generation: None  # crash before the journal is emptied
+    library.compact_journal()
+    recovered = Library("Recovered Library")
+    assert recovered.load_from_file(filename), "Failed to load snapshot after crash"
+    assert len(recovered.transactions) == 1, "Journaled borrow replayed on top of the snapshot"
+    assert recovered.books[1].available and not recovered.book_loans, "Stale journal reopened a loan"
+    assert recovered.generation == library.generation, "Generation not saved"
+    
+    # Mutations journaled after a clean compaction are still replayed
+    recovered.enable_journal(filename)
+    recovered.borrow_book(1, 1, 1)
+    recovered.disable_journal()
+    again = Library("Recovered Again")
+    again.load_from_file(filename)
+    assert len(again.book_loans) == 1 and len(again.transactions) == 2, "Journal after compaction not replayed"
+    print("✓ Journal generation test passed")
+    
+    # Saving a reloaded library without journaling supersedes the journal left on disk
+    library = Library("Unjournaled Library")
+    library.add_book(Book(1, "Unjournaled Book", "Author", "205", 2020))
+    library.add_member(Member(1, "Unjournaled Member", "unjournaled@test.com", "555-2022"))
+    library.add_librarian(Librarian(1, "Unjournaled Librarian", "unjournaled@lib.com"))
+    library.enable_journal(filename)
+    library.borrow_book(1, 1, 1)
+    library.return_book(1, 1)
+    library.flush_journal()
+    reloaded = Library("Reloaded Library")
+    reloaded.load_from_file(filename)
+    assert len(reloaded.transactions) == 1, "Journal not replayed"
+    reloaded.save_to_file(filename)
+    again = Library("Reloaded Again")
+    again.load_from_file(filename)
+    assert len(again.transactions) == 1 and again.next_transaction_id == 2, "Saved mutations replayed twice"
+    library.disable_journal()
+    print("✓ Unjournaled save test passed")
+    print("Journal persistence tests passed! ✅")
+
+def test_sqlite_reopen():
+    """Test that an SQLite library is served straight from its database file"""
+    print("\n=== Testing SQLite Reopen ===")
+    
+    filename = os.path.join(tempfile.mkdtemp(), "library.db")
+    library = SQLiteLibrary("SQLite Test Library", filename)
+    missing = [name for name in vars(Library("Base")) if not hasattr(library, name)]
+    assert not missing, f"Base attributes missing: {missing}"
+    library.add_book(Book(1, "Stored Book", "Author", "978-0-7432-7356-5", 2020))
+    library.add_member(Member(1, "Stored Member", "stored@test.com", "555-3030"))
+    library.add_librarian(Librarian(1, "Stored Librarian", "stored@lib.com"))
+    library.borrow_book(1, 1, 1)
+    # The database is its own journal, so journaling is accepted and does nothing
+    library.enable_journal(filename + ".json")
+    library.compact_journal()
+    assert library.journal is None and not os.path.exists(filename + ".json.journal"), "SQLite should not journal"
+    library.close()
+    
+    reopened = SQLiteLibrary("Other Name", filename)
+    assert reopened.name == "SQLite Test Library", "Library name not stored"
+    assert reopened.find_by_isbn("0743273567").title == "Stored Book", "Book not stored"
+    assert list(reopened.members[1].borrowed_books) == [1], "Member loans not stored"
+    assert reopened.get_status()['borrowed_books'] == 1, "Availability not stored"
+    success, message = reopened.return_book(1, 1)
+    assert success, f"Return after reopen failed: {message}"
+    assert reopened.next_transaction_id == 2, "Transaction ID counter not stored"
+    reopened.close()
+    print("✓ SQLite reopen test passed")
+    print("SQLite reopen tests passed! ✅")
+
+def test_streaming_load():
+    """Test the streaming JSON loader and partial loads"""
+    print("\n=== Testing Streaming Load ===")
+    
+    library = create_library("Streaming Test Library")
+    for book_id in range(1, 4):
+        library.add_book(Book(book_id, f"Stream Book {book_id}", "Author", f"30{book_id}", 2000 + book_id))
+    library.add_member(Member(1, "Stream Member", "stream@test.com", "555-4040"))
+    library.add_librarian(Librarian(1, "Stream Librarian", "stream@lib.com"))
+    library.borrow_book(1, 1, 1)
+    library.borrow_book(1, 2, 1)
+    library.return_book(1, 1)
+    filename = os.path.join(tempfile.mkdtemp(), "stream_test.json")
+    library.save_to_file(filename)
+    
+    # Tiny chunks force values to be split across reads
+    with open(filename, 'r') as f:
+        sections = {key: list(value) if key in SECTIONS else value
+                    for key, value in JSONStreamReader(f, chunk_size=7).sections()}
+    with open(filename, 'r') as f:
+        assert sections == json.load(f), "Streamed document differs from json.load"
+    print("✓ Stream reader test passed")
+    
+    kiosk = create_library("Kiosk")
+    assert kiosk.load_from_file(filename, sections=['books', 'transactions'], active_only=True), "Partial load failed"
+    assert kiosk.name == "Streaming Test Library", "Name not loaded"
+    assert len(kiosk.books) == 3 and len(kiosk.members) == 0, "Skipped section was loaded"
+    assert list(kiosk.transactions) == [2], "Returned transaction was loaded"
+    assert kiosk.get_active_transaction(2) is not None, "Active loan not indexed"
+    print("✓ Partial load test passed")
+    
+    with open(filename, 'r+') as f:
+        f.truncate(os.path.getsize(filename) // 2)
+    assert not kiosk.load_from_file(filename), "Truncated file should not load"
+    assert len(kiosk.books) == 3, "Failed load changed the library"
+    print("✓ Truncated file test passed")
+    print("Streaming load tests passed! ✅")
+
+def test_transaction_store():
+    """Test the columnar transaction store"""
+    print("\n=== Testing Transaction Store ===")
+    
+    borrow_date = datetime(2024, 3, 1, 10, 30)
+    store = TransactionStore([
+        BorrowTransaction(1, 10, 20, 30, borrow_date),
+        BorrowTransaction(2, 11, 21, 30, borrow_date, return_date=borrow_date + timedelta(days=3))
+    ])
+    row = store[1]
+    assert isinstance(row, BorrowTransaction), "Rows should behave like transactions"
+    assert (row.book_id, row.member_id, row.librarian_id) == (10, 20, 30), "Wrong ids"
+    assert row.due_date == borrow_date + timedelta(days=14), "Wrong due date"
+    assert not row.is_returned and store[2].is_returned, "Wrong return status"
+    row.return_book(borrow_date + timedelta(days=20))
+    assert store[1].is_returned and store[1].get_days_overdue() == 6, "Return not written to the store"
+    assert store[1].to_dict()['return_date'] == "2024-03-21T10:30:00", "Wrong serialized date"
+    print("✓ Row view test passed")
+    
+    # Non-consecutive ids and deletion
+    store[7] = BorrowTransaction(7, 12, 22, 30, borrow_date)
+    del store[2]
+    assert list(store) == [1, 7] and len(store) == 2, "Wrong keys after insert and delete"
+    assert 2 not in store and store[7].book_id == 12, "Wrong lookup after insert and delete"
+    assert "x" not in store and store.get("x") is None and TransactionStore([store[1]]).get("x") is None, "Non-int keys should miss"
+    print("✓ Sparse id test passed")
+    
+    # Every field of a row writes through to its column, to the microsecond
+    precise = datetime(2024, 3, 1, 10, 30, 15, 123456)
+    written = []
+    store.on_change = written.append
+    row = store[7]
+    row.book_id, row.member_id, row.librarian_id = 13, 23, 31
+    row.borrow_date, row.due_date = precise, precise + timedelta(days=7)
+    store.on_change = None
+    row = store[7]
+    assert (row.book_id, row.member_id, row.librarian_id) == (13, 23, 31), "Id writes lost"
+    assert row.borrow_date == precise and row.due_date == precise + timedelta(days=7), "Date writes lost"
+    assert written == [7] * 5, "Row writes not reported"
+    print("✓ Row write test passed")
+    print("Transaction store tests passed! ✅")
+
+def test_overdue_report():
+    """Test the bulk overdue report"""
+    print("\n=== Testing Overdue Report ===")
+    
+    library = create_library("Overdue Test Library")
+    for book_id in range(1, 5):
+        library.add_book(Book(book_id, f"Overdue Book {book_id}", "Author", f"40{book_id}", 2000))
+    library.add_member(Member(1, "Overdue Member", "overdue@test.com", "555-5050"))
+    library.add_librarian(Librarian(1, "Overdue Librarian", "overdue@lib.com"))
+    
+    start = datetime(2024, 1, 1, 12, 0)
+    library.borrow_book(1, 1, 1, start)  # due Jan 15, still out
+    library.borrow_book(1, 2, 1, start)  # due Jan 15, returned 5 days late
+    library.return_book(1, 2, start + timedelta(days=19))
+    library.borrow_book(1, 3, 1, start)  # returned on time
+    library.return_book(1, 3, start + timedelta(days=3))
+    library.borrow_book(1, 4, 1, start + timedelta(days=30))  # not due yet
+    
+    as_of = start + timedelta(days=24, hours=1)
+    report = library.overdue_report(as_of=as_of, policy=FinePolicy(daily_rate=0.5, grace_days=2, max_fine=3))
+    assert list(report) == [(1, 10, 3), (2, 5, 1.5)], f"Wrong overdue rows: {list(report)}"
+    assert report.total_fines == 4.5, "Wrong fine total"
+    for transaction_id, days, fine in report:
+        transaction = library.transactions[transaction_id]
+        if transaction.is_returned:
+            assert days == transaction.get_days_overdue(), "Disagrees with get_days_overdue"
+    print("✓ Overdue report test passed")
+    
+    active_only = library.overdue_report(as_of=as_of, include_returned=False)
+    assert active_only.transaction_ids == [1], "Returned loans should be excluded"
+    before_due = library.overdue_report(as_of=start + timedelta(days=10))
+    assert len(before_due) == 0, "Nothing is overdue before the due date"
+    print("✓ Fixed clock test passed")
+    print("Overdue report tests passed! ✅")
+
+def test_due_date_queue():
+    """Test due-date ordered queries and overdue alerts"""
+    print("\n=== Testing Due Date Queue ===")
+    
+    library = create_library("Due Date Test Library")
+    for book_id in range(1, 6):
+        library.add_book(Book(book_id, f"Due Book {book_id}", "Author", f"50{book_id}", 2000))
+    library.add_member(Member(1, "Due Member", "due@test.com", "555-6060"))
+    library.add_librarian(Librarian(1, "Due Librarian", "due@lib.com"))
+    
+    start = datetime(2024, 1, 1)
+    for book_id in (3, 1, 4, 2, 5):
+        library.borrow_book(1, book_id, 1, start + timedelta(days=book_id))  # book N is due on day N + 14
+    
+    upcoming = library.next_due(2, as_of=start)
+    assert [t.book_id for t in upcoming] == [1, 2], "next_due not in due order"
+    library.return_book(1, 1)
+    assert [t.book_id for t in library.next_due(2, as_of=start)] == [2, 3], "Returned loan still queued"
+    print("✓ Next due test passed")
+    
+    as_of = start + timedelta(days=18, hours=1)  # books 2, 3 and 4 are past due
+    assert [t.book_id for t in library.overdue_since(start, as_of)] == [2, 3, 4], "Wrong overdue loans"
+    assert [t.book_id for t in library.overdue_since(start + timedelta(days=17, hours=1), as_of)] == [4], "Wrong new overdue loans"
+    assert [t.book_id for t in library.next_due(5, as_of=as_of)] == [5], "Overdue loans still upcoming"
+    print("✓ Overdue since test passed")
+    
+    # Queries never consume loans, whatever order and as_of they are asked with
+    later = start + timedelta(days=60)
+    assert library.overdue_since(start + timedelta(days=30), later) == [], "Nothing fell due after day 30"
+    assert [t.book_id for t in library.next_due(1, as_of=start)] == [2], "Earlier query consumed the queue"
+    assert [t.book_id for t in library.overdue_since(datetime(2000, 1, 1), later)] == [2, 3, 4, 5], "Overdue loans lost"
+    assert [t.book_id for t in library.next_due(2, as_of=start + timedelta(days=17))] == [3, 4], "Wrong loans after as_of"
+    # A backdated loan falls due before loans made earlier
+    library.borrow_book(1, 1, 1, start - timedelta(days=10))
+    assert [t.book_id for t in library.overdue_since(start, start + timedelta(days=5))] == [1], "Backdated loan missed"
+    assert [t.book_id for t in library.next_due(2, as_of=start)] == [1, 2], "Backdated loan out of order"
+    library.return_book(1, 1)
+    print("✓ Repeated queries test passed")
+    
+    # Alerts use an injected clock and never report a loan twice
+    clock = [start + timedelta(days=17, hours=1)]
+    waits = []
+    def sleep(seconds):
+        waits.append(seconds)
+        clock[0] += timedelta(days=1)
+    alerts = library.overdue_alerts(clock=lambda: clock[0], sleep=sleep, max_wait=86400)
+    library.return_book(1, 4)
+    assert [next(alerts).book_id for _ in range(3)] == [2, 3, 5], "Wrong alert order"
+    assert len(waits) == 2, "Alerts should wait for the next due date"
+    print("✓ Overdue alerts test passed")
+    
+    # Heavy churn, enough to compact away returned loans, agrees with a scan of open loans
+    rng = random.Random(10)
+    for book_id in range(6, 206):
+        library.add_book(Book(book_id, f"Churn Book {book_id}", "Author", f"5{book_id:03d}", 2000))
+    library.add_member(Member(2, "Churn Member", "churn@test.com", "555-6061"))
+    for _ in range(600):
+        book_id = rng.randrange(6, 206)
+        if not library.return_book(2, book_id)[0]:
+            library.borrow_book(2, book_id, 1, start + timedelta(days=rng.randrange(60)))
+    as_of = start + timedelta(days=40)
+    open_loans = sorted((t for t in library.transactions.values() if not t.is_returned),
+                        key=lambda t: (t.due_date, t.transaction_id))
+    expected = [t.transaction_id for t in open_loans if start + timedelta(days=20) <= t.due_date < as_of]
+    found = [t.transaction_id for t in library.overdue_since(start + timedelta(days=20), as_of)]
+    assert found == expected, "Overdue loans differ from a scan"
+    expected = [t.transaction_id for t in open_loans if t.due_date >= as_of][:7]
+    assert [t.transaction_id for t in library.next_due(7, as_of)] == expected, "Next due loans differ from a scan"
+    print("✓ Due date churn test passed")
+    print("Due date queue tests passed! ✅")
+
+def test_batch_operations():
+    """Test bulk borrow and return"""
+    print("\n=== Testing Batch Operations ===")
+    
+    library = create_library("Batch Test Library")
+    for book_id in range(1, 6):
+        library.add_book(Book(book_id, f"Batch Book {book_id}", "Author", f"60{book_id}", 2000))
+    library.add_member(Member(1, "Batch Member 1", "batch1@test.com", "555-7070"))
+    library.add_member(Member(2, "Batch Member 2", "batch2@test.com", "555-7071"))
+    librarian = Librarian(1, "Batch Librarian", "batch@lib.com")
+    library.add_librarian(librarian)
+    
+    # All-or-nothing: one bad request aborts the batch
+    results = library.borrow_many([(1, 1), (1, 99), (2, 2)], 1, atomic=True)
+    assert [r.success for r in results] == [False, False, False], "Atomic batch should abort"
+    assert results[1].error == "Book not found" and results[0].error == "Batch aborted", "Wrong errors"
+    assert library.get_status()['borrowed_books'] == 0, "Aborted batch changed the library"
+    
+    # Best effort: valid requests go ahead with consecutive transaction IDs
+    borrow_date = datetime(2024, 5, 1, 9, 0)
+    results = library.borrow_many([(1, 1), (2, 1), (1, 99), (2, 2), (3, 3)], 1, borrow_date=borrow_date)
+    assert [r.success for r in results] == [True, False, False, True, False], "Wrong best-effort results"
+    assert results[1].error == "Book is not available", "Duplicate book in batch not caught"
+    assert results[4].error == "Member not found", "Unknown member not caught"
+    assert [results[0].transaction_id, results[3].transaction_id] == [1, 2], "IDs not allocated as a block"
+    assert all(library.transactions[r.transaction_id].borrow_date == borrow_date for r in results if r.success), "Timestamps differ"
+    assert list(library.members[2].borrowed_books) == [2], "Member not updated"
+    print("✓ Batch borrow test passed")
+    
+    results = librarian.process_return_many(library, [(1, 1), (1, 1), (2, 3)])
+    assert [r.success for r in results] == [True, False, False], "Wrong return results"
+    assert results[0].transaction_id == 1, "Wrong returned transaction"
+    assert library.get_active_transaction(1) is None and library.get_status()['borrowed_books'] == 1, "Return not applied"
+    results = librarian.process_borrow_many(library, [(1, 4), (1, 5)])
+    assert all(r.success for r in results) and library.next_transaction_id == 5, "Librarian batch borrow failed"
+    print("✓ Batch return test passed")
+    print("Batch operation tests passed! ✅")
+
+def test_concurrent_circulation():
+    """Stress test many desk threads sharing one library"""
+    print("\n=== Testing Concurrent Circulation ===")
+    
+    library = ConcurrentLibrary("Concurrent Test Library", stripes=8)
+    for book_id in range(1, 21):
+        library.add_book(Book(book_id, f"Shared Book {book_id}", "Author", f"70{book_id:02d}", 2000))
+    for member_id in range(1, 9):
+        library.add_member(Member(member_id, f"Desk Member {member_id}", f"desk{member_id}@test.com", "555-8080"))
+    library.add_librarian(Librarian(1, "Desk Librarian", "desk@lib.com"))
+    
+    successful_borrows = []
+    def desk(member_id):
+        rng = random.Random(member_id)
+        for _ in range(500):
+            book_id = rng.randint(1, 20)
+            if rng.random() < 0.2:
+                results = library.borrow_many([(member_id, book_id), (member_id, rng.randint(1, 20))], 1)
+                successful_borrows.extend(r.transaction_id for r in results if r.success)
+            else:
+                success, message = library.borrow_book(member_id, book_id, 1)
+                if success:
+                    successful_borrows.append(int(message.rsplit(" ", 1)[1]))
+            if rng.random() < 0.6:
+                library.return_book(member_id, rng.choice(list(library.members[member_id].borrowed_books) or [book_id]))
+    
+    threads = [threading.Thread(target=desk, args=(member_id,)) for member_id in range(1, 9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    # No book is on two open loans, and no transaction ID was handed out twice
+    open_loans = [t for t in library.transactions.values() if not t.is_returned]
+    assert len({t.book_id for t in open_loans}) == len(open_loans), "A book was lent twice"
+    assert len(set(successful_borrows)) == len(successful_borrows) == len(library.transactions), "Transaction ID reused"
+    assert sorted(library.transactions) == list(range(1, library.next_transaction_id)), "Transaction IDs have gaps"
+    assert library.get_status()['borrowed_books'] == len(open_loans) == len(library.book_loans), "Indexes out of step"
+    for member in library.get_all_members():
+        assert sorted(member.borrowed_books) == sorted(t.book_id for t in open_loans if t.member_id == member.member_id), "Member loans out of step"
+    print(f"✓ Stress test passed ({len(successful_borrows)} loans)")
+    
+    # Desks serving the same member on different books cannot beat the loan limit
+    limited = ConcurrentLibrary("Limit Test Library", stripes=8)
+    for book_id in range(1, 65):
+        limited.add_book(Book(book_id, f"Limit Book {book_id}", "Author", f"71{book_id:02d}", 2000))
+    limited.add_member(Member(1, "Limited Member", "limited@test.com", "555-8181", loan_limit=2))
+    limited.add_librarian(Librarian(1, "Limit Librarian", "limit@lib.com"))
+    held = []
+    def limited_desk(desk_id):
+        for round_number in range(40):
+            book_id = desk_id * 8 + round_number % 8 + 1
+            if round_number % 3:
+                limited.borrow_book(1, book_id, 1)
+            else:
+                limited.borrow_many([(1, book_id)], 1)
+            held.append(len(limited.members[1].borrowed_books))
+            limited.top_borrowers(1)
+            limited.query('transactions').where(F.member_id == 1).count()
+            if round_number % 4 == 3:
+                limited.return_many([(1, book) for book in list(limited.members[1].borrowed_books)])
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # switch threads as often as possible to expose races
+    try:
+        threads = [threading.Thread(target=limited_desk, args=(desk_id,)) for desk_id in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert max(held) <= 2, f"Loan limit broken: a member held {max(held)} books"
+    assert len(limited.book_loans) == len(limited.members[1].borrowed_books) <= 2, "Loans out of step"
+    print("✓ Concurrent loan limit passed")
+    print("Concurrent circulation tests passed! ✅")
+
+def test_library_server():
+    """Test the JSON-lines server with pipelined requests from two clients"""
+    print("\n=== Testing Library Server ===")
+    
+    async def scenario():
+        library = Library("Server Test Library")
+        save_path = os.path.join(tempfile.mkdtemp(), "served.json")
+        server = LibraryServer(library, port=0, save_path=save_path)
+        await server.start()
+        desk = await LibraryClient.connect(port=server.port)
+        kiosk = await LibraryClient.connect(port=server.port)
+        
+        # Pipelined requests are answered in order on one connection
+        await desk.call('add_librarian', librarian=Librarian(1, "Desk", "desk@lib.com").to_dict())
+        await desk.call('add_member', member=Member(1, "Remote Member", "remote@test.com", "555-1010").to_dict())
+        results = await asyncio.gather(*(
+            desk.call('add_book', book=Book(book_id, f"Remote Book {book_id}", "Author", f"80{book_id:02d}", 2001).to_dict())
+            for book_id in range(1, 51)))
+        assert results == [True] * 50, "Pipelined add_book failed"
+        print("✓ Pipelined requests passed")
+        
+        # Both clients see the same library
+        success, _ = await desk.call('borrow_book', member_id=1, book_id=7, librarian_id=1, borrow_date="2024-01-01T10:00:00")
+        assert success, "Remote borrow failed"
+        success, _ = await kiosk.call('borrow_book', member_id=1, book_id=7, librarian_id=1)
+        assert not success, "Book lent twice across clients"
+        assert (await kiosk.call('get_status'))['borrowed_books'] == 1, "Status not shared"
+        assert (await kiosk.call('get_active_transaction', book_id=7))['borrow_date'].startswith("2024-01-01"), "Date argument not decoded"
+        assert library.books[7].available is False, "Server library not updated"
+        print("✓ Shared state passed")
+        
+        # Bad requests get an error answer and leave the connection usable
+        try:
+            await desk.call('load_from_file', filename="x.json")
+            assert False, "Unlisted operation should be rejected"
+        except LibraryServerError as error:
+            assert "Unknown operation" in str(error)
+        try:
+            await desk.call('save_to_file', filename=os.path.join(tempfile.mkdtemp(), "anywhere.json"))
+            assert False, "Clients must not choose where files are written"
+        except LibraryServerError as error:
+            assert "Unknown operation" in str(error)
+        kiosk.writer.write(b"not json\n")
+        assert len(await kiosk.call('search_books', query="remote book 4")) > 0, "Connection unusable after bad line"
+        print("✓ Error responses passed")
+        
+        # Saves go only to the path the server was started with
+        assert await kiosk.call('save') is True, "Save failed"
+        restored = Library("Served Copy")
+        assert restored.load_from_file(save_path) and len(restored.books) == 50, "Save did not write the library"
+        unsaved = LibraryServer(Library("No Save Path"), port=0)
+        assert unsaved.handle_request({'id': 1, 'op': 'save'})['ok'] is False, "Save without a path should fail"
+        print("✓ Fixed save path passed")
+        
+        await desk.close()
+        await kiosk.close()
+        await server.close()
+    
+    asyncio.run(scenario())
+    print("Library server tests passed! ✅")
+
+def test_sharded_search():
+    """Test that a sharded catalogue ranks searches like a single index"""
+    print("\n=== Testing Sharded Search ===")
+    
+    plain = Library("Plain Library")
+    sharded = ShardedLibrary("Sharded Library", shards=3)
+    try:
+        authors = ["Ann Lee", "Leeann Ray", "Bo Ray", "Raymond Chan"]
+        for book_id in range(1, 121):
+            book = Book(book_id, f"Volume {book_id} of Rays", authors[book_id % 4], f"90{book_id:03d}", 1990)
+            plain.add_book(book)
+            sharded.add_book(Book.from_dict(book.to_dict()))
+        plain.remove_book(12)
+        sharded.remove_book(12)
+        
+        for query in ["ray", "lee", "volume 1", "90011", "chan", "nothing"]:
+            expected = [book.book_id for book in plain.search_books(query)]
+            assert [book.book_id for book in sharded.search_books(query)] == expected, f"Ranking differs for {query}"
+            assert [book.book_id for book in sharded.search_books(query, limit=5)] == expected[:5], f"Top-k differs for {query}"
+        assert 12 not in [book.book_id for book in sharded.search_books("volume 12")], "Removed book still found"
+        print("✓ Merged ranking passed")
+        
+        batches = sharded.search_many(["ann", "bo ray"], limit=3)
+        assert [[book.book_id for book in books] for books in batches] == [
+            [book.book_id for book in plain.search_books(query, limit=3)] for query in ["ann", "bo ray"]], "search_many mismatch"
+        print("✓ Batched search passed")
+        
+        # Loading replaces the shards' contents
+        filename = os.path.join(tempfile.mkdtemp(), "sharded.json")
+        plain.save_to_file(filename)
+        assert sharded.load_from_file(filename), "Sharded load failed"
+        assert len(sharded.search_index) == 119, "Shard sizes wrong after load"
+        assert [b.book_id for b in sharded.search_books("rays", limit=4)] == [b.book_id for b in plain.search_books("rays", limit=4)], "Search wrong after load"
+        print("✓ Reload passed")
+    finally:
+        sharded.close()
+    print("Sharded search tests passed! ✅")
+
+def test_member_loans():
+    """Test member loan sets, loan limits and the top-borrowers view"""
+    print("\n=== Testing Member Loans ===")
+    
+    library = create_library("Loan Limit Test Library")
+    library.add_librarian(Librarian(1, "Limit Librarian", "limit@lib.com"))
+    library.add_member(Member(1, "Casual Reader", "casual@test.com", "555-0001", loan_limit=2))
+    library.add_member(Member(2, "Village School", "school@test.com", "555-0002", loan_limit=10))
+    library.add_member(Member(3, "Book Club", "club@test.com", "555-0003"))
+    for book_id in range(1, 13):
+        library.add_book(Book(book_id, f"Loan Book {book_id}", "Author", f"60{book_id:02d}", 2010))
+    
+    # Member-level and library-wide limits
+    assert library.borrow_book(1, 1, 1)[0] and library.borrow_book(1, 2, 1)[0], "Borrow under limit failed"
+    success, message = library.borrow_book(1, 3, 1)
+    assert not success and message == "Member has reached the loan limit", "Member limit not enforced"
+    library.loan_limit = 3
+    results = library.borrow_many([(3, 3), (3, 4), (3, 5), (3, 6)], 1)
+    assert [r.success for r in results] == [True, True, True, False], "Limit not enforced within a batch"
+    assert results[3].error == "Member has reached the loan limit", "Wrong batch error"
+    for book_id in range(7, 13):
+        assert library.borrow_book(2, book_id, 1)[0], "Member limit should override library limit"
+    library.return_book(1, 1)
+    assert library.borrow_book(1, 1, 1)[0], "Returned book not freed against the limit"
+    print("✓ Loan limits passed")
+    
+    # Insertion order survives returns and the to_dict/from_dict round trip
+    library.return_book(2, 9)
+    assert list(library.members[2].borrowed_books) == [7, 8, 10, 11, 12], "Loan order lost"
+    data = library.members[2].to_dict()
+    assert data['borrowed_books'] == [7, 8, 10, 11, 12] and data['loan_limit'] == 10, "to_dict changed"
+    restored = Member.from_dict(data)
+    assert list(restored.borrowed_books) == [7, 8, 10, 11, 12] and restored.loan_limit == 10, "from_dict changed"
+    legacy = Member.from_dict({'member_id': 9, 'name': "Old", 'email': "old@test.com", 'phone': "555", 'borrowed_books': [4, 2]})
+    assert list(legacy.borrowed_books) == [4, 2] and legacy.loan_limit is None, "Old member records not readable"
+    print("✓ Loan set round trip passed")
+    
+    # Top borrowers follow borrows and returns
+    top = [(member.member_id, count) for member, count in library.top_borrowers(3)]
+    assert top == [(2, 5), (3, 3), (1, 2)], "Wrong top borrowers"
+    library.return_many([(2, 7), (2, 8), (2, 10)])
+    top = [(member.member_id, count) for member, count in library.top_borrowers(2)]
+    assert top == [(3, 3), (1, 2)], "Top borrowers not updated after returns"
+    print("✓ Top borrowers passed")
+    
+    print("Member loan tests passed! ✅")
+
+def test_binary_snapshot():
+    """Test saving a binary snapshot and opening it lazily"""
+    print("\n=== Testing Binary Snapshot ===")
+    
+    library = create_library("Snapshot Test Library")
+    library.add_librarian(Librarian(1, "Snap Librarian", "snap@lib.com"))
+    library.add_member(Member(1, "Snap Reader", "snap@test.com", "555-4040", loan_limit=5))
+    library.add_member(Member(2, "Ünïcode Reader", "uni@test.com", "555-5050"))
+    for book_id in range(1, 31):
+        library.add_book(Book(book_id, f"Snapshot Book {book_id}", f"Writer {book_id % 4}", f"0-306-40{book_id:03d}-X", 1980 + book_id))
+    start = datetime(2024, 3, 1)
+    library.borrow_book(1, 3, 1, start)
+    library.borrow_book(1, 5, 1, start)
+    library.borrow_book(2, 7, 1, start)
+    library.return_book(1, 5, start + timedelta(days=20))
+    
+    filename = os.path.join(tempfile.mkdtemp(), "library.snap")
+    library.save_snapshot(filename)
+    opened = Library("Empty")
+    assert opened.open_snapshot(filename), "Snapshot did not open"
+    assert not opened.open_snapshot(filename + ".missing"), "Missing snapshot should fail"
+    assert opened.name == "Snapshot Test Library" and opened.next_transaction_id == 4, "Metadata lost"
+    assert not opened.books.loaded and not opened.members.loaded, "Records built before use"
+    print("✓ Lazy open passed")
+    
+    # The SQLite backend imports a snapshot into its database
+    imported = SQLiteLibrary("Imported")
+    assert imported.open_snapshot(filename) and not imported.open_snapshot(filename + ".missing"), "Import failed"
+    for table in SECTIONS:
+        assert [r.to_dict() for r in getattr(imported, table).values()] == \
+            [r.to_dict() for r in getattr(library, table).values()], f"Imported {table} differ"
+    assert imported.get_status() == library.get_status() and imported.next_transaction_id == 4, "Import metadata lost"
+    assert not imported.borrow_book(2, 7, 1)[0] and imported.return_book(2, 7)[0], "Imported loans not live"
+    imported.close()
+    print("✓ SQLite snapshot import passed")
+    
+    # Records resolve on access and match the original
+    assert opened.books[7].to_dict() == library.books[7].to_dict(), "Book record differs"
+    assert opened.members[2].to_dict() == library.members[2].to_dict(), "Member record differs"
+    assert opened.get_all_transactions()[1].to_dict() == library.transactions[2].to_dict(), "Transaction differs"
+    assert opened.find_by_isbn("0306400070").book_id == 7, "ISBN index not mapped"
+    assert opened.get_status() == library.get_status(), "Counters differ"
+    assert [b.book_id for b in opened.search_books("snapshot book 1", limit=3)] == \
+        [b.book_id for b in library.search_books("snapshot book 1", limit=3)], "Search differs"
+    assert [m.member_id for m, _ in opened.top_borrowers()] == [1, 2], "Top borrowers differ"
+    print("✓ Record access passed")
+    
+    # The opened library keeps working as a normal one
+    assert opened.return_book(1, 3, start + timedelta(days=3))[0], "Return after open failed"
+    assert not opened.borrow_book(2, 7, 1)[0], "Open loan not indexed"
+    assert opened.add_book(Book(40, "Added Later", "New Writer", "999", 2024)), "Add after open failed"
+    assert not opened.add_book(Book(41, "Same ISBN", "Writer", "0-306-40007-X", 2024)), "Duplicate ISBN accepted"
+    assert opened.remove_book(30) and 30 not in opened.books and len(opened.books) == 30, "Remove after open failed"
+    assert opened.borrow_book(2, 40, 1, start)[0] and opened.next_transaction_id == 5, "Borrow after open failed"
+    assert [b.book_id for b in opened.search_books("added later")] == [40], "Search missed new book"
+    report = opened.overdue_report(as_of=start + timedelta(days=40))
+    assert sorted(report.transaction_ids) == [2, 3, 4], "Overdue report over mapped columns wrong"
+    print("✓ Changes after open passed")
+    
+    # Snapshots and JSON saved from an opened snapshot round-trip
+    opened.save_snapshot(filename)
+    reopened = Library("Empty")
+    assert reopened.open_snapshot(filename), "Re-save failed"
+    assert sorted(reopened.books) == sorted(opened.books) and len(reopened.transactions) == 4, "Re-saved snapshot differs"
+    assert list(reopened.members[2].borrowed_books) == [7, 40], "Member loans lost"
+    json_file = filename + ".json"
+    reopened.save_to_file(json_file)
+    loaded = Library("Empty")
+    assert loaded.load_from_file(json_file) and loaded.get_status() == reopened.get_status(), "JSON export differs"
+    print("✓ Round trip passed")
+    
+    print("Binary snapshot tests passed! ✅")
+
+def test_lazy_iteration():
+    """Test filtered, ordered and paged iteration over books, members and transactions"""
+    print("\n=== Testing Lazy Iteration ===")
+    
+    library = create_library("Iteration Test Library")
+    library.add_librarian(Librarian(1, "Iter Librarian", "iter@lib.com"))
+    for member_id in range(1, 6):
+        library.add_member(Member(member_id, f"Iter Member {member_id}", f"iter{member_id}@test.com", "555-3030"))
+    for book_id in range(1, 26):
+        library.add_book(Book(book_id, f"Iter Book {book_id}", "Author", f"50{book_id:02d}", 2000 + book_id))
+    start = datetime(2024, 5, 1)
+    for i in range(12):
+        library.borrow_book(i % 5 + 1, i + 1, 1, start + timedelta(days=11 - i))
+    for book_id in (2, 4, 6):
+        library.return_book((book_id - 1) % 5 + 1, book_id, start + timedelta(days=20))
+    
+    # Paging groups items without losing or repeating any
+    pages = list(library.iter_books(page_size=10))
+    assert [len(page) for page in pages] == [10, 10, 5], "Wrong page sizes"
+    assert [book.book_id for page in pages for book in page] == list(range(1, 26)), "Pages lost books"
+    assert [b.book_id for b in library.iter_books(filter=lambda b: b.publication_year > 2022)] == [23, 24, 25], "Filter wrong"
+    assert sorted(b.book_id for b in library.iter_books(available=False)) == [1, 3, 5, 7, 8, 9, 10, 11, 12], "Borrowed scan wrong"
+    assert len(list(library.iter_books(available=True))) == 16, "Available scan wrong"
+    assert [m.member_id for m in library.iter_members(filter=lambda m: len(m.borrowed_books) == 2)] == [1, 2, 3, 5], "Member filter wrong"
+    print("✓ Book and member iteration passed")
+    
+    # Ordering and filters over transactions
+    ids = [t.transaction_id for t in library.iter_transactions()]
+    assert ids == list(range(1, 13)), "Default order should be by ID"
+    by_date = [t.transaction_id for t in library.iter_transactions(order='borrow_date')]
+    assert by_date == list(range(12, 0, -1)), "borrow_date order wrong"
+    assert [t.transaction_id for t in library.iter_transactions(order='-borrow_date')] == ids, "Descending order wrong"
+    open_first = [t.transaction_id for t in library.iter_transactions(order='return_date')]
+    assert sorted(open_first[:9]) == [1, 3, 5, 7, 8, 9, 10, 11, 12] and open_first[9:] == [2, 4, 6], "Open loans should sort first"
+    pages = list(library.iter_transactions(filter=lambda t: t.member_id == 1, order='-due_date', page_size=2))
+    assert [[t.transaction_id for t in page] for page in pages] == [[1, 6], [11]], "Filtered pages wrong"
+    try:
+        library.iter_transactions(order='title')
+        assert False, "Unknown order should be rejected"
+    except ValueError:
+        pass
+    if backend == 'dict':
+        # Ties keep row order in both directions, with and without numpy
+        import transaction_store
+        store = TransactionStore(BorrowTransaction(i, i % 3, i % 4, 1, start + timedelta(days=i % 5)) for i in range(1, 40))
+        numpy = transaction_store.np
+        for transaction_store.np in (numpy, None):
+            for field in ('book_id', 'borrow_date', 'transaction_id'):
+                for reverse in (False, True):
+                    expected = sorted(store.values(), key=lambda t: getattr(t, field), reverse=reverse)
+                    assert [t.transaction_id for t in store.sorted_values(field, reverse)] == \
+                        [t.transaction_id for t in expected], f"Wrong {field} order"
+        transaction_store.np = numpy
+    print("✓ Transaction iteration passed")
+    
+    # Librarian reports stream through the same iterators
+    report = library.librarians[1].generate_report(library, "all", page_size=5)
+    assert [len(page) for page in report["transactions"]] == [5, 5, 2], "Report not paged"
+    assert sum(1 for _ in library.librarians[1].generate_report(library, "members")) == 5, "Member report wrong"
+    print("✓ Streaming reports passed")
+    
+    # Borrowing during a scan of available books neither breaks nor skips the scan
+    for book in library.iter_books(available=True):
+        if book.book_id > 20:
+            library.borrow_book(5, book.book_id, 1)  # changes the availability sets mid-scan
+    assert sorted(b.book_id for b in library.iter_books(available=False))[-5:] == [21, 22, 23, 24, 25], "Scan lost borrows"
+    for book_id in range(21, 26):
+        library.return_book(5, book_id)
+    
+    print("Lazy iteration tests passed! ✅")
+
+def test_query_engine():
+    """Test composable query filters, index-aware plans, ordering and limits"""
+    print("\n=== Testing Query Engine ===")
+    
+    library = create_library("Query Test Library")
+    library.add_librarian(Librarian(1, "Query Librarian", "query@lib.com"))
+    for member_id in range(1, 4):
+        library.add_member(Member(member_id, f"Query Member {member_id}", f"query{member_id}@test.com", "555-4040"))
+    authors = ["J.R.R. Tolkien", "Ursula K. Le Guin", "Terry Pratchett"]
+    for book_id in range(1, 31):
+        year = None if book_id == 30 else 1950 + book_id
+        library.add_book(Book(book_id, f"Query Book {book_id}", authors[book_id % 3], f"60{book_id:02d}", year))
+    for book_id in range(1, 10):
+        library.borrow_book(book_id % 3 + 1, book_id, 1, datetime(2024, 6, book_id))
+    library.return_book(2, 1, datetime(2024, 6, 20))
+    
+    # Every query agrees with a brute-force filter over the books
+    books = library.get_all_books()
+    predicates = [
+        F.author == "Terry Pratchett",
+        (F.author == "Terry Pratchett") & (F.publication_year > 1960) & (F.available == True),
+        F.publication_year.is_in([1955, 1956, 2100]),
+        F.title.contains("book 2"),
+        F.author.startswith("ursula") | (F.publication_year <= 1953),
+        ~(F.available == True) & (F.book_id != 5),
+        F.isbn == "6007",
+        F.publication_year >= 1975,
+    ]
+    for predicate in predicates:
+        expected = [book.book_id for book in books if predicate.matches(book)]
+        found = sorted(book.book_id for book in library.query('books').where(predicate))
+        assert found == expected, f"Wrong results for {predicate}"
+    assert library.query('books').where(F.author == "terry  pratchett").count() == 0, "Equality should be exact"
+    print("✓ Query results passed")
+    
+    # Plans name the index they use
+    query = library.query('books').where(F.author == "Terry Pratchett", F.publication_year > 1960)
+    if backend == 'dict':
+        assert query.explain().startswith("author index"), "Author index not used"
+        assert library.query('books').where(F.publication_year == 1970).explain().startswith("publication_year index")
+        assert library.query('books').where(F.available == False).explain().startswith("Availability set")
+        assert library.query('books').where(F.title.contains("7")).explain().startswith("Search index")
+        assert library.query('books').where(F.title.startswith("Query")).explain().startswith("Full scan of books")
+    else:
+        assert "books_author" in query.explain(), "Author index not used"
+    print("✓ Query plans passed")
+    
+    # Ordering, limits and the other tables
+    newest = library.query('books').where(F.author == "J.R.R. Tolkien").order_by('-publication_year').limit(3)
+    assert [book.book_id for book in newest] == [27, 24, 21], "Descending order wrong"
+    assert library.query('books').order_by('publication_year').all()[-1].book_id == 30, "Missing years should sort last"
+    assert library.query('books').where(F.publication_year > 2100).first() is None, "Empty query should have no first"
+    open_loans = library.query('transactions').where(F.is_returned == False).order_by('borrow_date')
+    assert [t.book_id for t in open_loans] == list(range(2, 10)), "Open loans wrong"
+    # Open loans of a removed book are still open transactions
+    library.remove_book(9)
+    scanned = [t.transaction_id for t in library.transactions.values() if not t.is_returned]
+    planned = [t.transaction_id for t in library.query('transactions').where(F.is_returned == False)]
+    assert sorted(planned) == sorted(scanned) and len(scanned) == 8, "Open-loan query differs from a scan"
+    first_open = library.query('transactions').where(F.is_returned == False, F.transaction_id == scanned[0])
+    assert [t.transaction_id for t in first_open] == scanned[:1], "Open-loan and key terms should combine"
+    member_loans = library.query('transactions').where(F.member_id == 2, F.borrow_date >= datetime(2024, 6, 2))
+    assert [t.book_id for t in member_loans] == [4, 7], "Transaction filter wrong"
+    assert library.query('members').where(F.member_id.is_in([2, 3])).count() == 2, "Member lookup wrong"
+    try:
+        library.query('shelves')
+        assert False, "Unknown table should be rejected"
+    except ValueError:
+        pass
+    print("✓ Query ordering and tables passed")
+    
+    print("Query engine tests passed! ✅")
+
+def test_range_queries():
+    """Test year ranges and author prefixes answered from the sorted indexes"""
+    print("\n=== Testing Range Queries ===")
+    
+    library = create_library("Range Test Library")
+    authors = ["Orwell, George", "Orczy, Emma", "Ondaatje, Michael", "O'Brien, Flann", "Austen, Jane"]
+    for book_id in range(1, 101):
+        year = None if book_id % 25 == 0 else 1850 + book_id
+        library.add_book(Book(book_id, f"Range Book {book_id}", authors[book_id % 5], f"70{book_id:03d}", year))
+    library.remove_book(60)
+    library.add_book(Book(101, "Range Book 101", "  ORWELL,   george ", "70101", 1905))
+    books = library.get_all_books()
+    
+    # Ranges and prefixes match a scan, missing years never match
+    predicates = [
+        (F.publication_year >= 1900) & (F.publication_year <= 1950),
+        (F.publication_year > 1900) & (F.publication_year < 1950) & (F.publication_year >= 1920),
+        F.publication_year < 1855,
+        (F.publication_year > 1930) & (F.publication_year <= 1930),
+        F.author.startswith("Or"),
+        F.author.startswith("o'b") & (F.publication_year > 1900),
+        F.author.startswith("orwell,   g"),
+    ]
+    for predicate in predicates:
+        expected = sorted(book.book_id for book in books if predicate.matches(book))
+        found = sorted(book.book_id for book in library.query('books').where(predicate))
+        assert found == expected, f"Wrong results for {predicate}"
+    assert library.query('books').where(F.publication_year >= 1905, F.publication_year <= 1905).count() == 2, "Added book missing"
+    assert library.query('books').where(F.publication_year == 1910).count() == 0, "Removed book still indexed"
+    print("✓ Range and prefix results passed")
+    
+    # Plans use one slice of the index for all bounds
+    plan = library.query('books').where(F.publication_year >= 1900, F.publication_year <= 1950).explain()
+    if backend == 'dict':
+        assert plan.startswith("publication_year range index") and "Filter" not in plan, "Year range not indexed"
+        assert library.query('books').where(F.author.startswith("Or")).explain().startswith("author prefix index")
+    else:
+        assert "books_year" in plan, "Year range not indexed"
+        assert "books_author_prefix" in library.query('books').where(F.author.startswith("Or")).explain()
+    print("✓ Range plans passed")
+    
+    print("Range query tests passed! ✅")
+
+def test_search_cache():
+    """Test cached search results, their invalidation and the cache statistics"""
+    print("\n=== Testing Search Cache ===")
+    
+    library = create_library("Cache Test Library")
+    library.add_librarian(Librarian(1, "Cache Librarian", "cache@lib.com"))
+    library.add_member(Member(1, "Cache Member", "cache@test.com", "555-5050"))
+    for book_id in range(1, 21):
+        library.add_book(Book(book_id, f"Cached Title {book_id}", "Cache Author", f"80{book_id:02d}", 2001))
+    assert library.search_cache_stats() is None, "Cache should be off by default"
+    library.enable_search_cache(capacity=2)
+    
+    # Repeated searches hit, and borrowed books show their current state
+    first = library.search_books("title 1", limit=5)
+    assert library.search_books("title 1", limit=5) == first, "Cached results differ"
+    library.borrow_book(1, first[0].book_id, 1)
+    again = library.search_books("title 1", limit=5)
+    assert [b.book_id for b in again] == [b.book_id for b in first] and not again[0].available, "Stale availability"
+    stats = library.search_cache_stats()
+    assert (stats['hits'], stats['misses'], stats['size']) == (2, 1, 1), "Wrong hit and miss counts"
+    
+    # Catalogue changes invalidate every cached result
+    library.add_book(Book(21, "Cached Title 1 Sequel", "Cache Author", "8021", 2002))
+    assert 21 in [b.book_id for b in library.search_books("title 1")], "New book missing after add"
+    library.remove_book(21)
+    assert 21 not in [b.book_id for b in library.search_books("title 1")], "Removed book still cached"
+    assert library.search_cache_stats()['invalidations'] == 1, "Stale entry not dropped"
+    
+    # Least recently used entries are evicted beyond capacity
+    library.search_books("title 2")
+    library.search_books("title 3")
+    library.search_books("title 1")
+    hits = library.search_cache_stats()['hits']
+    library.search_books("title 3")
+    stats = library.search_cache_stats()
+    assert stats['size'] == 2 and stats['evictions'] == 3 and stats['hits'] == hits + 1, "LRU eviction wrong"
+    print("✓ Cached search passed")
+    
+    # Entries expire after their time to live
+    now = [0.0]
+    cache = SearchCache(capacity=4, ttl=10, clock=lambda: now[0])
+    cache.put("key", 1, [1, 2])
+    assert cache.get("key", 1) == [1, 2] and cache.get("key", 2) is None, "Version check wrong"
+    cache.put("key", 1, [1, 2])
+    now[0] = 10.5
+    assert cache.get("key", 1) is None, "Expired entry served"
+    print("✓ Cache expiry passed")
+    
+    print("Search cache tests passed! ✅")
+
+def test_metrics():
+    """Test opt-in operation timing, table sizes and the Prometheus dump"""
+    print("\n=== Testing Metrics ===")
+    
+    library = create_library("Metrics Test Library")
+    assert library.metrics_snapshot() is None and library.metrics_text() is None, "Metrics should be off by default"
+    assert 'borrow_book' not in vars(library), "Disabled metrics should not wrap methods"
+    library.enable_metrics()
+    library.add_librarian(Librarian(1, "Metrics Librarian", "metrics@lib.com"))
+    library.add_member(Member(1, "Metrics Member", "metrics@test.com", "555-6060"))
+    for book_id in range(1, 6):
+        library.add_book(Book(book_id, f"Metered Book {book_id}", "Metrics Author", f"90{book_id:02d}", 2010))
+    library.borrow_book(1, 1, 1)
+    library.borrow_book(1, 1, 1)  # already borrowed
+    library.return_book(1, 1)
+    library.search_books("metered")
+    
+    # Calls, failures and latencies per operation
+    snapshot = library.metrics_snapshot()
+    operations = snapshot['operations']
+    assert (operations['borrow_book']['count'], operations['borrow_book']['errors']) == (2, 1), "Borrow counts wrong"
+    assert operations['add_book']['count'] == 5 and operations['return_book']['errors'] == 0, "Counts wrong"
+    assert sum(operations['search_books']['buckets'].values()) == 1, "Histogram should hold every call"
+    assert operations['search_books']['p99_seconds'] >= operations['search_books']['mean_seconds'], "Quantile wrong"
+    assert snapshot['tables'] == {'books': 5, 'members': 1, 'librarians': 1, 'transactions': 1, 'open_loans': 0}
+    print("✓ Metrics snapshot passed")
+    
+    # Prometheus text exposition
+    text = library.metrics_text()
+    assert '# TYPE library_operation_seconds histogram' in text, "Histogram type missing"
+    assert 'library_operation_seconds_count{library="Metrics Test Library",operation="borrow_book"} 2' in text
+    assert 'operation="borrow_book",le="+Inf"} 2' in text, "+Inf bucket should count every call"
+    assert 'library_table_rows{library="Metrics Test Library",table="books"} 5' in text, "Table gauge missing"
+    library.disable_metrics()
+    assert 'borrow_book' not in vars(library) and library.metrics_snapshot() is None, "Metrics not disabled"
+    print("✓ Prometheus dump passed")
+    
+    print("Metrics tests passed! ✅")
+
+def test_data_generator():
+    """Test that generated libraries are reproducible and internally consistent"""
+    print("\n=== Testing Data Generator ===")
+    
+    with tempfile.TemporaryDirectory() as directory:
+        first, second = os.path.join(directory, "first.json"), os.path.join(directory, "second.json")
+        LibraryGenerator(books=500, members=50, transactions=2000, seed=3).write(first)
+        LibraryGenerator(books=500, members=50, transactions=2000, seed=3).write(second)
+        with open(first, 'rb') as f, open(second, 'rb') as g:
+            assert f.read() == g.read(), "Same seed should give the same file"
+        
+        library = Library("Generated")
+        assert library.load_from_file(first), "Generated file did not load"
+    status = library.get_status()
+    assert (status['total_books'], status['total_members'], status['total_transactions']) == (500, 50, 2000)
+    open_loans = [t for t in library.transactions.values() if not t.is_returned]
+    assert len(open_loans) == status['borrowed_books'] == len(library.book_loans) == 100, "Open loans inconsistent"
+    assert all(t.book_id in library.members[t.member_id].borrowed_books for t in open_loans), "Member loans inconsistent"
+    assert all(library.find_by_isbn(book.isbn) is book for book in library.books.values()), "ISBNs should be unique"
+    dates = [t.borrow_date for t in library.transactions.values()]
+    assert dates == sorted(dates), "History should be in borrow order"
+    print("✓ Data generator passed")
+    
+    print("Data generator tests passed! ✅")
+
+def test_transaction_archive():
+    """Test moving old returned transactions into monthly archive segments"""
+    print("\n=== Testing Transaction Archive ===")
+    
+    library = create_library("Archive Test Library")
+    library.add_librarian(Librarian(1, "Archive Librarian", "archive@lib.com"))
+    library.add_member(Member(1, "Archive Member", "archive@test.com", "555-7070"))
+    for book_id in range(1, 5):
+        library.add_book(Book(book_id, f"Archived Book {book_id}", "Archive Author", f"95{book_id:02d}", 2000))
+    # Two loans a month from January to June 2023; book 4 is still out
+    for month in range(1, 7):
+        for book_id in (1, 2) if month % 2 else (3, 4):
+            library.borrow_book(1, book_id, 1, datetime(2023, month, 3))
+            if (month, book_id) != (6, 4):
+                library.return_book(1, book_id, datetime(2023, month, 20))
+    
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            library.archive_transactions(datetime(2023, 4, 1))
+            assert False, "Archiving needs a directory"
+        except ValueError:
+            pass
+        unarchived = os.path.join(directory, "unarchived.json")
+        library.save_to_file(unarchived)
+        moved = library.archive_transactions(datetime(2023, 4, 1), os.path.join(directory, "archive"))
+        assert moved == 6, "Wrong number archived"
+        assert library.archive.months() == ["2023-01", "2023-02", "2023-03"], "Wrong segments"
+        assert sorted(t.transaction_id for t in library.transactions.values()) == list(range(7, 13)), "Working set wrong"
+        assert library.get_active_transaction(4) is not None, "Open loan lost"
+        assert library.return_book(1, 4, datetime(2023, 7, 1))[0], "Open loan should still return"
+        assert library.archive_transactions(datetime(2023, 4, 1)) == 0, "Nothing more to archive"
+        print("✓ Archiving passed")
+        
+        # History reads the archive only when asked, and only the months in range
+        all_ids = [t.transaction_id for t in library.transaction_history()]
+        assert sorted(all_ids) == list(range(1, 13)), "History lost transactions"
+        recent = [t.transaction_id for t in library.transaction_history(include_archive=False)]
+        assert recent == list(range(7, 13)), "Working-set history wrong"
+        read = []
+        months = library.archive.read
+        library.archive.read = lambda month: read.append(month) or months(month)
+        february = [t.transaction_id for t in library.transaction_history(datetime(2023, 2, 1), datetime(2023, 3, 1))]
+        assert february == [3, 4] and read == ["2023-02"], "Range should read one segment"
+        member_history = library.transaction_history(filter=lambda t: t.book_id == 1)
+        assert [t.transaction_id for t in member_history] == [1, 5, 9], "Filtered history wrong"
+        print("✓ History queries passed")
+        
+        # A reopened archive serves the same history
+        saved = os.path.join(directory, "library.json")
+        library.save_to_file(saved)
+        restored = create_library("Restored Archive Library")
+        restored.load_from_file(saved)
+        assert len(restored.transactions) == 6, "Archived transactions were saved"
+        restored.open_archive(os.path.join(directory, "archive"))
+        assert len(list(restored.transaction_history())) == 12, "Reopened archive incomplete"
+        print("✓ Archive reopen passed")
+        
+        # Archiving again from a save made before the archive run adds no duplicate rows
+        stale = create_library("Stale Archive Library")
+        stale.load_from_file(unarchived)
+        stale.open_archive(os.path.join(directory, "archive"))
+        assert stale.archive_transactions(datetime(2023, 4, 1)) == 6, "Stale transactions not moved"
+        assert len(stale.archive) == 6, "Archive rows duplicated"
+        assert sorted(t.transaction_id for t in stale.transaction_history()) == list(range(1, 13)), "History duplicated"
+        print("✓ Repeated archive passed")
+    
+    print("Transaction archive tests passed! ✅")
+
+def test_incremental_saves():
+    """Test dirty tracking, delta files and merging them into the base"""
+    print("\n=== Testing Incremental Saves ===")
+    
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, "incremental.json")
+    library = Library("Incremental Library")
+    library.add_librarian(Librarian(1, "Delta Librarian", "delta@lib.com"))
+    library.add_member(Member(1, "Delta Member", "delta@test.com", "555-8080"))
+    for book_id in range(1, 21):
+        library.add_book(Book(book_id, f"Delta Book {book_id}", "Delta Author", f"96{book_id:02d}", 2000 + book_id))
+    assert library.save_incremental(filename) == filename, "First save should be a full save"
+    assert library.save_incremental(filename) is None, "Nothing changed since the last save"
+    
+    # Only the records touched since the last save go into the delta
+    library.borrow_book(1, 3, 1)
+    library.borrow_book(1, 4, 1)
+    library.return_book(1, 3)
+    library.remove_book(20)
+    library.add_book(Book(21, "New Delta Book", "Delta Author", "9621", 2021))
+    library.add_member(Member(2, "Second Member", "second@test.com", "555-8081"))
+    first = library.save_incremental(filename)
+    with open(first) as f:
+        delta = json.load(f)
+    assert sorted(r['book_id'] for r in delta['upsert']['books']) == [3, 4, 21], "Wrong books in delta"
+    assert sorted(r['member_id'] for r in delta['upsert']['members']) == [1, 2], "Wrong members in delta"
+    assert sorted(r['transaction_id'] for r in delta['upsert']['transactions']) == [1, 2], "Wrong transactions in delta"
+    assert 'librarians' not in delta['upsert'] and delta['delete'] == {'books': [20]}, "Unchanged sections written"
+    assert os.path.getsize(first) < os.path.getsize(filename), "Delta should be smaller than the base"
+    
+    # Deltas stack in order on top of the base
+    library.return_book(1, 4)
+    library.add_book(Book(20, "Replacement Book", "Delta Author", "9620", 2020))
+    second = library.save_incremental(filename)
+    assert second > first, "Deltas should be numbered in order"
+    
+    def same_state(restored):
+        assert sorted(restored.books) == sorted(library.books), "Books differ"
+        assert restored.books[20].title == "Replacement Book", "Re-added book lost"
+        assert restored.books[4].available and 4 in restored.available_ids, "Return lost"
+        assert sorted(restored.members) == [1, 2] and not restored.members[1].borrowed_books, "Members differ"
+        assert all(t.is_returned for t in restored.transactions.values()), "Transactions differ"
+        assert restored.next_book_id == library.next_book_id, "Next ids differ"
+    
+    restored = Library("Restored Library")
+    assert restored.load_from_file(filename), "Failed to load base and deltas"
+    same_state(restored)
+    assert len(restored.transactions) == 2, "Delta transactions lost"
+    assert len(list(restored.search_books("replacement"))) == 1, "Delta books not indexed"
+    print("✓ Delta save and load passed")
+    
+    # A reloaded library keeps saving deltas against the same base
+    restored.borrow_book(2, 5, 1)
+    third = restored.save_incremental(filename)
+    assert third > second, "Reloaded library should continue the delta sequence"
+    restored.return_book(2, 5)
+    restored.save_incremental(filename)
+    library = restored
+    
+    # Merging folds every delta into the base without changing what loads
+    assert library.merge_deltas() == 4, "Wrong number of deltas merged"
+    assert not [name for name in os.listdir(directory) if ".delta-" in name], "Deltas not removed"
+    merged = Library("Merged Library")
+    merged.load_from_file(filename)
+    same_state(merged)
+    assert len(merged.transactions) == 3, "Merged transactions lost"
+    print("✓ Delta merge passed")
+    
+    # A delta torn by a crash mid-write is ignored, then cleaned up by the next save
+    library.add_book(Book(23, "Torn Delta Book", "Delta Author", "9623", 2023))
+    torn = os.path.join(directory, "incremental.json.delta-000099.tmp")
+    with open(torn, "w") as f:
+        f.write('{"name": "Incremental Li')
+    assert Library("Torn").load_from_file(filename), "A torn delta should not block loading"
+    fourth = library.save_incremental(filename)
+    assert fourth.endswith(".delta-000001") and not os.path.exists(torn), "Torn delta not cleaned up"
+    reloaded = Library("Reloaded")
+    reloaded.load_from_file(filename)
+    assert 23 in reloaded.books, "Delta after a torn write lost"
+    library.remove_book(23)
+    
+    # A full save supersedes older deltas
+    library.add_book(Book(22, "Stale Delta Book", "Delta Author", "9622", 2022))
+    library.save_incremental(filename)
+    library.remove_book(22)
+    library.save_to_file(filename)
+    assert not [name for name in os.listdir(directory) if ".delta-" in name], "Full save left deltas behind"
+    other = os.path.join(directory, "other.json")
+    assert library.save_incremental(other) == other, "A new file needs a full save"
+    print("✓ Full save after deltas passed")
+    
+    # The SQLite backend loads deltas too, and its incremental saves are full exports
+    library.borrow_book(1, 5, 1)
+    library.remove_book(21)
+    library.save_incremental(other)
+    database = SQLiteLibrary("Delta Database")
+    assert database.load_from_file(other), "SQLite failed to load base and deltas"
+    assert sorted(database.books) == sorted(library.books), "SQLite ignored the delta"
+    assert database.get_active_transaction(5) is not None, "SQLite lost the delta loan"
+    exported = os.path.join(directory, "exported.json")
+    assert database.save_incremental(exported) == exported, "SQLite export failed"
+    assert database.merge_deltas(other) == 1, "Merge should work from any backend"
+    print("✓ SQLite delta load passed")
+    
+    print("Incremental save tests passed! ✅")
+
+def test_compact_format():
+    """Test compact saves with each installed codec"""
+    print("\n=== Testing Compact Format ===")
+    
+    library = create_library("Compact Library")
+    library.add_librarian(Librarian(1, "Compact Librarian", "compact@lib.com"))
+    library.add_member(Member(1, "Compact Member", "compact@test.com", "555-9090"))
+    library.add_member(Member(2, "Limited Member", "limited@test.com", "555-9091", loan_limit=1))
+    for book_id in range(1, 6):
+        library.add_book(Book(book_id, f"Compact Book {book_id} \u00e9t\u00e9", "Compact Author", f"97{book_id:02d}", 1990 + book_id))
+    library.borrow_book(1, 1, 1, datetime(2024, 3, 1, 9, 30))
+    library.return_book(1, 1, datetime(2024, 3, 10, 17, 45))
+    library.borrow_book(2, 2, 1, datetime(2024, 3, 5, 12, 0, 0, 250001))
+    
+    try:
+        library.set_codec("no-such-codec")
+        assert False, "Unknown codec should be rejected"
+    except ValueError:
+        pass
+    
+    def same_state(restored):
+        assert restored.name == library.name, "Name differs"
+        for table in SECTIONS:
+            expected = [record.to_dict() for record in getattr(library, table).values()]
+            assert [record.to_dict() for record in getattr(restored, table).values()] == expected, f"{table} differ"
+        assert restored.next_transaction_id == library.next_transaction_id, "Next ids differ"
+    
+    with tempfile.TemporaryDirectory() as directory:
+        indented = os.path.join(directory, "indented.json")
+        library.save_to_file(indented)
+        for name in available_codecs():
+            filename = os.path.join(directory, f"{name}.json")
+            assert library.set_codec(name).name == name, "Wrong codec chosen"
+            library.save_to_file(filename)
+            with open(filename) as f:
+                text = f.read()
+            data = json.loads(text)
+            assert "  " not in text and data["format"] == "compact-1", "Output should be compact"
+            borrowed = (datetime(2024, 3, 1, 9, 30) - datetime(1970, 1, 1)) // timedelta(microseconds=1)
+            assert data["transactions"][0][0][4] == borrowed, "Dates should be epoch microseconds"
+            assert os.path.getsize(filename) < os.path.getsize(indented), "Compact file should be smaller"
+            
+            restored = create_library(f"Restored {name}")
+            assert restored.load_from_file(filename), "Failed to load compact file"
+            same_state(restored)
+            assert restored.get_active_transaction(2) is not None, "Open loan not indexed"
+            assert restored.get_active_transaction(2).borrow_date.microsecond == 250001, "Microseconds lost"
+            active = create_library("Active Only")
+            active.load_from_file(filename, active_only=True)
+            assert [t.transaction_id for t in active.transactions.values()] == [2], "active_only ignored"
+            partial = create_library("Books Only")
+            partial.load_from_file(filename, sections=["books"])
+            assert len(partial.books) == 5 and not partial.members, "sections ignored"
+        print("✓ Compact save and load passed")
+        
+        # Files in the indented format still load, whatever codec is set
+        library.set_codec(None)
+        restored = create_library("Restored Indented")
+        restored.set_codec()
+        assert restored.load_from_file(indented), "Indented file should still load"
+        same_state(restored)
+        print("✓ Indented compatibility passed")
+        
+        # Binary snapshots keep microseconds too
+        snapshot = os.path.join(directory, "library.snap")
+        library.save_snapshot(snapshot)
+        restored = create_library("Restored Snapshot")
+        assert restored.open_snapshot(snapshot), "Failed to open snapshot"
+        same_state(restored)
+        print("✓ Microsecond round trip passed")
+        
+        if backend == 'dict':
+            # Deltas merge into a compact base without changing its format
+            filename = os.path.join(directory, "merged.json")
+            library.set_codec()
+            library.save_incremental(filename)
+            library.return_book(2, 2, datetime(2024, 3, 20))
+            library.add_book(Book(6, "Merged Compact Book", "Compact Author", "9706", 2000))
+            library.save_incremental(filename)
+            assert library.merge_deltas() == 1, "Delta not merged"
+            with open(filename) as f:
+                assert f.read().startswith('{"format":"compact-1"'), "Merge changed the format"
+            merged = Library("Merged")
+            merged.load_from_file(filename)
+            same_state(merged)
+            print("✓ Compact delta merge passed")
+    
+    print("Compact format tests passed! ✅")
+
 if __name__ == "__main__":
     try:
-        test_basic_functionality()
-        test_error_cases()
-        test_data_persistence()
-        test_transaction_functionality()
+        for backend in BACKENDS:
+            print(f"\n##### {backend} backend #####")
+            test_basic_functionality()
+            test_error_cases()
+            test_data_persistence()
+            test_transaction_functionality()
+            test_active_loan_index()
+            test_search_index()
+            test_isbn_lookup()
+            test_availability_tracking()
+            test_streaming_load()
+            test_overdue_report()
+            test_due_date_queue()
+            test_batch_operations()
+            test_member_loans()
+            test_binary_snapshot()
+            test_lazy_iteration()
+            test_query_engine()
+            test_range_queries()
+            test_search_cache()
+            test_metrics()
+            test_transaction_archive()
+            test_compact_format()
+        test_journal_persistence()
+        test_sqlite_reopen()
+        test_transaction_store()
+        test_concurrent_circulation()
+        test_library_server()
+        test_sharded_search()
+        test_data_generator()
+        test_incremental_saves()
         
         print("\n🎉 All tests passed successfully!")
         print("\nThe Library Management System is working correctly.")
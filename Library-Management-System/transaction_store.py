@@ -0,0 +1,250 @@
+from array import array
+from collections.abc import MutableMapping
+from itertools import chain
+from datetime import datetime, timedelta
+from borrow_transaction import BorrowTransaction
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; sorting falls back to a list of row numbers
+    np = None
+
+EPOCH = datetime(1970, 1, 1)
+NO_DATE = -(2 ** 63)  # stored in place of a missing return date
+DELETED = -1  # stored in the id column of a deleted row
+ONE_MICROSECOND = timedelta(microseconds=1)
+
+def to_epoch(date):
+    """Convert a naive datetime to microseconds since 1970-01-01, losing nothing"""
+    return (date - EPOCH) // ONE_MICROSECOND
+
+def from_epoch(microseconds):
+    """Convert microseconds since 1970-01-01 back to a naive datetime"""
+    return EPOCH + timedelta(microseconds=microseconds)
+
+def _column(name, decode=None, encode=None):
+    """Property reading and writing one column of a row, reporting writes to the store's on_change"""
+    def get(self):
+        value = getattr(self.store, name)[self.row]
+        return decode(value) if decode else value
+
+    def set(self, value):
+        store = self.store
+        getattr(store, name)[self.row] = encode(value) if encode else value
+        if store.on_change:
+            store.on_change(store.ids[self.row])
+    return property(get, set)
+
+# Transaction fields that can order a scan, and the column holding each
+ORDER_COLUMNS = {
+    'transaction_id': 'ids',
+    'book_id': 'book_ids',
+    'member_id': 'member_ids',
+    'borrow_date': 'borrow_dates',
+    'due_date': 'due_dates',
+    'return_date': 'return_dates',
+}
+
+def _argsort(column, reverse):
+    """Positions of an int64 column in stable ascending or descending order, as a numpy array"""
+    values = np.fromiter(column, dtype=np.int64, count=len(column))
+    if not reverse:
+        return np.argsort(values, kind='stable')
+    # Stable descending order: sort the reversed column, then map positions back
+    return len(values) - 1 - np.argsort(values[::-1], kind='stable')[::-1]
+
+class MappedColumn:
+    """int64 column over a fixed buffer such as a memory-mapped file, with appended values in an array"""
+
+    def __init__(self, base):
+        self.base = base
+        self.tail = array('q')
+
+    def __len__(self):
+        return len(self.base) + len(self.tail)
+
+    def __getitem__(self, i):
+        size = len(self.base)
+        return self.base[i] if i < size else self.tail[i - size]
+
+    def __setitem__(self, i, value):
+        size = len(self.base)
+        if i < size:
+            self.base[i] = value
+        else:
+            self.tail[i - size] = value
+
+    def __iter__(self):
+        return chain(self.base, self.tail)
+
+    def append(self, value):
+        self.tail.append(value)
+
+class TransactionRow(BorrowTransaction):
+    """A BorrowTransaction that reads and writes one row of a TransactionStore"""
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    transaction_id = property(lambda self: self.store.ids[self.row])
+    book_id = _column('book_ids')
+    member_id = _column('member_ids')
+    librarian_id = _column('librarian_ids')
+    borrow_date = _column('borrow_dates', from_epoch, to_epoch)
+    due_date = _column('due_dates', from_epoch, to_epoch)
+
+    @property
+    def return_date(self):
+        microseconds = self.store.return_dates[self.row]
+        return None if microseconds == NO_DATE else from_epoch(microseconds)
+
+    @return_date.setter
+    def return_date(self, value):
+        store = self.store
+        store.return_dates[self.row] = NO_DATE if value is None else to_epoch(value)
+        if store.on_change:
+            store.on_change(store.ids[self.row])
+
+    @property
+    def is_returned(self):
+        return self.store.return_dates[self.row] != NO_DATE
+
+    def __eq__(self, other):
+        return isinstance(other, TransactionRow) and other.store is self.store and other.row == self.row
+
+    def __hash__(self):
+        return hash((id(self.store), self.row))
+
+class TransactionStore(MutableMapping):
+    """Transaction history kept in parallel int64 columns, with dates as epoch microseconds.
+
+    It behaves like the {transaction_id: BorrowTransaction} dict it replaces,
+    but each record costs a few machine words instead of a Python object and
+    three datetimes. Lookups return TransactionRow views over the columns.
+    """
+
+    def __init__(self, transactions=()):
+        self.ids = array('q')
+        self.book_ids = array('q')
+        self.member_ids = array('q')
+        self.librarian_ids = array('q')
+        self.borrow_dates = array('q')
+        self.due_dates = array('q')
+        self.return_dates = array('q')
+        self.positions = None  # {transaction_id: row} once ids stop being consecutive
+        self.count = 0
+        self.on_change = None  # Called with the transaction_id of each row written
+        for transaction in transactions:
+            self[transaction.transaction_id] = transaction
+
+    @classmethod
+    def from_columns(cls, columns, dense=True):
+        """Wrap existing columns of live rows, given in the order of self.ids ... self.return_dates"""
+        store = cls()
+        (store.ids, store.book_ids, store.member_ids, store.librarian_ids,
+         store.borrow_dates, store.due_dates, store.return_dates) = columns
+        store.count = len(store.ids)
+        if not dense:
+            store.positions = {transaction_id: row for row, transaction_id in enumerate(store.ids)}
+        return store
+
+    def _row(self, transaction_id):
+        """Return the row holding a transaction, or None"""
+        if self.positions is not None:
+            return self.positions.get(transaction_id)
+        if not self.ids or not isinstance(transaction_id, int):
+            return None
+        row = transaction_id - self.ids[0]
+        if 0 <= row < len(self.ids) and self.ids[row] == transaction_id:
+            return row
+        return None
+
+    def __getitem__(self, transaction_id):
+        row = self._row(transaction_id)
+        if row is None:
+            raise KeyError(transaction_id)
+        return TransactionRow(self, row)
+
+    def __setitem__(self, transaction_id, transaction):
+        row = self._row(transaction_id)
+        if row is not None:
+            self._write(row, transaction)
+            if self.on_change:
+                self.on_change(transaction_id)
+            return
+        row = len(self.ids)
+        if self.positions is None and self.ids and transaction_id != self.ids[0] + row:
+            self.positions = {tid: i for i, tid in enumerate(self.ids) if tid != DELETED}
+        self.ids.append(transaction_id)
+        for column in (self.book_ids, self.member_ids, self.librarian_ids,
+                       self.borrow_dates, self.due_dates, self.return_dates):
+            column.append(0)
+        self._write(row, transaction)
+        if self.positions is not None:
+            self.positions[transaction_id] = row
+        self.count += 1
+        if self.on_change:
+            self.on_change(transaction_id)
+
+    def _write(self, row, transaction):
+        self.book_ids[row] = transaction.book_id
+        self.member_ids[row] = transaction.member_id
+        self.librarian_ids[row] = transaction.librarian_id
+        self.borrow_dates[row] = to_epoch(transaction.borrow_date)
+        self.due_dates[row] = to_epoch(transaction.due_date)
+        self.return_dates[row] = NO_DATE if transaction.return_date is None else to_epoch(transaction.return_date)
+
+    def __delitem__(self, transaction_id):
+        row = self._row(transaction_id)
+        if row is None:
+            raise KeyError(transaction_id)
+        if self.positions is None:
+            self.positions = {tid: i for i, tid in enumerate(self.ids) if tid != DELETED}
+        del self.positions[transaction_id]
+        self.ids[row] = DELETED
+        self.count -= 1
+
+    def __contains__(self, transaction_id):
+        return self._row(transaction_id) is not None
+
+    def __iter__(self):
+        for transaction_id in self.ids:
+            if transaction_id != DELETED:
+                yield transaction_id
+
+    def __len__(self):
+        return self.count
+
+    def values(self):
+        for row, transaction_id in enumerate(self.ids):
+            if transaction_id != DELETED:
+                yield TransactionRow(self, row)
+
+    def open_values(self):
+        """Yield the rows of loans not yet returned, checking only the return date column"""
+        ids = self.ids
+        for row, returned in enumerate(self.return_dates):
+            if returned == NO_DATE and ids[row] != DELETED:
+                yield TransactionRow(self, row)
+
+    def sorted_values(self, field, reverse=False):
+        """Yield rows ordered by a field, ties in row order, sorting row numbers rather than rows.
+
+        A dense store already holds its rows in transaction_id order, so that
+        order is streamed without sorting. Other orders sort one int64 row
+        number per row, in a numpy array when numpy is installed. Open loans
+        have no return date and sort first by return_date.
+        """
+        ids = self.ids
+        column = getattr(self, ORDER_COLUMNS[field])
+        if field == 'transaction_id' and self.positions is None:
+            rows = range(len(ids) - 1, -1, -1) if reverse else range(len(ids))
+        elif np is not None:
+            rows = map(int, _argsort(column, reverse))
+        else:
+            rows = sorted(range(len(ids)), key=column.__getitem__, reverse=reverse)
+        for row in rows:
+            if ids[row] != DELETED:
+                yield TransactionRow(self, row)